@@ -0,0 +1,231 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, Optional, Sequence, Tuple
+
+from langchain_core.caches import BaseCache
+from langchain_core.load import dumps, loads
+
+from civic_chat.env import CACHE_FILE, CACHE_TTL, SHARED_CACHE_FILE
+from civic_chat.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+#
+# A cache of tool results, keyed by the normalized query text.
+# Values are stored as JSON text so callers that mutate results (several tools del or extend what they get back)
+# can never corrupt a cached entry, and so the whole cache can be written to disk as-is.
+#
+
+
+class ToolCache:
+    def __init__(self, ttl: Optional[float] = CACHE_TTL, path: Optional[str] = None):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: Dict[str, Tuple[float, str]] = {}
+        self._lock = threading.Lock()
+        # A file saved by save(), loaded on first use rather than on import, since most imports never touch the cache.
+        self._path = path
+        self._loaded = path is None
+        self._load_lock = threading.RLock()
+
+    def _load_once(self):
+        if self._loaded:
+            return
+        with self._load_lock:
+            # Loading calls back in here through set(), which then finds no path left to load.
+            path, self._path = self._path, None
+            if path is not None:
+                try:
+                    self.load(path)
+                finally:
+                    self._loaded = True
+
+    def get(self, key: str) -> Optional[str]:
+        self._load_once()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl is not None and time.time() - entry[0] > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: str, value: str, created: Optional[float] = None):
+        self._load_once()
+        with self._lock:
+            self._entries[key] = (created if created is not None else time.time(), value)
+
+    def items(self) -> Iterable[Tuple[str, Tuple[float, str]]]:
+        self._load_once()
+        with self._lock:
+            return list(self._entries.items())
+
+    def update(self, entries: Iterable[Tuple[str, Tuple[float, str]]]):
+        for key, (created, value) in entries:
+            self.set(key, value, created)
+
+    def clear(self):
+        self._load_once()
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        self._load_once()
+        return len(self._entries)
+
+    def load(self, path: str = CACHE_FILE):
+        """Merge entries from a file written by save(), skipping any that have already expired.
+
+        A file that cannot be read, such as one cut short by a full disk, is skipped with a warning.
+        """
+        if not os.path.exists(path):
+            return
+        now = time.time()
+        try:
+            with open(path) as f:
+                entries = [
+                    (key, (created, value)) for key, (created, value) in json.load(f).items()
+                    if self.ttl is None or now - created <= self.ttl
+                ]
+        except (OSError, ValueError, TypeError, AttributeError) as e:
+            logger.warning("ignoring the tool cache in %s, which could not be read: %s", path, e)
+            return
+        self.update(entries)
+
+    def save(self, path: str = CACHE_FILE):
+        """Write all entries to a file, atomically so a reader never sees a partial cache."""
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmp_path, "w") as f:
+            json.dump(dict(self.items()), f)
+        os.replace(tmp_path, path)
+
+
+#
+# A cache several processes share through one SQLite file in WAL mode: readers never block, and SQLite's file locks
+# serialize the writers.  Each kind of entry (tool results, search results, schemas, LLM responses) is a namespace
+# in the same table, so one file serves them all.  A process opens its own connection per thread, including after
+# a fork, since SQLite connections must not cross either.
+#
+
+# How long a writer waits for another process to finish writing, in milliseconds.
+SHARED_CACHE_BUSY_TIMEOUT = 10000
+
+
+class SharedCache(ToolCache):
+    def __init__(self, namespace: str, path: str = SHARED_CACHE_FILE, ttl: Optional[float] = CACHE_TTL):
+        super().__init__(ttl)
+        self.namespace = namespace
+        self.path = path
+        self._local = threading.local()
+        with self._db() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                " namespace TEXT NOT NULL, key TEXT NOT NULL, created REAL NOT NULL, value TEXT NOT NULL,"
+                " PRIMARY KEY (namespace, key))"
+            )
+
+    def _db(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            db = sqlite3.connect(self.path, timeout=SHARED_CACHE_BUSY_TIMEOUT / 1000)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute("PRAGMA busy_timeout=%d" % SHARED_CACHE_BUSY_TIMEOUT)
+            self._local.db = db
+            self._local.pid = os.getpid()
+        return db
+
+    def get(self, key: str) -> Optional[str]:
+        row = self._db().execute(
+            "SELECT created, value FROM cache WHERE namespace = ? AND key = ?", (self.namespace, key)
+        ).fetchone()
+        if row is not None and self.ttl is not None and time.time() - row[0] > self.ttl:
+            with self._db() as db:
+                db.execute("DELETE FROM cache WHERE namespace = ? AND key = ? AND created = ?", (self.namespace, key, row[0]))
+            row = None
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return row[1]
+
+    def set(self, key: str, value: str, created: Optional[float] = None):
+        with self._db() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO cache (namespace, key, created, value) VALUES (?, ?, ?, ?)",
+                (self.namespace, key, created if created is not None else time.time(), value),
+            )
+
+    def items(self) -> Iterable[Tuple[str, Tuple[float, str]]]:
+        rows = self._db().execute("SELECT key, created, value FROM cache WHERE namespace = ?", (self.namespace,))
+        return [(key, (created, value)) for key, created, value in rows]
+
+    def update(self, entries: Iterable[Tuple[str, Tuple[float, str]]]):
+        with self._db() as db:
+            db.executemany(
+                "INSERT OR REPLACE INTO cache (namespace, key, created, value) VALUES (?, ?, ?, ?)",
+                [(self.namespace, key, created, value) for key, (created, value) in entries],
+            )
+
+    def clear(self):
+        with self._db() as db:
+            db.execute("DELETE FROM cache WHERE namespace = ?", (self.namespace,))
+
+    def __len__(self):
+        return self._db().execute("SELECT COUNT(*) FROM cache WHERE namespace = ?", (self.namespace,)).fetchone()[0]
+
+
+llm_cache_lookups = registry.counter(
+    "civic_chat_llm_cache_lookups_total", "LLM response cache lookups, by whether they hit.", ["outcome"]
+)
+
+
+class LLMCache(BaseCache):
+    """Serves LangChain's LLM cache from a ToolCache, such as a SharedCache, so processes share LLM responses."""
+
+    def __init__(self, cache: ToolCache):
+        self.cache = cache
+
+    @staticmethod
+    def _key(prompt: str, llm_string: str) -> str:
+        return json.dumps([llm_string, prompt])
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[Sequence[Any]]:
+        value = self.cache.get(self._key(prompt, llm_string))
+        llm_cache_lookups.inc(outcome="miss" if value is None else "hit")
+        return [loads(generation) for generation in json.loads(value)] if value is not None else None
+
+    def update(self, prompt: str, llm_string: str, return_val: Sequence[Any]):
+        self.cache.set(self._key(prompt, llm_string), json.dumps([dumps(generation) for generation in return_val]))
+
+    def clear(self, **kwargs: Any):
+        self.cache.clear()
+
+
+def use_shared_cache(path: str = SHARED_CACHE_FILE, llm: bool = True):
+    """Switch this process to the cache shared with other processes, for tool results, schemas, searches and LLM calls."""
+    from langchain_core.globals import set_llm_cache
+    from civic_chat.tools.civic_db_gql import civic_tool
+    from civic_chat.tools.duckduckgo_search import SEARCH_CACHE_TTL, duckduckgo
+    from civic_chat.tools.starwars_gql import starwars_tool
+
+    for gql_tool in [civic_tool, starwars_tool]:
+        gql_tool.graphql_wrapper.cache = SharedCache("graphql", path)
+    duckduckgo.cache = SharedCache("search", path, ttl=SEARCH_CACHE_TTL)
+    if llm:
+        set_llm_cache(LLMCache(SharedCache("llm", path)))
+
+
+# The shared cache for the CIViC tools, pre-populated by anything the warm-up command saved.
+tool_cache = ToolCache(path=CACHE_FILE)
@@ -0,0 +1,172 @@
+import copy
+import gzip
+import hashlib
+import json
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import BaseMessage, message_to_dict, messages_from_dict
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.runnables import RunnableBinding
+
+#
+# Record every LLM call and GraphQL request of a run into a cassette file, and play them back later with no model
+# and no network, either at the recorded pace or with no delay at all.  This makes slow or failing runs repeatable
+# offline, and gives benchmarks the same traffic every time.
+#
+# Exchanges are matched on a hash of the request, and repeated identical requests replay in the order they were
+# recorded.  A cassette is gzipped JSON lines, one exchange per line.
+#
+
+
+class CassetteMiss(KeyError):
+    """A replayed run made a request that was not recorded."""
+
+
+def _request_key(kind: str, request: Any) -> str:
+    text = json.dumps(request, sort_keys=True, default=str)
+    return kind + ":" + hashlib.sha1(text.encode()).hexdigest()
+
+
+class Cassette:
+    def __init__(self, path: str, mode: str = "replay", realtime: bool = True):
+        if mode not in ("record", "replay"):
+            raise ValueError("mode must be record or replay, not %r" % mode)
+        self.path = path
+        self.mode = mode
+        self.realtime = realtime
+        self.exchanges: List[dict] = []
+        self._unplayed: Dict[str, Deque[dict]] = defaultdict(deque)
+        self._lock = threading.Lock()
+        if mode == "replay":
+            self.load()
+
+    def load(self):
+        with gzip.open(self.path, "rt") as f:
+            self.exchanges = [json.loads(line) for line in f]
+        for exchange in self.exchanges:
+            self._unplayed[exchange["key"]].append(exchange)
+
+    def save(self):
+        with gzip.open(self.path, "wt") as f:
+            for exchange in self.exchanges:
+                f.write(json.dumps(exchange, separators=(",", ":"), default=str) + "\n")
+
+    def play(self, kind: str, request: Any, call: Callable[[], Any], note: Optional[str] = None) -> Any:
+        """Record what call() returns for a request, or return what was recorded for it."""
+        key = _request_key(kind, request)
+        if self.mode == "record":
+            t0 = time.time()
+            response = call()
+            # Callers are free to change what they get back, so the cassette keeps its own copy.
+            exchange = {"key": key, "elapsed": round(time.time() - t0, 4), "response": copy.deepcopy(response)}
+            if note:
+                exchange["note"] = note
+            with self._lock:
+                self.exchanges.append(exchange)
+            return response
+        with self._lock:
+            unplayed = self._unplayed.get(key)
+            if not unplayed:
+                raise CassetteMiss("%s request not in %s: %s" % (kind, self.path, note or key))
+            exchange = unplayed.popleft()
+        if self.realtime:
+            time.sleep(exchange["elapsed"])
+        return copy.deepcopy(exchange["response"])
+
+    def graphql(self, query: str, fetch: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+        return self.play("graphql", " ".join(query.split()), fetch, note=" ".join(query.split())[:200])
+
+    @property
+    def unplayed(self) -> int:
+        return sum(len(exchanges) for exchanges in self._unplayed.values())
+
+    def __str__(self):
+        if self.mode == "record":
+            return f"{len(self.exchanges)} exchanges recorded to {self.path}"
+        return f"{len(self.exchanges) - self.unplayed} of {len(self.exchanges)} exchanges replayed from {self.path}"
+
+
+class CassetteChatModel(BaseChatModel):
+    """Wraps a chat model to record its responses to a cassette, or to answer from the cassette without it."""
+
+    llm: BaseChatModel
+    cassette: Any
+
+    @property
+    def _llm_type(self) -> str:
+        return "cassette-" + self.llm._llm_type
+
+    def bind_tools(self, tools, **kwargs):
+        # Let the wrapped model format the tools the way its API expects, and pass them through on each call.
+        return RunnableBinding(bound=self, kwargs=self.llm.bind_tools(tools, **kwargs).kwargs)
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None,
+                  **kwargs: Any) -> ChatResult:
+        # Message ids are assigned per run, so they are left out of the match.
+        message_dicts = [message_to_dict(m) for m in messages]
+        for d in message_dicts:
+            d["data"] = {k: v for k, v in d["data"].items() if k != "id"}
+        request = {"messages": message_dicts, "stop": stop, "kwargs": kwargs}
+
+        def call():
+            result = self.llm._generate(messages, stop=stop, **kwargs)
+            return {
+                "messages": [message_to_dict(g.message) for g in result.generations],
+                "llm_output": result.llm_output,
+            }
+
+        response = self.cassette.play("llm", request, call)
+        return ChatResult(
+            generations=[ChatGeneration(message=m) for m in messages_from_dict(response["messages"])],
+            llm_output=response["llm_output"],
+        )
+
+
+def _clear_indexes():
+    from civic_chat.tools.civic_disease_index import disease_index_source
+    from civic_chat.tools.civic_profile_index import profile_index_source
+
+    profile_index_source.clear()
+    disease_index_source.clear()
+
+
+def attach_cassette(cassette: Cassette) -> List[Tuple[Any, Any, Any]]:
+    """Route the GraphQL tools through a cassette.  Caches are bypassed or emptied so every request reaches it.
+
+    Returns the (wrapper, cassette, cache) each wrapper had before, for detach_cassette.
+    """
+    from civic_chat.tools.civic_db_gql import civic_tool
+    from civic_chat.tools.starwars_gql import starwars_tool
+
+    previous = []
+    for gql_tool in [civic_tool, starwars_tool]:
+        wrapper = gql_tool.graphql_wrapper
+        previous.append((wrapper, wrapper.cassette, wrapper.cache))
+        wrapper.cassette = cassette
+        wrapper.cache = None
+    _clear_indexes()
+    return previous
+
+
+def detach_cassette(previous: List[Tuple[Any, Any, Any]]):
+    """Put back the cassettes and caches attach_cassette replaced."""
+    for wrapper, cassette, cache in previous:
+        wrapper.cassette = cassette
+        wrapper.cache = cache
+    # The indexes were built from what the cassette played.
+    _clear_indexes()
+
+
+@contextmanager
+def cassette_attached(cassette: Cassette) -> Iterator[Cassette]:
+    """Route the GraphQL tools through a cassette for the duration of a with block."""
+    previous = attach_cassette(cassette)
+    try:
+        yield cassette
+    finally:
+        detach_cassette(previous)
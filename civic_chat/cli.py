@@ -1,21 +1,57 @@
 import time
 
+import httpx
 from langchain_core.messages import HumanMessage, SystemMessage
 from langchain.agents import AgentType, initialize_agent, AgentExecutor
 
+from langchain_ollama import ChatOllama
 from langgraph.prebuilt import create_react_agent
 from langgraph.graph.graph import CompiledGraph
 
+from civic_chat.cassette import Cassette, CassetteChatModel, attach_cassette, detach_cassette
+from civic_chat.deadline import Deadline, best_effort_answer, with_timeouts
+from civic_chat.encode import with_encodings
+from civic_chat.env import METRICS_FILE, QUESTION_STEP_BUDGET, QUESTION_TIME_BUDGET
+from civic_chat.llm.ollama import ModelDoesNotFit, OllamaModelManager
+from civic_chat.metrics import agent_metrics, registry
+from civic_chat.profiling import MemoryProfiler
+from civic_chat.session import session_frames
+from civic_chat.tools._args import tool_arg_stats
+from civic_chat.tools.civic_prefetch import prefetcher
 from civic_chat.tools.duckduckgo_search import duckduckgo_tool
-from civic_chat.tools.python_repl import python_repl_tool
+from civic_chat.tools.python_repl import python_repl, python_repl_tool
+
+
+def create_agent_executor(tools: list, llm, verbose: bool = True, deadline: Deadline = None) -> AgentExecutor:
+    # The ReAct agent behind the CLI, also used by anything else that drives the agent, like the load tester.
+    # It stops at the step budget, or once the time budget less its reserve is spent, and then has the LLM answer from
+    # the steps so far.  Tool calls are cut short at the deadline of the question being answered, and their results
+    # reach the LLM in the compact encoding chosen for each tool.
+    # Tools taking several typed arguments need the structured chat agent, where each action input is a JSON object.
+    deadline = deadline or Deadline()
+    if any(len(tool.args) > 1 for tool in tools):
+        agent_type = AgentType.STRUCTURED_CHAT_ZERO_SHOT_REACT_DESCRIPTION
+    else:
+        agent_type = AgentType.ZERO_SHOT_REACT_DESCRIPTION
+    return initialize_agent(
+        with_timeouts(with_encodings(tools)), llm, agent=agent_type, verbose=verbose,
+        handle_parsing_errors=True, max_iterations=deadline.max_steps, max_execution_time=deadline.working_time,
+        early_stopping_method="generate",
+    )
 
 
 def create_single_inference_cli(tools: list, sys_msg: SystemMessage, user_msg: HumanMessage):
 
-    def cli(graph: bool = False, search: bool = False, code: bool = False, debug: bool = False, verbose: bool = False):
+    def cli(graph: bool = False, search: bool = False, code: bool = False, debug: bool = False, verbose: bool = False,
+            profile_memory: bool = False, record: str = "", replay: str = "", zero_latency: bool = False,
+            time_budget: float = QUESTION_TIME_BUDGET, step_budget: int = QUESTION_STEP_BUDGET):
         """ The single inference CLI just processes one set of messages and prints the output.
+        --record FILE saves every LLM and GraphQL exchange to a cassette, and --replay FILE plays one back offline,
+        at the recorded pace or with --zero-latency.
+        --time-budget SECONDS and --step-budget STEPS limit the question; when either runs out, the answer is the best
+        the LLM can give from what it found so far.
         """
-        print(f'app: {graph} search {search} code: {code} debug {debug} verbose: {verbose}')
+        print(f'app: {graph} search {search} code: {code} debug {debug} verbose: {verbose} profile_memory: {profile_memory}')
         nonlocal tools
         if search or code:
             tools = tools.copy()
@@ -23,46 +59,93 @@ def create_single_inference_cli(tools: list, sys_msg: SystemMessage, user_msg: H
                 tools.append(duckduckgo_tool)
             if code:
                 tools.append(python_repl_tool)
+                # Start the REPL's fork server and spare workers now, so the first call does not wait for them.
+                python_repl.start()
+                # Keep what the tools fetch, for the REPL to analyse.
+                session_frames.enabled = True
 
         from .llm_client import llm
 
+        if isinstance(llm, ChatOllama) and not replay:
+            # Load the local model before the first question, and keep it loaded for the whole run.
+            ollama_manager = OllamaModelManager.for_chat_model(llm)
+            print(f"Ollama: {ollama_manager.server_env()}")
+            try:
+                print(f"Ollama: {ollama_manager.warm()}")
+            except (ModelDoesNotFit, httpx.HTTPError, ValueError) as e:
+                # The question still runs; the model loads on its first request, or the request reports the problem.
+                print(f"Ollama: not warmed up: {type(e).__name__}: {e}")
+
+        cassette = None
+        if record or replay:
+            cassette = Cassette(record or replay, mode="record" if record else "replay", realtime=not zero_latency)
+            replaced = attach_cassette(cassette)
+            llm = CassetteChatModel(llm=llm, cassette=cassette)
+
         messages = [sys_msg, user_msg]
 
         print(f"Sys Message: {sys_msg}")
         print(f"User Message: {user_msg}")
         print(f"Tools: {[t.name for t in tools]}")
         print(f"LLM: {llm}")
+
+        deadline = Deadline(seconds=time_budget, max_steps=step_budget)
+        callbacks = [deadline, agent_metrics]
+        if profile_memory:
+            memory_profiler = MemoryProfiler()
+            memory_profiler.start()
+            callbacks.append(memory_profiler)
+
         t0 = time.time()
         try:
-            if graph:
-                from langchain.globals import set_verbose, set_debug
-                set_verbose(verbose)
-                set_debug(debug)
-                graph: CompiledGraph = create_react_agent(model=llm, tools=tools)
-                stream = graph.stream(
-                    input={"messages": messages},
-                    config={"configurable": {"thread_id": 42}},
-                    stream_mode="values"
-                )
-                from langchain_core.messages.base import BaseMessage
-                for s in stream:
-                    message: BaseMessage = s["messages"][-1]
-                    if isinstance(message, tuple):
-                        print(message)
+            with deadline:
+                if graph:
+                    from langchain.globals import set_verbose, set_debug
+                    from langgraph.errors import GraphRecursionError
+                    set_verbose(verbose)
+                    set_debug(debug)
+                    tools = with_timeouts(with_encodings(tools))
+                    graph: CompiledGraph = create_react_agent(model=llm, tools=tools)
+                    stream = graph.stream(
+                        input={"messages": messages},
+                        # Each step is a model call and a tool call, and one more model call gives the answer.
+                        config={"configurable": {"thread_id": 42}, "callbacks": callbacks,
+                                "recursion_limit": 2 * step_budget + 1},
+                        stream_mode="values"
+                    )
+                    from langchain_core.messages.base import BaseMessage
+                    state_messages = messages
+                    cut_short = False
+                    try:
+                        for s in stream:
+                            state_messages = s["messages"]
+                            message: BaseMessage = s["messages"][-1]
+                            if isinstance(message, tuple):
+                                print(message)
+                            else:
+                                print(message.pretty_repr(html=True))
+                            if deadline.expired and getattr(message, "tool_calls", None):
+                                cut_short = True
+                                break
+                    except GraphRecursionError:
+                        cut_short = True
+                    if cut_short:
+                        print(f"deadline: out of budget after {deadline.elapsed:.1f}s, answering with what was found")
+                        result = best_effort_answer(llm, state_messages)
+                        print(result.pretty_repr(html=True))
                     else:
-                        print(message.pretty_repr(html=True))
-            else:
-                from langchain.agents import create_tool_calling_agent
-                #agent = create_tool_calling_agent(llm, tools, prompt_template)
-                agent_exec: AgentExecutor = initialize_agent(
-                    tools, llm, agent=AgentType.ZERO_SHOT_REACT_DESCRIPTION, verbose=True, handle_parsing_errors=True,
-                )
-                result = agent_exec.invoke(
-                    {
-                        'input': user_msg,
-                        'chat_history': [sys_msg],
-                    }
-                )
+                        result = state_messages[-1]
+                else:
+                    from langchain.agents import create_tool_calling_agent
+                    #agent = create_tool_calling_agent(llm, tools, prompt_template)
+                    agent_exec = create_agent_executor(tools, llm, deadline=deadline)
+                    result = agent_exec.invoke(
+                        {
+                            'input': user_msg,
+                            'chat_history': [sys_msg],
+                        },
+                        config={"callbacks": callbacks},
+                    )
             t1 = time.time()
             e1 = t1 - t0
             print(result)
@@ -71,6 +154,22 @@ def create_single_inference_cli(tools: list, sys_msg: SystemMessage, user_msg: H
             t1 = time.time()
             e1 = t1 - t0
             print(f"error elapsed time: {e1} on model {llm}")
+            print(f"deadline: {deadline}")
+            print(f"prefetch: {prefetcher}")
+            print(f"tool arguments: {tool_arg_stats}")
+            if hasattr(llm, "prompt_cache_stats"):
+                print(f"prompt cache: {llm.prompt_cache_stats}")
+            if profile_memory:
+                memory_profiler.stop()
+                print(memory_profiler.report())
+            if cassette is not None:
+                detach_cassette(replaced)
+                if record:
+                    cassette.save()
+                print(f"cassette: {cassette}")
+            if METRICS_FILE:
+                registry.dump(METRICS_FILE)
+                print(f"metrics: {METRICS_FILE}")
 
     return cli
 
@@ -0,0 +1,211 @@
+import contextvars
+import functools
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+
+from civic_chat.env import FINAL_ANSWER_RESERVE, QUESTION_STEP_BUDGET, QUESTION_TIME_BUDGET, TOOL_TIMEOUT
+
+#
+# Every question gets a budget of wall-clock time and agent steps, so a slow model or a slow tool can not keep a
+# question running until someone kills it.
+#
+# The ReAct agent stops after its step budget or once its time is spent, less a reserve, and then has the LLM write a
+# final answer from the steps so far.  The graph agent gets the same budget as a recursion limit and a check between
+# steps.  Tool calls get what is left of the budget before the reserve, up to TOOL_TIMEOUT, and a call that takes
+# longer is abandoned: the agent gets an observation saying so and carries on.
+#
+# The deadline of the question being answered is a context variable, so tools wrapped once serve concurrent
+# questions, each with its own deadline.
+#
+
+current_deadline: contextvars.ContextVar[Optional["Deadline"]] = contextvars.ContextVar("current_deadline", default=None)
+
+FINAL_ANSWER_REQUEST = (
+    "The time for this question is up.  Do not call any more tools.  Give the best final answer you can from the "
+    "information gathered above, and say what could not be checked."
+)
+
+
+class Deadline(BaseCallbackHandler):
+    """The time and step budget of one question.  Use it as a context manager around the question, and as a callback
+    to account for the time spent in LLM and tool calls."""
+
+    def __init__(self, seconds: float = QUESTION_TIME_BUDGET, max_steps: int = QUESTION_STEP_BUDGET,
+                 tool_timeout: float = TOOL_TIMEOUT, reserve: float = FINAL_ANSWER_RESERVE):
+        self.seconds = seconds
+        self.max_steps = max_steps
+        self.tool_timeout = tool_timeout
+        # Never reserve more than half the budget, so short budgets still leave time to work.
+        self.reserve = min(reserve, seconds / 2)
+        self.started: Optional[float] = None
+        self.spent: Dict[str, float] = {"llm": 0.0, "tool": 0.0}
+        self.calls: Dict[str, int] = {"llm": 0, "tool": 0}
+        self.timed_out_tools: List[str] = []
+        # The threads of tool calls that ran over and were left to finish in the background.
+        self.abandoned_threads: List[threading.Thread] = []
+        self.finished = False
+        self._running: Dict[UUID, tuple] = {}
+        self._on_exit: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+        self._token = None
+
+    def start(self) -> "Deadline":
+        self.started = time.time()
+        return self
+
+    def __enter__(self) -> "Deadline":
+        if self.started is None:
+            self.start()
+        self._token = current_deadline.set(self)
+        return self
+
+    def __exit__(self, *exc):
+        current_deadline.reset(self._token)
+        with self._lock:
+            self.finished = True
+            callbacks, self._on_exit = self._on_exit, []
+        for callback in callbacks:
+            callback()
+
+    def on_exit(self, callback: Callable[[], None]):
+        """Call back when the question ends, to free what was kept for it.  Calls back at once if it already has."""
+        with self._lock:
+            if not self.finished:
+                self._on_exit.append(callback)
+                return
+        callback()
+
+    @property
+    def elapsed(self) -> float:
+        return time.time() - self.started if self.started is not None else 0.0
+
+    @property
+    def remaining(self) -> float:
+        return self.seconds - self.elapsed
+
+    @property
+    def working_time(self) -> float:
+        """Seconds for the agent to work before it has to stop and answer."""
+        return self.seconds - self.reserve
+
+    @property
+    def expired(self) -> bool:
+        return self.elapsed >= self.working_time
+
+    @property
+    def abandoned_running(self) -> int:
+        """How many abandoned tool calls are still running."""
+        with self._lock:
+            return sum(thread.is_alive() for thread in self.abandoned_threads)
+
+    def tool_budget(self) -> float:
+        return max(0.0, min(self.tool_timeout, self.working_time - self.elapsed))
+
+    def _begin(self, run_id: UUID, kind: str, name: str):
+        with self._lock:
+            self._running[run_id] = (kind, name, time.time())
+
+    def _end(self, run_id: UUID):
+        with self._lock:
+            entry = self._running.pop(run_id, None)
+            if entry is not None:
+                kind, _, t0 = entry
+                self.spent[kind] += time.time() - t0
+                self.calls[kind] += 1
+
+    def on_chat_model_start(self, serialized, messages, *, run_id: UUID, **kwargs):
+        self._begin(run_id, "llm", "llm")
+
+    def on_llm_start(self, serialized, prompts, *, run_id: UUID, **kwargs):
+        self._begin(run_id, "llm", "llm")
+
+    def on_llm_end(self, response, *, run_id: UUID, **kwargs):
+        self._end(run_id)
+
+    def on_llm_error(self, error, *, run_id: UUID, **kwargs):
+        self._end(run_id)
+
+    def on_tool_start(self, serialized, input_str, *, run_id: UUID, **kwargs):
+        self._begin(run_id, "tool", (serialized or {}).get("name") or "tool")
+
+    def on_tool_end(self, output, *, run_id: UUID, **kwargs):
+        self._end(run_id)
+
+    def on_tool_error(self, error, *, run_id: UUID, **kwargs):
+        self._end(run_id)
+
+    def __str__(self):
+        return (
+            f"{self.elapsed:.1f}s of {self.seconds:.0f}s: "
+            f"llm {self.spent['llm']:.1f}s in {self.calls['llm']} calls, "
+            f"tools {self.spent['tool']:.1f}s in {self.calls['tool']} calls"
+            + (f", timed out: {', '.join(self.timed_out_tools)}" if self.timed_out_tools else "")
+            + (f", {self.abandoned_running} of {len(self.abandoned_threads)} abandoned calls still running"
+               if self.abandoned_threads else "")
+        )
+
+
+def _call_with_timeout(name: str, func, *args, **kwargs) -> Any:
+    deadline = current_deadline.get()
+    timeout = deadline.tool_budget() if deadline is not None else TOOL_TIMEOUT
+    if deadline is not None and timeout <= 0:
+        return "Not run: the time for this question is up.  Answer with what you have."
+    outcome = {}
+    context = contextvars.copy_context()
+
+    def run():
+        try:
+            outcome["result"] = context.run(func, *args, **kwargs)
+        except BaseException as e:
+            outcome["error"] = e
+
+    # A thread can not be killed, so a call that runs over is abandoned, and finishes in the background.
+    thread = threading.Thread(target=run, daemon=True, name="tool %s" % name)
+    thread.start()
+    thread.join(timeout)
+    if thread.is_alive():
+        if deadline is not None:
+            with deadline._lock:
+                deadline.timed_out_tools.append(name)
+                deadline.abandoned_threads.append(thread)
+        return "%s timed out after %.0fs and was abandoned.  Answer with what you have, or try a narrower request." % (
+            name, timeout
+        )
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome["result"]
+
+
+def _timed(name: str, func: Callable) -> Callable:
+    # The tool description shows the signature of its function, so the wrapper has to keep it.
+    @functools.wraps(func)
+    def timed(*args, **kwargs):
+        return _call_with_timeout(name, func, *args, **kwargs)
+
+    timed._with_timeout = True
+    return timed
+
+
+def with_timeouts(tools: list) -> list:
+    """Copies of the tools whose calls are cut short at the current deadline, or at TOOL_TIMEOUT without one."""
+    wrapped = []
+    for tool in tools:
+        func = getattr(tool, "func", None)
+        if func is None or getattr(func, "_with_timeout", False):
+            wrapped.append(tool)
+            continue
+        wrapped.append(tool.model_copy(update={"func": _timed(tool.name, func)}))
+    return wrapped
+
+
+def best_effort_answer(llm, messages: List[BaseMessage]) -> BaseMessage:
+    """Ask the LLM, without tools, for a final answer from a conversation cut short."""
+    # A tool call with no result is not a valid conversation for most APIs, so an unanswered last call is dropped.
+    if messages and isinstance(messages[-1], AIMessage) and messages[-1].tool_calls:
+        messages = messages[:-1]
+    return llm.invoke(list(messages) + [HumanMessage(FINAL_ANSWER_REQUEST)])
@@ -0,0 +1,224 @@
+import functools
+import json
+import os
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import typer
+
+from civic_chat.metrics import SIZE_BUCKETS, registry
+
+#
+# How tool results are written into the conversation.
+#
+# Left alone, a list of evidence dicts reaches the LLM as its Python repr: every row repeats every key, and a single
+# question can spend thousands of tokens on quotes and key names.  Tools wrapped with with_encodings hand the LLM text
+# in one of these encodings instead:
+#
+#   repr   what LangChain does by default, for comparison
+#   json   compact JSON, written by orjson when it is installed
+#   table  a header of dotted column names, then one tab-separated line per row; lists become "a|b|c", and lists of
+#          lists, like the aliases of each therapy, stay JSON in their cell so each item keeps its own values
+#   auto   whichever of json and table takes the fewest tokens, the default for lists of dicts; a tool's first
+#          AUTO_SAMPLES table results are encoded both ways, and the encoding that won most is kept from then on
+#
+# Each tool can be given its own encoding, in code or with CIVIC_CHAT_RESULT_ENCODINGS, like
+# "get_all_disease_mutations=json,get_disease_predictive_mutations_for_profiles=table".
+#
+# The bytes and tokens of every encoded result are recorded by tool and encoding in the metrics registry, and
+# python -m civic_chat.encode RESULT.json prints the bytes and tokens each encoding takes for a saved result.
+#
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+ENCODINGS = ["repr", "json", "table", "auto"]
+
+# Joins the items of a list within one table cell.
+LIST_SEPARATOR = "|"
+
+# How many table results of a tool auto encodes both ways before it settles on one encoding for the tool.
+AUTO_SAMPLES = 3
+
+tool_result_bytes = registry.histogram(
+    "civic_chat_tool_result_bytes", "Bytes of tool results as encoded for the LLM, by tool and encoding.",
+    ["tool", "encoding"], buckets=SIZE_BUCKETS,
+)
+tool_result_tokens = registry.histogram(
+    "civic_chat_tool_result_tokens", "Tokens of tool results as encoded for the LLM, by tool and encoding.",
+    ["tool", "encoding"], buckets=SIZE_BUCKETS,
+)
+
+
+def _parse_encodings(text: str) -> Dict[str, str]:
+    encodings = {}
+    for entry in filter(None, (e.strip() for e in text.split(","))):
+        name, _, encoding = entry.partition("=")
+        encodings[name.strip()] = encoding.strip()
+    return encodings
+
+
+TOOL_RESULT_ENCODINGS: Dict[str, str] = _parse_encodings(os.environ.get("CIVIC_CHAT_RESULT_ENCODINGS", ""))
+
+
+@functools.lru_cache(maxsize=1)
+def _tokenizer():
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        # Not installed, or its vocabulary can not be downloaded here.
+        return None
+
+
+def count_tokens(text: str) -> int:
+    """Tokens in the text for an OpenAI tokenizer, or about four characters per token without tiktoken."""
+    tokenizer = _tokenizer()
+    if tokenizer is None:
+        return (len(text) + 3) // 4
+    return len(tokenizer.encode(text, disallowed_special=()))
+
+
+def encode_json(result: Any) -> str:
+    if orjson is not None:
+        return orjson.dumps(result, option=orjson.OPT_NON_STR_KEYS).decode()
+    return json.dumps(result, separators=(",", ":"), ensure_ascii=False)
+
+
+def _cell(value: Any) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, list):
+        if any(isinstance(v, (list, dict)) for v in value):
+            # Joined flat, [["a", "b"], ["c"]] would read as three values of one item.
+            return encode_json(value)
+        return LIST_SEPARATOR.join(_cell(v) for v in value)
+    if isinstance(value, dict):
+        return encode_json(value)
+    # Tabs and newlines would break the row, and read the same to the LLM as spaces.
+    return " ".join(str(value).split())
+
+
+def _flatten(row: dict, prefix: str = "", columns: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    columns = {} if columns is None else columns
+    for key, value in row.items():
+        name = prefix + key
+        if isinstance(value, dict):
+            _flatten(value, name + ".", columns)
+        elif isinstance(value, list) and value and all(isinstance(v, dict) for v in value):
+            # A list of objects, like the therapies of an evidence item, becomes one list-valued column per field.
+            # Items may lack fields others have, so each column has a value for every item, None where it is missing.
+            items = [_flatten(item, name + ".") for item in value]
+            for column in dict.fromkeys(column for item in items for column in item):
+                columns[column] = [item.get(column) for item in items]
+        else:
+            columns[name] = value
+    return columns
+
+
+def is_table(result: Any) -> bool:
+    return isinstance(result, list) and bool(result) and all(isinstance(row, dict) for row in result)
+
+
+def encode_table(result: List[dict]) -> str:
+    rows = [_flatten(row) for row in result]
+    seen: Dict[str, None] = {}
+    for row in rows:
+        seen.update(dict.fromkeys(row))
+    # An object or list that is empty in some rows only has its fields as columns, and those cells are left blank.
+    header = [column for column in seen if not any(other.startswith(column + ".") for other in seen)]
+    lines = ["\t".join(header)]
+    lines.extend("\t".join(_cell(row.get(column)) for column in header) for row in rows)
+    return "\n".join(lines)
+
+
+def encode_result(result: Any, encoding: str = "auto") -> str:
+    """The result as text for the LLM.  The table encoding only applies to lists of dicts, and falls back to json."""
+    if encoding == "repr":
+        return str(result)
+    if encoding == "table" and is_table(result):
+        return encode_table(result)
+    if encoding == "auto" and is_table(result):
+        return min((encode_json(result), encode_table(result)), key=count_tokens)
+    if encoding in ("json", "table", "auto"):
+        return encode_json(result)
+    raise ValueError("Unknown result encoding %r, expected one of %s" % (encoding, ", ".join(ENCODINGS)))
+
+
+def compare_encodings(result: Any) -> Dict[str, Dict[str, int]]:
+    """The bytes and tokens of the result in each encoding."""
+    sizes = {}
+    for encoding in ENCODINGS[:-1]:
+        if encoding == "table" and not is_table(result):
+            continue
+        text = encode_result(result, encoding)
+        sizes[encoding] = {"bytes": len(text.encode()), "tokens": count_tokens(text)}
+    return sizes
+
+
+def _encoded(func: Callable, encoding: str, tool_name: str) -> Callable:
+    # Which of json and table won each of the first results, while auto is still comparing them.
+    auto_wins: List[str] = []
+
+    def encode(result: Any) -> Tuple[str, str]:
+        # The text, and the encoding it is in.
+        if encoding == "repr":
+            return str(result), "repr"
+        if encoding == "json" or not is_table(result):
+            return encode_json(result), "json"
+        if encoding == "table":
+            return encode_table(result), "table"
+        if len(auto_wins) >= AUTO_SAMPLES:
+            chosen = max(set(auto_wins), key=auto_wins.count)
+            return encode_result(result, chosen), chosen
+        # Ties go to json, as in encode_result.
+        texts = {"json": encode_json(result), "table": encode_table(result)}
+        auto_wins.append(min(texts, key=lambda e: count_tokens(texts[e])))
+        return texts[auto_wins[-1]], auto_wins[-1]
+
+    @functools.wraps(func)
+    def encoded(*args, **kwargs):
+        result = func(*args, **kwargs)
+        # Text is already written for the LLM.
+        if isinstance(result, str):
+            return result
+        text, chosen = encode(result)
+        if registry.enabled:
+            tool_result_bytes.observe(len(text.encode()), tool=tool_name, encoding=chosen)
+            tool_result_tokens.observe(count_tokens(text), tool=tool_name, encoding=chosen)
+        return text
+
+    encoded._encoding = encoding
+    return encoded
+
+
+def with_encodings(tools: list, encodings: Optional[Dict[str, str]] = None) -> list:
+    """Copies of the tools that return their results as text in the encoding chosen for each, "auto" by default."""
+    encodings = {**TOOL_RESULT_ENCODINGS, **(encodings or {})}
+    wrapped = []
+    for tool in tools:
+        func = getattr(tool, "func", None)
+        if func is None or hasattr(func, "_encoding"):
+            wrapped.append(tool)
+            continue
+        encoding = encodings.get(tool.name, "auto")
+        if encoding not in ENCODINGS:
+            raise ValueError("Unknown result encoding %r for %s" % (encoding, tool.name))
+        wrapped.append(tool.model_copy(update={"func": _encoded(func, encoding, tool.name)}))
+    return wrapped
+
+
+def report(path: str):
+    """ Print the bytes and tokens each encoding takes for a tool result saved as JSON.
+    """
+    with open(path) as f:
+        result = json.load(f)
+    print(f"{'encoding':<10}{'bytes':>10}{'tokens':>10}")
+    for encoding, size in compare_encodings(result).items():
+        print(f"{encoding:<10}{size['bytes']:>10}{size['tokens']:>10}")
+    print(f"auto picks {'table' if encode_result(result) != encode_json(result) else 'json'}")
+
+
+if __name__ == "__main__":
+    typer.run(report)
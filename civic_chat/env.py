@@ -1,6 +1,60 @@
+import os
 
 # Set the temperature to zero for everything.
 TEMP = 0
 
 # 10s, plus one for padding for rate-limited APIs
 RATE_LIMIT_DELAY = 11
+
+# Local data: the tool cache, and the synced copy of CIViC.
+DATA_DIR = os.environ.get("CIVIC_CHAT_DATA_DIR", os.path.expanduser("~/.cache/civic_chat"))
+
+# Where tool results are cached between runs, and how long they stay fresh.
+# The warm-up command fills this file before interactive sessions start.
+CACHE_FILE = os.environ.get("CIVIC_CHAT_CACHE_FILE", os.path.join(DATA_DIR, "tool_cache.json"))
+CACHE_TTL = float(os.environ.get("CIVIC_CHAT_CACHE_TTL", 24 * 60 * 60))
+
+# The cache shared by several worker processes on one host: tool results, GraphQL schemas and LLM responses.
+SHARED_CACHE_FILE = os.environ.get("CIVIC_CHAT_SHARED_CACHE_FILE", os.path.join(DATA_DIR, "shared_cache.sqlite3"))
+
+# The local copy of CIViC kept current by civic_chat.sync.
+STORE_FILE = os.environ.get("CIVIC_CHAT_STORE_FILE", os.path.join(DATA_DIR, "civic.sqlite3"))
+
+# The local CPU model used to embed evidence for semantic search, and where the vectors are kept.
+EMBEDDING_MODEL = os.environ.get("CIVIC_CHAT_EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+EMBEDDING_DIR = os.environ.get("CIVIC_CHAT_EMBEDDING_DIR", os.path.join(DATA_DIR, "evidence_embeddings"))
+
+# How often, in seconds, the evidence search indexes pick up what a sync applied to the local copy since.
+SEARCH_REFRESH_INTERVAL = float(os.environ.get("CIVIC_CHAT_SEARCH_REFRESH_INTERVAL", 60))
+
+# The local Ollama server, and how it is asked to keep models loaded.  OLLAMA_HOST, OLLAMA_KEEP_ALIVE and
+# OLLAMA_NUM_PARALLEL are the same variables `ollama serve` reads, so one setting configures both ends.
+OLLAMA_HOST = os.environ.get("OLLAMA_HOST", "http://127.0.0.1:11434")
+OLLAMA_KEEP_ALIVE = os.environ.get("OLLAMA_KEEP_ALIVE", "30m")
+OLLAMA_NUM_PARALLEL = int(os.environ.get("OLLAMA_NUM_PARALLEL", 1))
+
+# The budget each question gets: wall-clock seconds and agent steps (an LLM call and the tool call it asks for).
+# Tools get at most TOOL_TIMEOUT of what is left, and FINAL_ANSWER_RESERVE seconds are kept back so that, when the
+# budget runs out, there is time for the LLM to write an answer from what it has found so far.
+QUESTION_TIME_BUDGET = float(os.environ.get("CIVIC_CHAT_QUESTION_TIME_BUDGET", 300))
+QUESTION_STEP_BUDGET = int(os.environ.get("CIVIC_CHAT_QUESTION_STEP_BUDGET", 15))
+TOOL_TIMEOUT = float(os.environ.get("CIVIC_CHAT_TOOL_TIMEOUT", 60))
+FINAL_ANSWER_RESERVE = float(os.environ.get("CIVIC_CHAT_FINAL_ANSWER_RESERVE", 30))
+
+# Whether the CIViC tools start fetching the evidence the agent is likely to ask for next, as soon as a disease or
+# gene is resolved.
+PREFETCH = os.environ.get("CIVIC_CHAT_PREFETCH", "1") != "0"
+
+# The LiteLLM proxy, the config it serves, and how the client shares connections to it.  Each route of the config
+# gets at most LITELLM_ROUTE_CONCURRENCY requests at once, unless it sets its own max_parallel_requests.
+LITELLM_BASE_URL = os.environ.get("LITELLM_BASE_URL", "http://0.0.0.0:4000")
+LITELLM_CONFIG_FILE = os.environ.get(
+    "LITELLM_CONFIG_FILE", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "litellm-config.yaml")
+)
+LITELLM_MAX_CONNECTIONS = int(os.environ.get("LITELLM_MAX_CONNECTIONS", 32))
+LITELLM_ROUTE_CONCURRENCY = int(os.environ.get("LITELLM_ROUTE_CONCURRENCY", 4))
+
+# Whether the process keeps metrics for civic_chat.metrics, and the file the CLI writes them to on exit, in the
+# Prometheus text format, for node_exporter's textfile collector or a look by hand.  The server serves them at /metrics.
+METRICS = os.environ.get("CIVIC_CHAT_METRICS", "1") != "0"
+METRICS_FILE = os.environ.get("CIVIC_CHAT_METRICS_FILE", "")
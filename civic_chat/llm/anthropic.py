@@ -0,0 +1,119 @@
+import threading
+from typing import Any, List, Optional
+
+from langchain_anthropic import ChatAnthropic
+from langchain_core.outputs import ChatResult
+from pydantic import PrivateAttr
+
+from civic_chat.metrics import registry
+
+#
+# The system prompt, the tool schemas and (in example mode) the example queries are the same on every request of a
+# run, so they are marked for Anthropic's prompt cache.  Cache reads are billed at a fraction of the input price and
+# skip re-processing the prefix.  Anthropic reads the cache at content block boundaries, in the order tools, system,
+# messages, and allows up to four breakpoints.
+#
+
+CACHE_CONTROL = {"type": "ephemeral"}
+
+# The ReAct agent renders its instructions and tool descriptions into the first user message, ahead of the question
+# and the growing scratchpad.  Splitting that message here puts the static part in a block of its own.
+REACT_STATIC_PREFIX_END = "\nQuestion:"
+
+
+prompt_cache_tokens = registry.counter(
+    "civic_chat_llm_prompt_cache_tokens_total", "Input tokens by model, read from or written to the prompt cache.",
+    ["model", "type"],
+)
+
+
+class PromptCacheStats:
+    def __init__(self):
+        self.requests = 0
+        self.input_tokens = 0
+        self.cache_read_tokens = 0
+        self.cache_creation_tokens = 0
+        self._lock = threading.Lock()
+
+    def add(self, usage_metadata: Optional[dict]):
+        if not usage_metadata:
+            return
+        details = usage_metadata.get("input_token_details") or {}
+        with self._lock:
+            self.requests += 1
+            self.input_tokens += usage_metadata.get("input_tokens", 0)
+            self.cache_read_tokens += details.get("cache_read", 0) or 0
+            self.cache_creation_tokens += details.get("cache_creation", 0) or 0
+
+    @property
+    def uncached_tokens(self) -> int:
+        return self.input_tokens - self.cache_read_tokens - self.cache_creation_tokens
+
+    def __str__(self):
+        return (
+            f"{self.requests} requests, {self.input_tokens} input tokens: {self.cache_read_tokens} cached, "
+            f"{self.cache_creation_tokens} written to cache, {self.uncached_tokens} uncached"
+        )
+
+
+def _mark_last_block(content: Any) -> Any:
+    if isinstance(content, str):
+        content = [{"type": "text", "text": content}]
+    if content:
+        content[-1] = {**content[-1], "cache_control": CACHE_CONTROL}
+    return content
+
+
+def _split_react_prompt(message: dict) -> bool:
+    content = message["content"]
+    if isinstance(content, str):
+        content = [{"type": "text", "text": content}]
+    first = content[0]
+    if first.get("type") != "text" or REACT_STATIC_PREFIX_END not in first["text"]:
+        return False
+    static, rest = first["text"].split(REACT_STATIC_PREFIX_END, 1)
+    message["content"] = [
+        {"type": "text", "text": static, "cache_control": CACHE_CONTROL},
+        {"type": "text", "text": REACT_STATIC_PREFIX_END.lstrip("\n") + rest},
+    ] + content[1:]
+    return True
+
+
+def mark_static_prefix(payload: dict) -> dict:
+    """Add cache breakpoints to a Messages API payload after the tools, the system prompt and the ReAct preamble."""
+    if payload.get("tools"):
+        payload["tools"] = payload["tools"][:-1] + [{**payload["tools"][-1], "cache_control": CACHE_CONTROL}]
+    if payload.get("system"):
+        payload["system"] = _mark_last_block(payload["system"])
+    messages = payload.get("messages") or []
+    if messages and messages[0]["role"] == "user":
+        _split_react_prompt(messages[0])
+    return payload
+
+
+class ChatAnthropicPromptCached(ChatAnthropic):
+    # Use this in place of ChatAnthropic to cache the static prefix of every request, and count cached tokens.
+    _prompt_cache_stats: PromptCacheStats = PrivateAttr(default_factory=PromptCacheStats)
+
+    @property
+    def prompt_cache_stats(self) -> PromptCacheStats:
+        return self._prompt_cache_stats
+
+    def _get_request_payload(self, input_, *, stop: Optional[List[str]] = None, **kwargs) -> dict:
+        return mark_static_prefix(super()._get_request_payload(input_, stop=stop, **kwargs))
+
+    def _record(self, result: ChatResult) -> ChatResult:
+        for generation in result.generations:
+            usage_metadata = getattr(generation.message, "usage_metadata", None)
+            self._prompt_cache_stats.add(usage_metadata)
+            details = (usage_metadata or {}).get("input_token_details") or {}
+            for kind in ("cache_read", "cache_creation"):
+                if details.get(kind):
+                    prompt_cache_tokens.inc(details[kind], model=self.model, type=kind)
+        return result
+
+    def _generate(self, *args, **kwargs) -> ChatResult:
+        return self._record(super()._generate(*args, **kwargs))
+
+    async def _agenerate(self, *args, **kwargs) -> ChatResult:
+        return self._record(await super()._agenerate(*args, **kwargs))
@@ -1,8 +1,153 @@
+import asyncio
+import fnmatch
+import functools
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
 
+import httpx
+from langchain_core.outputs import ChatResult
 from langchain_openai import ChatOpenAI
 
-def get_litellm_proxy(model: str) -> ChatOpenAI:
-    # This lets us test accessing remote models through the LiteLLM proxy interface.
-    # When using a LiteLLM we always use the OpenAI code b/c LiteLLM internally adapts to OpenAI.
-    # The LiteLLM server on port 4000 exposes an OpenAI compatible interface for other models.
-    return ChatOpenAI(model=model, base_url="http://0.0.0.0:4000")
+from civic_chat.env import (
+    LITELLM_BASE_URL, LITELLM_CONFIG_FILE, LITELLM_MAX_CONNECTIONS, LITELLM_ROUTE_CONCURRENCY, TEMP,
+)
+from civic_chat.metrics import registry
+
+#
+# This lets us test accessing remote models through the LiteLLM proxy interface.
+# When using a LiteLLM we always use the OpenAI code b/c LiteLLM internally adapts to OpenAI.
+# The LiteLLM server on port 4000 exposes an OpenAI compatible interface for other models.
+#
+# Every model from get_litellm_proxy shares one pooled HTTP client per process, so requests reuse the connections to
+# the proxy instead of each model opening its own.  Requests are also limited per route of litellm-config.yaml, so a
+# burst of questions for a local Ollama model does not queue dozens of requests at a server that runs one at a time,
+# while remote routes can run more.
+#
+# civic_chat.mock.openai_server stands in for the proxy, for exercising this path without any providers.
+#
+
+
+route_wait_seconds = registry.histogram(
+    "civic_chat_llm_route_wait_seconds", "Time waiting for a free slot of a LiteLLM route.", ["route"]
+)
+route_in_flight = registry.gauge(
+    "civic_chat_llm_route_in_flight", "Requests holding a slot of a LiteLLM route.", ["route"]
+)
+
+
+class Route:
+    def __init__(self, model_name: str, max_parallel_requests: int):
+        self.model_name = model_name
+        self.max_parallel_requests = max_parallel_requests
+        self.semaphore = threading.BoundedSemaphore(max_parallel_requests)
+
+    def __repr__(self):
+        return "Route(%r, max_parallel_requests=%d)" % (self.model_name, self.max_parallel_requests)
+
+
+def load_routes(path: str = LITELLM_CONFIG_FILE, default_limit: int = LITELLM_ROUTE_CONCURRENCY) -> List[Route]:
+    """The routes of a LiteLLM config, with max_parallel_requests from their litellm_params or the default."""
+    if not os.path.exists(path):
+        return []
+    import yaml
+
+    with open(path) as f:
+        config = yaml.safe_load(f) or {}
+    return [
+        Route(entry["model_name"], int((entry.get("litellm_params") or {}).get("max_parallel_requests", default_limit)))
+        for entry in config.get("model_list") or []
+    ]
+
+
+@functools.lru_cache(maxsize=None)
+def _routes() -> List[Route]:
+    return load_routes()
+
+
+# Models matching no route of the config share this one.
+_default_route = Route("*", LITELLM_ROUTE_CONCURRENCY)
+
+
+def route_for(model: str, routes: Optional[List[Route]] = None) -> Route:
+    for route in _routes() if routes is None else routes:
+        if fnmatch.fnmatchcase(model, route.model_name):
+            return route
+    return _default_route
+
+
+_clients: Dict[str, Any] = {}
+_clients_lock = threading.Lock()
+
+
+def _shared_client(kind: str):
+    # One per process, made after any fork, since a pool's connections can not be shared across processes.
+    key = "%s %d" % (kind, os.getpid())
+    with _clients_lock:
+        if key not in _clients:
+            limits = httpx.Limits(max_connections=LITELLM_MAX_CONNECTIONS,
+                                  max_keepalive_connections=LITELLM_MAX_CONNECTIONS)
+            client_class = httpx.AsyncClient if kind == "async" else httpx.Client
+            _clients[key] = client_class(limits=limits, timeout=httpx.Timeout(600.0, connect=10.0))
+        return _clients[key]
+
+
+class ChatOpenAIRouteLimited(ChatOpenAI):
+    """ChatOpenAI that holds a slot of its LiteLLM route for the length of each request."""
+
+    @property
+    def route(self) -> Route:
+        return route_for(self.model_name)
+
+    @contextmanager
+    def _slot(self):
+        route = self.route
+        t0 = time.perf_counter()
+        route.semaphore.acquire()
+        route_wait_seconds.observe(time.perf_counter() - t0, route=route.model_name)
+        route_in_flight.inc(route=route.model_name)
+        try:
+            yield
+        finally:
+            route_in_flight.dec(route=route.model_name)
+            route.semaphore.release()
+
+    def _generate(self, *args, **kwargs) -> ChatResult:
+        with self._slot():
+            return super()._generate(*args, **kwargs)
+
+    def _stream(self, *args, **kwargs) -> Iterator:
+        with self._slot():
+            yield from super()._stream(*args, **kwargs)
+
+    async def _agenerate(self, *args, **kwargs) -> ChatResult:
+        # Polling for the slot keeps the event loop free, shares the limit with sync callers, and can not leave a
+        # slot taken when the task is cancelled while waiting.
+        route = self.route
+        t0 = time.perf_counter()
+        while not route.semaphore.acquire(blocking=False):
+            await asyncio.sleep(0.01)
+        route_wait_seconds.observe(time.perf_counter() - t0, route=route.model_name)
+        route_in_flight.inc(route=route.model_name)
+        try:
+            return await super()._agenerate(*args, **kwargs)
+        finally:
+            route_in_flight.dec(route=route.model_name)
+            route.semaphore.release()
+
+
+def get_litellm_proxy(model: str, base_url: str = LITELLM_BASE_URL) -> ChatOpenAI:
+    """The chat model for a model name served by the LiteLLM proxy, made once per process and shared."""
+    return _get_litellm_proxy(model, base_url, os.getpid())
+
+
+@functools.lru_cache(maxsize=None)
+def _get_litellm_proxy(model: str, base_url: str, pid: int) -> ChatOpenAI:
+    return ChatOpenAIRouteLimited(
+        model=model, base_url=base_url, temperature=TEMP,
+        # The proxy holds the provider keys; it only needs some key to be sent.
+        api_key=os.environ.get("LITELLM_API_KEY", "sk-litellm"),
+        http_client=_shared_client("sync"), http_async_client=_shared_client("async"),
+    )
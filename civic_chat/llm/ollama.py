@@ -1,4 +1,10 @@
+import re
+import time
+from typing import Any, Dict, Optional
 
+import httpx
+
+from civic_chat.env import OLLAMA_HOST, OLLAMA_KEEP_ALIVE, OLLAMA_NUM_PARALLEL
 
 #
 # ChatOllama did not have tool support originally w/o this shium.
@@ -8,3 +14,183 @@ from langchain_experimental.llms.ollama_functions import OllamaFunctions    # op
 
 def ChatOllamaWithFunctionShim(*args, **kwargs):
     return OllamaFunctions(*args, format="json", **kwargs)
+
+
+#
+# Local models take seconds to load on the first request, and again whenever Ollama evicts them after keep_alive.
+# The manager checks a model fits in memory before loading it, loads it ahead of the first question, asks Ollama to
+# keep it loaded, and measures the first (cold) request against a second (warm) one.
+#
+# How many requests a loaded model serves at once is a server setting (OLLAMA_NUM_PARALLEL).  Each parallel slot
+# gets its own context, so it counts toward the memory a model needs.
+#
+
+# Bytes of KV cache per token per layer and KV dimension, for an f16 cache, keys and values.
+KV_BYTES = 2 * 2
+# Used when the model does not report its shape: about right for a 7-8B model with grouped-query attention.
+DEFAULT_KV_BYTES_PER_TOKEN = 128 * 1024
+# Ollama's default context length, when the chat model does not set num_ctx.
+DEFAULT_NUM_CTX = 2048
+# Weights take about the size of the model file, plus some runtime overhead.
+WEIGHTS_OVERHEAD = 1.1
+
+WARM_PROMPT = "Hi"
+
+
+class ModelDoesNotFit(RuntimeError):
+    """Loading the model would need more memory than is available."""
+
+
+def read_available_memory() -> Optional[int]:
+    """Memory available to new allocations without swapping, in bytes, or None off Linux where it is not known."""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def _base_url(host: str) -> str:
+    # OLLAMA_HOST is often given without a scheme, like 0.0.0.0:11434.
+    return re.sub("/*$", "", host if "://" in host else "http://" + host)
+
+
+class OllamaModelManager:
+    def __init__(self, model: str, base_url: Optional[str] = None, keep_alive: Any = OLLAMA_KEEP_ALIVE,
+                 num_parallel: int = OLLAMA_NUM_PARALLEL, num_ctx: Optional[int] = None, timeout: float = 600):
+        self.model = model
+        self.base_url = _base_url(base_url or OLLAMA_HOST)
+        self.keep_alive = keep_alive
+        self.num_parallel = num_parallel
+        self.num_ctx = num_ctx or DEFAULT_NUM_CTX
+        self._client = httpx.Client(base_url=self.base_url, timeout=timeout)
+
+    @classmethod
+    def for_chat_model(cls, llm, **kwargs) -> "OllamaModelManager":
+        """A manager for the model behind a ChatOllama, which is set to use the manager's keep_alive.
+
+        Every request resets Ollama's unload timer to the keep_alive it carries, or to the server default without one,
+        so the chat model has to send the same keep_alive as the warm-up for the model to stay loaded.
+        """
+        manager = cls(llm.model, base_url=llm.base_url, num_ctx=llm.num_ctx, **kwargs)
+        if llm.keep_alive is None:
+            llm.keep_alive = manager.keep_alive
+        return manager
+
+    def server_env(self) -> Dict[str, str]:
+        """The settings to start `ollama serve` with, to match this manager."""
+        return {
+            "OLLAMA_HOST": self.base_url.split("://", 1)[1],
+            "OLLAMA_KEEP_ALIVE": str(self.keep_alive),
+            "OLLAMA_NUM_PARALLEL": str(self.num_parallel),
+        }
+
+    def _post(self, path: str, body: dict) -> dict:
+        response = self._client.post(path, json=body)
+        response.raise_for_status()
+        return response.json()
+
+    def running(self) -> Optional[dict]:
+        """The model's entry in /api/ps if it is loaded, with its size, size_vram and expires_at."""
+        response = self._client.get("/api/ps")
+        response.raise_for_status()
+        for entry in response.json().get("models", []):
+            if entry.get("name") == self.model or entry.get("model") == self.model:
+                return entry
+        return None
+
+    def kv_bytes_per_token(self) -> int:
+        info = self._post("/api/show", {"model": self.model}).get("model_info") or {}
+        arch = info.get("general.architecture")
+        layers = info.get("%s.block_count" % arch)
+        width = info.get("%s.embedding_length" % arch)
+        heads = info.get("%s.attention.head_count" % arch)
+        kv_heads = info.get("%s.attention.head_count_kv" % arch) or heads
+        if not (layers and width and heads):
+            return DEFAULT_KV_BYTES_PER_TOKEN
+        return layers * (width // heads) * kv_heads * KV_BYTES
+
+    def model_size(self) -> int:
+        response = self._client.get("/api/tags")
+        response.raise_for_status()
+        for entry in response.json().get("models", []):
+            if entry.get("name") == self.model or entry.get("model") == self.model:
+                return entry["size"]
+        raise ValueError("model %s is not pulled on %s" % (self.model, self.base_url))
+
+    def required_memory(self) -> int:
+        """An estimate of the memory the model needs loaded: its weights, and a context for each parallel slot."""
+        weights = int(self.model_size() * WEIGHTS_OVERHEAD)
+        return weights + self.num_parallel * self.num_ctx * self.kv_bytes_per_token()
+
+    def check_fit(self, available: Optional[int] = None) -> bool:
+        """Raise ModelDoesNotFit if the model is not loaded and would not fit in available memory.
+
+        Returns False when the available memory is not known, so the check was skipped.
+        """
+        if self.running() is not None:
+            return True
+        available = available if available is not None else read_available_memory()
+        if available is None:
+            return False
+        required = self.required_memory()
+        if required > available:
+            raise ModelDoesNotFit(
+                "%s needs about %.1fGiB with %d parallel slots of %d tokens, but %.1fGiB is available" % (
+                    self.model, required / 2 ** 30, self.num_parallel, self.num_ctx, available / 2 ** 30
+                )
+            )
+        return True
+
+    def _generate(self) -> dict:
+        # One token is enough to time a round trip through the loaded model.
+        t0 = time.time()
+        result = self._post("/api/generate", {
+            "model": self.model, "prompt": WARM_PROMPT, "stream": False, "keep_alive": self.keep_alive,
+            "options": {"num_predict": 1, "num_ctx": self.num_ctx},
+        })
+        result["elapsed"] = time.time() - t0
+        return result
+
+    def warm(self, available: Optional[int] = None) -> "WarmupReport":
+        """Load the model if it is not loaded, and time a cold request against a warm one."""
+        was_loaded = self.running() is not None
+        fit_checked = self.check_fit(available)
+        cold = self._generate()
+        warm = self._generate()
+        return WarmupReport(
+            model=self.model,
+            was_loaded=was_loaded,
+            fit_checked=fit_checked,
+            cold_seconds=cold["elapsed"],
+            load_seconds=cold.get("load_duration", 0) / 1e9,
+            warm_seconds=warm["elapsed"],
+            running=self.running(),
+        )
+
+    def unload(self):
+        self._post("/api/generate", {"model": self.model, "keep_alive": 0})
+
+
+class WarmupReport:
+    def __init__(self, model: str, was_loaded: bool, cold_seconds: float, load_seconds: float, warm_seconds: float,
+                 running: Optional[dict], fit_checked: bool = True):
+        self.model = model
+        self.was_loaded = was_loaded
+        self.fit_checked = fit_checked
+        self.cold_seconds = cold_seconds
+        self.load_seconds = load_seconds
+        self.warm_seconds = warm_seconds
+        self.running = running or {}
+
+    def __str__(self):
+        return (
+            f"{self.model}: {'already loaded' if self.was_loaded else 'loaded'}, "
+            f"cold request {self.cold_seconds:.2f}s (load {self.load_seconds:.2f}s), warm request {self.warm_seconds:.2f}s, "
+            f"{self.running.get('size_vram', 0) / 2 ** 30:.1f}GiB in VRAM of {self.running.get('size', 0) / 2 ** 30:.1f}GiB, "
+            f"loaded until {self.running.get('expires_at', '?')}"
+            + ("" if self.fit_checked else ", not checked to fit in memory: available memory is unknown here")
+        )
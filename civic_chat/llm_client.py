@@ -22,13 +22,16 @@ from langgraph.prebuilt import create_react_agent
 #
 
 from .env import TEMP
+from .llm.anthropic import ChatAnthropicPromptCached                        # caches the static prompt prefix
 
 ## Working models
 
 # works, fast
 #llm = ChatAnthropic(model="claude-3-5-sonnet-20241022", temperature=TEMP)   # civic: 29.4s, detailed
+# Same, with the system prompt, tool schemas and ReAct preamble served from Anthropic's prompt cache.
+#llm = ChatAnthropicPromptCached(model="claude-3-5-sonnet-20241022", temperature=TEMP)
 # Alternative: use a LiteLLM proxy.
-# llm = get_llm("anthropic/claude-3-5-sonnet-20241022")
+# llm = get_litellm_proxy("anthropic/claude-3-5-sonnet-20241022")
 
 # works, slow b/c of delay
 #llm = ChatTogether(model="deepseek-ai/DeepSeek-R1") # civic 360s b/c of rate limit delay
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+
+"""
+Find how many simultaneous chat sessions one civic_chat process sustains.
+
+Simulated users ask questions from a weighted mix, arriving at a given rate (or all at once when no rate is given),
+and are served by up to N concurrent sessions, each running the ReAct agent against the mock GraphQL server and a
+scripted fake LLM with a configurable latency.  Each concurrency level reports throughput, latency percentiles,
+error rate and the time questions spent queued, which together trace the saturation curve.
+
+    python -m civic_chat.loadtest --concurrency 1 --concurrency 4 --concurrency 16 --llm-latency 0.5
+    python -m civic_chat.loadtest --rate 5 --questions 200
+"""
+
+import queue
+import random
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import typer
+
+# Each question and its weight in the mix.
+QUESTION_MIX = [
+    ('What is the evidence of mutations associated with the gene "KRAS" in relation to Colorectal Cancer?', 4),
+    ('What is the evidence of mutations associated with the gene "BRAF" in relation to Melanoma?', 2),
+    ('What is the evidence of mutations associated with the gene "EGFR" in relation to Lung Non-small Cell Carcinoma?', 2),
+    ('Which therapies have the strongest evidence for the gene "KRAS" in Colorectal Cancer?', 2),
+]
+
+
+def load_test_tools() -> list:
+    from civic_chat.tools.civic_disease import get_disease_id
+    from civic_chat.tools.civic_evidence_search import search_evidence
+    from civic_chat.tools.civic_evidence_semantic import semantic_search_evidence
+    from civic_chat.tools.civic_evidence_summary import summarize_disease_mutations_for_profiles
+    from civic_chat.tools.civic_mutation import get_gene_molecular_profile_ids
+    from civic_chat.tools.civic_mutation_evidence import get_disease_predictive_mutations_for_profiles
+
+    return [
+        get_disease_id,
+        get_gene_molecular_profile_ids,
+        get_disease_predictive_mutations_for_profiles,
+        summarize_disease_mutations_for_profiles,
+        search_evidence,
+        semantic_search_evidence,
+    ]
+
+
+def create_load_test_agent(llm_latency: float):
+    from civic_chat.cli import create_agent_executor
+    from civic_chat.mock.llm import ScriptedReactChatModel
+
+    return create_agent_executor(load_test_tools(), ScriptedReactChatModel(latency=llm_latency), verbose=False)
+
+
+def run_level(agent_exec, concurrency: int, questions: int, rate: Optional[float],
+              mix: List[Tuple[str, int]], seed: int = 0) -> Dict[str, float]:
+    """Serve a number of questions with a number of concurrent sessions, and summarize how it went."""
+    rng = random.Random(seed)
+    texts = [text for text, _ in mix]
+    weights = [weight for _, weight in mix]
+    pending: "queue.Queue[Optional[Tuple[str, float]]]" = queue.Queue()
+    samples = []
+    lock = threading.Lock()
+
+    def session():
+        while True:
+            item = pending.get()
+            if item is None:
+                return
+            question, arrived = item
+            started = time.time()
+            try:
+                agent_exec.invoke({"input": question})
+                error = False
+            except Exception:
+                error = True
+            finished = time.time()
+            with lock:
+                samples.append((started - arrived, finished - started, finished - arrived, error))
+
+    sessions = [threading.Thread(target=session, daemon=True) for _ in range(concurrency)]
+    for thread in sessions:
+        thread.start()
+
+    t0 = time.time()
+    for _ in range(questions):
+        if rate:
+            # Open loop: arrivals are a Poisson process, whether or not the sessions keep up.
+            time.sleep(rng.expovariate(rate))
+        pending.put((rng.choices(texts, weights)[0], time.time()))
+    for _ in sessions:
+        pending.put(None)
+    for thread in sessions:
+        thread.join()
+    elapsed = time.time() - t0
+
+    if not samples:
+        # No question was asked, or none finished, so there is nothing to measure.
+        nan = float("nan")
+        return {"concurrency": concurrency, "throughput": 0.0, "p50": nan, "p95": nan, "p99": nan,
+                "service_p50": nan, "queue_mean": nan, "queue_p95": nan, "error_rate": 0.0}
+    queued, service, total, errors = (np.array(column) for column in zip(*samples))
+    ok = ~errors.astype(bool)
+    p50, p95, p99 = np.percentile(total, [50, 95, 99])
+    return {
+        "concurrency": concurrency,
+        "throughput": ok.sum() / elapsed,
+        "p50": p50,
+        "p95": p95,
+        "p99": p99,
+        "service_p50": float(np.percentile(service, 50)),
+        "queue_mean": float(queued.mean()),
+        "queue_p95": float(np.percentile(queued, 95)),
+        "error_rate": float(errors.mean()),
+    }
+
+
+HEADER = "%11s %10s %8s %8s %8s %11s %10s %9s %7s" % (
+    "concurrency", "answers/s", "p50 s", "p95 s", "p99 s", "service p50", "queue avg", "queue p95", "errors"
+)
+
+
+def format_result(r: Dict[str, float]) -> str:
+    return "%11d %10.2f %8.2f %8.2f %8.2f %11.2f %10.2f %9.2f %6.1f%%" % (
+        r["concurrency"], r["throughput"], r["p50"], r["p95"], r["p99"], r["service_p50"], r["queue_mean"],
+        r["queue_p95"], 100 * r["error_rate"],
+    )
+
+
+def loadtest(
+    concurrency: List[int] = typer.Option([1, 2, 4, 8, 16], help="Concurrent sessions, one run per value."),
+    questions: int = typer.Option(50, help="Questions asked at each concurrency level."),
+    rate: float = typer.Option(0.0, help="Question arrivals per second, or 0 to ask them all at once."),
+    llm_latency: float = typer.Option(0.2, help="Seconds the fake LLM takes per step."),
+    graphql_latency: float = typer.Option(0.05, help="Seconds the mock GraphQL server takes per query."),
+    cache: bool = typer.Option(False, help="Serve repeated GraphQL queries from the tool cache."),
+):
+    """ Drive the agent with simulated users at increasing concurrency, and report the saturation curve.
+    """
+    from civic_chat.cache import ToolCache
+    from civic_chat.mock.graphql_server import MockGraphQLServer, point_civic_tools_at
+
+    results = []
+    with MockGraphQLServer(latency=graphql_latency) as server:
+        previous = point_civic_tools_at(server.url, cache=ToolCache() if cache else None)
+        try:
+            agent_exec = create_load_test_agent(llm_latency)
+            print(HEADER)
+            for level in concurrency:
+                results.append(run_level(agent_exec, level, questions, rate or None, QUESTION_MIX))
+                print(format_result(results[-1]))
+        finally:
+            from civic_chat.tools.civic_db_gql import civic_tool
+            civic_tool.graphql_wrapper = previous
+    print(f"{len(server.requests)} GraphQL requests served")
+    return results
+
+
+if __name__ == "__main__":
+    typer.run(loadtest)
@@ -0,0 +1,321 @@
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from civic_chat.env import METRICS
+
+#
+# In-process metrics: counters, gauges and histograms, written out in the Prometheus text format.
+#
+# The GraphQL wrapper counts queries by root field and by whether the cache answered, and times requests and sizes
+# results by root field.  The tools count how their arguments parsed, prefetch guesses and duplicate evidence, and
+# civic_chat.encode sizes their results in bytes and tokens as encoded for the LLM.  The model wrappers in
+# civic_chat/llm count prompt cache tokens and time waits for a LiteLLM route.  Pass agent_metrics in the callbacks
+# of an agent run to count and time every LLM and tool call, and the tokens each model used.
+# Token throughput per model is then rate(civic_chat_llm_tokens_total) over rate(civic_chat_llm_request_seconds_sum).
+#
+# The server serves its worker's metrics at /metrics.  The CLI writes them to CIVIC_CHAT_METRICS_FILE on exit.
+#
+# Recording takes a lock and a dict lookup, about a microsecond, and next to nothing with CIVIC_CHAT_METRICS=0.
+#
+
+# Seconds, from a cache lookup to a slow model.
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# Bytes or characters, from an ID to a page of full evidence.
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return "%d" % value if float(value).is_integer() else repr(float(value))
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{%s}" % ",".join('%s="%s"' % (name, _escape(str(value))) for name, value in zip(names, values))
+
+
+def _sorted(items):
+    return sorted(items, key=lambda item: [str(value) for value in item[0]])
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, registry: "MetricsRegistry", name: str, help: str, labelnames: Sequence[str] = ()):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[Any, ...], Any] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[Any, ...]:
+        # Label values are turned into text on the way out, not here on the hot path.
+        return tuple([labels.get(name, "") for name in self.labelnames])
+
+    def get(self, **labels) -> Any:
+        with self._lock:
+            return self._values.get(self._key(labels))
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def samples(self) -> List[Tuple[str, Tuple[str, ...], Tuple[Any, ...], float]]:
+        """(name, label names, label values, value) for each line of the exposition."""
+        with self._lock:
+            return [(self.name, self.labelnames, key, value) for key, value in _sorted(self._values.items())]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        if not self.registry.enabled:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        if not self.registry.enabled:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels):
+        if not self.registry.enabled:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class _Buckets:
+    def __init__(self, size: int):
+        self.counts = [0] * size
+        self.sum = 0.0
+        self.count = 0
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, registry: "MetricsRegistry", name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(registry, name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        if not self.registry.enabled:
+            return
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            buckets = self._values.get(key)
+            if buckets is None:
+                buckets = self._values[key] = _Buckets(len(self.buckets) + 1)
+            buckets.counts[i] += 1
+            buckets.sum += value
+            buckets.count += 1
+
+    @contextmanager
+    def time(self, **labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, **labels)
+
+    def samples(self) -> List[Tuple[str, Tuple[str, ...], Tuple[Any, ...], float]]:
+        names = self.labelnames + ("le",)
+        lines = []
+        with self._lock:
+            for key, buckets in _sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), buckets.counts):
+                    cumulative += count
+                    lines.append((self.name + "_bucket", names, key + (_format_number(bound),), cumulative))
+                lines.append((self.name + "_sum", self.labelnames, key, buckets.sum))
+                lines.append((self.name + "_count", self.labelnames, key, buckets.count))
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self, enabled: bool = METRICS):
+        self.enabled = enabled
+        # Labels added to every sample on the way out, like the worker a server process is.
+        self.const_labels: Dict[str, str] = {}
+        self._metrics: Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, metric_class, name: str, help: str, labelnames: Sequence[str], **kwargs) -> Any:
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = metric_class(self, name, help, labelnames, **kwargs)
+            elif type(metric) is not metric_class or metric.labelnames != tuple(labelnames):
+                raise ValueError("Metric %s is already registered as a %s with labels %s" % (
+                    name, metric.kind, ", ".join(metric.labelnames)
+                ))
+            return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._get(Counter, name, help, labelnames)
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._get(Gauge, name, help, labelnames)
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, help, labelnames, buckets=buckets)
+
+    def reset(self):
+        """Forget every value recorded, keeping the metrics registered."""
+        for metric in list(self._metrics.values()):
+            metric.clear()
+
+    def expose(self) -> str:
+        """Every metric in the Prometheus text exposition format."""
+        const_names = tuple(self.const_labels)
+        const_values = tuple(self.const_labels.values())
+        lines = []
+        for name in sorted(self._metrics):
+            metric = self._metrics[name]
+            lines.append("# HELP %s %s" % (name, metric.help.replace("\\", "\\\\").replace("\n", "\\n")))
+            lines.append("# TYPE %s %s" % (name, metric.kind))
+            for sample, names, values, value in metric.samples():
+                labels = _format_labels(const_names + names, const_values + values)
+                lines.append("%s%s %s" % (sample, labels, _format_number(value)))
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path: str):
+        """Write the exposition to a file, replacing it at once so a collector never reads half of it."""
+        tmp = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmp, "w") as f:
+            f.write(self.expose())
+        os.replace(tmp, path)
+
+
+registry = MetricsRegistry()
+
+llm_requests = registry.counter(
+    "civic_chat_llm_requests_total", "LLM calls by model and outcome.", ["model", "outcome"]
+)
+llm_request_seconds = registry.histogram(
+    "civic_chat_llm_request_seconds", "Time per LLM call by model.", ["model"]
+)
+llm_tokens = registry.counter(
+    "civic_chat_llm_tokens_total", "Tokens used by model, input or output.", ["model", "type"]
+)
+tool_calls = registry.counter(
+    "civic_chat_tool_calls_total", "Agent tool calls by tool and outcome.", ["tool", "outcome"]
+)
+tool_seconds = registry.histogram(
+    "civic_chat_tool_seconds", "Time per agent tool call by tool.", ["tool"]
+)
+tool_result_chars = registry.histogram(
+    "civic_chat_tool_result_chars", "Characters of tool results handed to the LLM, by tool.", ["tool"],
+    buckets=SIZE_BUCKETS,
+)
+
+
+def _model_name(serialized: Optional[dict], metadata: Optional[dict]) -> str:
+    name = (metadata or {}).get("ls_model_name")
+    if not name:
+        kwargs = (serialized or {}).get("kwargs") or {}
+        name = kwargs.get("model") or kwargs.get("model_name")
+    return str(name or (serialized or {}).get("name") or "unknown")
+
+
+def _usage(response) -> Dict[str, int]:
+    usage = {"input": 0, "output": 0}
+    for generations in response.generations:
+        for generation in generations:
+            metadata = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+            usage["input"] += metadata.get("input_tokens", 0) or 0
+            usage["output"] += metadata.get("output_tokens", 0) or 0
+    return usage
+
+
+class AgentMetrics(BaseCallbackHandler):
+    """Records every LLM and tool call of the runs it is a callback of."""
+
+    def __init__(self):
+        self._running: Dict[UUID, Tuple[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def _begin(self, run_id: UUID, name: str):
+        with self._lock:
+            self._running[run_id] = (name, time.perf_counter())
+
+    def _end(self, run_id: UUID) -> Tuple[Optional[str], float]:
+        with self._lock:
+            entry = self._running.pop(run_id, None)
+        if entry is None:
+            return None, 0.0
+        return entry[0], time.perf_counter() - entry[1]
+
+    def on_chat_model_start(self, serialized, messages, *, run_id: UUID, metadata=None, **kwargs):
+        self._begin(run_id, _model_name(serialized, metadata))
+
+    def on_llm_start(self, serialized, prompts, *, run_id: UUID, metadata=None, **kwargs):
+        self._begin(run_id, _model_name(serialized, metadata))
+
+    def on_llm_end(self, response, *, run_id: UUID, **kwargs):
+        model, seconds = self._end(run_id)
+        if model is None:
+            return
+        llm_requests.inc(model=model, outcome="ok")
+        llm_request_seconds.observe(seconds, model=model)
+        for kind, tokens in _usage(response).items():
+            if tokens:
+                llm_tokens.inc(tokens, model=model, type=kind)
+
+    def on_llm_error(self, error, *, run_id: UUID, **kwargs):
+        model, seconds = self._end(run_id)
+        if model is not None:
+            llm_requests.inc(model=model, outcome="error")
+            llm_request_seconds.observe(seconds, model=model)
+
+    def on_tool_start(self, serialized, input_str, *, run_id: UUID, **kwargs):
+        self._begin(run_id, (serialized or {}).get("name") or "tool")
+
+    def on_tool_end(self, output, *, run_id: UUID, **kwargs):
+        tool, seconds = self._end(run_id)
+        if tool is None:
+            return
+        tool_calls.inc(tool=tool, outcome="ok")
+        tool_seconds.observe(seconds, tool=tool)
+        tool_result_chars.observe(len(str(getattr(output, "content", output))), tool=tool)
+
+    def on_tool_error(self, error, *, run_id: UUID, **kwargs):
+        tool, seconds = self._end(run_id)
+        if tool is not None:
+            tool_calls.inc(tool=tool, outcome="error")
+            tool_seconds.observe(seconds, tool=tool)
+
+
+agent_metrics = AgentMetrics()
@@ -0,0 +1,75 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Optional, Tuple
+
+
+class JsonServer:
+    """A local HTTP server answering JSON requests from a thread, for standing in for remote services.
+
+    Subclasses implement handle(method, path, body) and return a status and a JSON-able response.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.requests = []
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._lock = threading.Lock()
+
+    def handle(self, method: str, path: str, body: Any) -> Tuple[int, Any]:
+        raise NotImplementedError
+
+    @property
+    def url(self) -> str:
+        return "http://%s:%d" % (self.host, self._server.server_address[1])
+
+    def start(self) -> str:
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _respond(self, method):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length)) if length else None
+                with server._lock:
+                    server.requests.append((method, self.path, body))
+                if server.latency:
+                    time.sleep(server.latency)
+                status, response = server.handle(method, self.path, body)
+                data = json.dumps(response).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self._respond("GET")
+
+            def do_POST(self):
+                self._respond("POST")
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self.url
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,67 @@
+import hashlib
+import json
+from typing import Any, Tuple
+
+from civic_chat.mock._server import JsonServer
+
+
+def _tokens(block: Any) -> int:
+    # A rough token count, which is all the cache accounting needs to be checked against.
+    return max(1, len(json.dumps(block)) // 4)
+
+
+class MockAnthropicServer(JsonServer):
+    """A stand-in for the Anthropic Messages API that simulates prompt caching.
+
+    Every prefix ending at a cache_control breakpoint is remembered, and a later request reads the longest of its
+    breakpoint prefixes that was seen before, reporting cache read, cache creation and uncached input tokens the way
+    the real API does.
+    """
+
+    def __init__(self, reply: str = "Final Answer: done", **kwargs):
+        super().__init__(**kwargs)
+        self.reply = reply
+        self.cached_prefixes = set()
+
+    def _blocks(self, body: dict):
+        # Anthropic orders the prompt as tools, then system, then messages.
+        for tool in body.get("tools") or []:
+            yield tool
+        system = body.get("system") or []
+        for block in [{"type": "text", "text": system}] if isinstance(system, str) else system:
+            yield block
+        for message in body.get("messages") or []:
+            content = message["content"]
+            for block in [{"type": "text", "text": content}] if isinstance(content, str) else content:
+                yield {"role": message["role"], **block}
+
+    def handle(self, method: str, path: str, body: Any) -> Tuple[int, Any]:
+        if not path.endswith("/messages"):
+            return 404, {"type": "error", "error": {"type": "not_found_error", "message": path}}
+        digest = hashlib.sha256()
+        total = 0
+        breakpoints = []
+        for block in self._blocks(body):
+            digest.update(json.dumps({k: v for k, v in block.items() if k != "cache_control"}, sort_keys=True).encode())
+            total += _tokens(block)
+            if "cache_control" in block:
+                breakpoints.append((digest.hexdigest(), total))
+
+        read = max([tokens for key, tokens in breakpoints if key in self.cached_prefixes], default=0)
+        written = max([tokens for _, tokens in breakpoints], default=0) - read
+        self.cached_prefixes.update(key for key, _ in breakpoints)
+        return 200, {
+            "id": "msg_mock_%d" % len(self.requests),
+            "type": "message",
+            "role": "assistant",
+            "model": body.get("model"),
+            "content": [{"type": "text", "text": self.reply}],
+            "stop_reason": "end_turn",
+            "stop_sequence": None,
+            "usage": {
+                "input_tokens": total - read - max(written, 0),
+                "output_tokens": _tokens(self.reply),
+                "cache_read_input_tokens": read,
+                "cache_creation_input_tokens": max(written, 0),
+            },
+        }
@@ -0,0 +1,202 @@
+import random
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from gql.transport import Transport
+from graphql import ExecutionResult, parse
+from graphql.language import FieldNode, OperationDefinitionNode
+
+from civic_chat.mock._server import JsonServer
+
+#
+# A local stand-in for the CIViC GraphQL API, serving a generated dataset with the same shape as the real one.
+# It understands the root fields the tools use, their filters and first/after paging, and returns only the
+# fields a query selects.  It does not answer schema introspection, so point clients at it with
+# fetch_schema_from_transport=False.
+#
+# MockTransport answers from the same dataset in-process, without HTTP, for measuring the tools rather than the
+# network stack.
+#
+
+DEFAULT_PAGE_SIZE = 50
+
+DISEASES = [
+    "Colorectal Cancer", "Melanoma", "Lung Non-small Cell Carcinoma", "Breast Cancer", "Acute Myeloid Leukemia",
+    "Pancreatic Cancer", "Thyroid Cancer", "Ovarian Cancer", "Glioblastoma", "Prostate Cancer",
+]
+DISEASE_ALIASES = {"Colorectal Cancer": ["CRC", "Colorectal Carcinoma"], "Lung Non-small Cell Carcinoma": ["NSCLC"]}
+GENES = {
+    "KRAS": ["G12C", "G12D", "G12V", "G13D", "Q61H", "Mutation"],
+    "BRAF": ["V600E", "V600K", "Mutation"],
+    "EGFR": ["L858R", "T790M", "Exon 19 Deletion", "Amplification"],
+    "NRAS": ["Q61K", "Mutation"],
+    "PIK3CA": ["E545K", "H1047R"],
+    "ERBB2": ["Amplification"],
+    "BRCA1": ["Mutation"],
+    "TP53": ["Mutation"],
+}
+THERAPIES = ["Cetuximab", "Panitumumab", "Sotorasib", "Adagrasib", "Vemurafenib", "Dabrafenib", "Osimertinib", "Erlotinib"]
+
+
+def build_dataset(evidence_count: int = 2000, seed: int = 0) -> Dict[str, List[dict]]:
+    """Generate diseases, genes, molecular profiles and evidence items shaped like the CIViC API returns them."""
+    rng = random.Random(seed)
+    diseases = [
+        {
+            "id": i + 1, "name": name, "displayName": name, "doid": str(9256 + i),
+            "diseaseAliases": DISEASE_ALIASES.get(name, []), "link": "/diseases/%d" % (i + 1),
+        }
+        for i, name in enumerate(DISEASES)
+    ]
+    profiles = []
+    for gene, variants in GENES.items():
+        for variant in variants:
+            profile_id = len(profiles) + 1
+            profiles.append({
+                "id": profile_id, "name": "%s %s" % (gene, variant),
+                "description": "The %s %s molecular profile." % (gene, variant),
+                "link": "/molecular-profiles/%d" % profile_id,
+            })
+    genes = [{"id": i + 1, "name": gene, "link": "/genes/%d" % (i + 1)} for i, gene in enumerate(GENES)]
+    therapies = [
+        {"id": i + 1, "ncitId": "C%d" % (1000 + i), "name": name, "therapyAliases": [name.upper()]}
+        for i, name in enumerate(THERAPIES)
+    ]
+    evidence = []
+    for i in range(evidence_count):
+        profile = rng.choice(profiles)
+        disease = rng.choice(diseases)
+        evidence.append({
+            "id": i + 1,
+            "status": rng.choices(["ACCEPTED", "SUBMITTED", "REJECTED"], [8, 1, 1])[0],
+            "molecularProfile": {k: profile[k] for k in ["id", "name", "link"]},
+            "evidenceType": rng.choices(["PREDICTIVE", "PROGNOSTIC", "DIAGNOSTIC"], [6, 2, 2])[0],
+            "evidenceLevel": rng.choice("ABCDE"),
+            "evidenceRating": rng.randint(1, 5),
+            "evidenceDirection": rng.choices(["SUPPORTS", "DOES_NOT_SUPPORT"], [4, 1])[0],
+            "phenotypes": [],
+            "description": "Patients with %s %s treated with %s showed a %s response (%d)." % (
+                profile["name"], disease["name"], rng.choice(THERAPIES), rng.choice(["partial", "complete", "poor"]), i
+            ),
+            "disease": {k: disease[k] for k in ["id", "doid", "name", "diseaseAliases", "displayName"]},
+            "therapies": rng.sample(therapies, rng.randint(0, 2)),
+            "source": {
+                "ascoAbstractId": None, "citationId": str(20000000 + i), "pmcId": None,
+                "sourceType": "PUBMED", "title": "A study of %s in %s" % (profile["name"], disease["name"]),
+            },
+            "therapyInteractionType": None,
+        })
+    return {"diseases": diseases, "genes": genes, "molecularProfiles": profiles, "evidenceItems": evidence}
+
+
+def _argument_values(field: FieldNode) -> Dict[str, Any]:
+    values = {}
+    for argument in field.arguments:
+        value = argument.value
+        values[argument.name.value] = getattr(value, "value", None)
+    return values
+
+
+def _project(value: Any, selection_set) -> Any:
+    # Keep only the selected fields, recursively, the way a GraphQL server shapes its response.
+    if selection_set is None or value is None:
+        return value
+    if isinstance(value, list):
+        return [_project(v, selection_set) for v in value]
+    return {
+        field.name.value: _project(value.get(field.name.value), field.selection_set)
+        for field in selection_set.selections if isinstance(field, FieldNode)
+    }
+
+
+class MockGraphQLServer(JsonServer):
+    def __init__(self, dataset: Optional[Dict[str, List[dict]]] = None, **kwargs):
+        super().__init__(**kwargs)
+        self.dataset = dataset if dataset is not None else build_dataset()
+
+    def _filter(self, root_field: str, args: Dict[str, Any]) -> List[dict]:
+        nodes = self.dataset[root_field]
+        if args.get("name"):
+            name = args["name"].lower()
+            nodes = [n for n in nodes if name in n["name"].lower()]
+        if root_field == "evidenceItems":
+            if args.get("status", "ALL") != "ALL":
+                nodes = [n for n in nodes if n["status"] == args["status"]]
+            if args.get("evidenceType"):
+                nodes = [n for n in nodes if n["evidenceType"] == args["evidenceType"]]
+            if args.get("diseaseId") is not None:
+                nodes = [n for n in nodes if n["disease"]["id"] == int(args["diseaseId"])]
+            if args.get("molecularProfileId") is not None:
+                nodes = [n for n in nodes if n["molecularProfile"]["id"] == int(args["molecularProfileId"])]
+        return nodes
+
+    def _connection(self, root_field: str, args: Dict[str, Any]) -> dict:
+        nodes = self._filter(root_field, args)
+        start = int(args["after"]) if args.get("after") else 0
+        first = int(args["first"]) if args.get("first") else DEFAULT_PAGE_SIZE
+        page = nodes[start:start + first]
+        end = start + len(page)
+        return {
+            "totalCount": len(nodes),
+            "pageInfo": {"hasNextPage": end < len(nodes), "endCursor": str(end) if page else None},
+            "nodes": page,
+        }
+
+    def execute(self, query: str) -> Tuple[int, dict]:
+        document = parse(query)
+        data = {}
+        for definition in document.definitions:
+            if not isinstance(definition, OperationDefinitionNode):
+                continue
+            for field in definition.selection_set.selections:
+                root_field = field.name.value
+                if root_field not in self.dataset:
+                    return 200, {"errors": [{"message": "Field '%s' doesn't exist on type 'Query'" % root_field}]}
+                data[root_field] = _project(self._connection(root_field, _argument_values(field)), field.selection_set)
+        return 200, {"data": data}
+
+    def handle(self, method: str, path: str, body: Any) -> Tuple[int, Any]:
+        if method != "POST" or not body or "query" not in body:
+            return 400, {"errors": [{"message": "expected a POST with a query"}]}
+        return self.execute(body["query"])
+
+
+def point_civic_tools_at(url: str, cache=None):
+    """Send the CIViC tools' queries to another endpoint, such as a mock server.  Returns the wrapper it replaced."""
+    from civic_chat.tools._gql import GraphQLAPIWrapperExtended
+    from civic_chat.tools.civic_db_gql import civic_tool
+
+    previous = civic_tool.graphql_wrapper
+    civic_tool.graphql_wrapper = GraphQLAPIWrapperExtended(
+        graphql_endpoint=re.sub("/*$", "", url) + "/graphql", fetch_schema_from_transport=False, cache=cache,
+    )
+    return previous
+
+
+class MockTransport(Transport):
+    """A gql transport that executes queries against a MockGraphQLServer's dataset in the calling thread."""
+
+    def __init__(self, server: MockGraphQLServer):
+        self.server = server
+
+    def execute(self, request, *args, **kwargs) -> ExecutionResult:
+        with self.server._lock:
+            self.server.requests.append(("POST", "/graphql", request.payload))
+        _, response = self.server.execute(request.payload["query"])
+        return ExecutionResult(data=response.get("data"), errors=response.get("errors"))
+
+
+def point_civic_tools_at_transport(server: MockGraphQLServer, cache=None):
+    """Send the CIViC tools' queries to a MockGraphQLServer in-process, never started.  Returns the wrapper it replaced."""
+    from gql import Client
+    from civic_chat.tools._gql import GraphQLAPIWrapperExtended
+    from civic_chat.tools.civic_db_gql import civic_tool
+
+    previous = civic_tool.graphql_wrapper
+    wrapper = GraphQLAPIWrapperExtended(
+        graphql_endpoint="http://mock/graphql", fetch_schema_from_transport=False, cache=cache,
+        transport_factory=lambda: MockTransport(server),
+    )
+    wrapper.gql_client = Client(transport=MockTransport(server), fetch_schema_from_transport=False)
+    civic_tool.graphql_wrapper = wrapper
+    return previous
@@ -0,0 +1,102 @@
+import ast
+import json
+import re
+import time
+from typing import Any, List, Optional
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+#
+# A fake chat model that plays the usual CIViC tool sequence through the ReAct agent, with a configurable latency,
+# so the agent loop can be driven end to end with no model behind it.  It writes its steps as ReAct text, or as the
+# JSON blobs of the structured chat agent when the prompt asks for those.
+#
+
+QUESTION_GENE = re.compile(r'gene "([^"]+)"')
+QUESTION_DISEASE = re.compile(r"(?:in relation to|in|for) ([A-Z][\w -]+?)\?")
+OBSERVATION = re.compile(r"Observation: (.*?)\nThought:", re.DOTALL)
+
+# What the agent asks when it stops early, at its step or time budget.
+STOPPED_EARLY = ("I now need to return a final answer", "The time for this question is up")
+
+# How many molecular profiles the scripted model asks for evidence about.
+PROFILES_PER_QUESTION = 3
+
+
+# Only the structured chat agent's prompt has this placeholder.
+JSON_BLOB = "$JSON_BLOB"
+
+
+def _react_step(action: str, action_input: str) -> str:
+    return "Thought: I should use %s.\nAction: %s\nAction Input: %s" % (action, action, action_input)
+
+
+def _json_step(thought: str, action: str, action_input: Any) -> str:
+    blob = json.dumps({"action": action, "action_input": action_input}, indent=2)
+    return "Thought: %s\nAction:\n```\n%s\n```" % (thought, blob)
+
+
+class ScriptedReactChatModel(BaseChatModel):
+    """Answers questions like 'What is the evidence of mutations associated with the gene "KRAS" in relation to
+    Colorectal Cancer?' by resolving the disease, then the gene's molecular profiles, then fetching their evidence.
+    Questions asking for the "strongest" evidence use the summary tool for the last step.
+    """
+
+    latency: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted-react"
+
+    def next_step(self, prompt: str) -> str:
+        structured = JSON_BLOB in prompt
+        # Both templates describe the format before the real question, so only what follows the question counts.
+        prompt = prompt.split(JSON_BLOB)[-1] if structured else prompt.split("\nQuestion:")[-1]
+        gene = QUESTION_GENE.search(prompt)
+        disease = QUESTION_DISEASE.search(prompt)
+        observations = OBSERVATION.findall(prompt)
+
+        def step(action: str, arguments: dict) -> str:
+            # A single argument is given bare, as models usually do.
+            action_input = arguments if len(arguments) > 1 else next(iter(arguments.values()))
+            if structured:
+                return _json_step("I should use %s." % action, action, action_input)
+            if len(arguments) > 1:
+                action_input = "(%d, [%s])" % (
+                    arguments["disease_id"], ",".join(str(i) for i in arguments["molecular_profile_ids"])
+                )
+            return _react_step(action, action_input)
+
+        def final(thought: str, answer: str) -> str:
+            if structured:
+                return _json_step(thought, "Final Answer", answer)
+            return "Thought: %s\nFinal Answer: %s" % (thought, answer)
+
+        if any(marker in prompt for marker in STOPPED_EARLY):
+            return final("I am out of time", "Partial answer after %d steps." % len(observations))
+        if gene is None or disease is None:
+            return final("I now know the final answer", "I can only answer questions about a gene in a disease.")
+        if len(observations) == 0:
+            return step("get_disease_id", {"disease_name": disease.group(1)})
+        if len(observations) == 1:
+            return step("get_gene_molecular_profile_ids", {"gene_name": gene.group(1)})
+        if len(observations) == 2:
+            disease_id = int(observations[0].strip())
+            profile_ids = ast.literal_eval(observations[1].strip())[:PROFILES_PER_QUESTION]
+            tool = (
+                "summarize_disease_mutations_for_profiles" if "strongest" in prompt
+                else "get_disease_predictive_mutations_for_profiles"
+            )
+            return step(tool, {"disease_id": disease_id, "molecular_profile_ids": profile_ids})
+        return final("I now know the final answer", "Found %d characters of evidence for %s in %s." % (
+            len(observations[-1]), gene.group(1), disease.group(1)
+        ))
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None,
+                  **kwargs: Any) -> ChatResult:
+        if self.latency:
+            time.sleep(self.latency)
+        prompt = "\n".join(str(message.content) for message in messages)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.next_step(prompt)))])
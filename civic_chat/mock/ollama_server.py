@@ -0,0 +1,98 @@
+import re
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional, Tuple
+
+from civic_chat.mock._server import JsonServer
+
+#
+# A local stand-in for an Ollama server.  Models load on their first request, which takes load_seconds, and stay
+# loaded for the keep_alive the last request gave.  It answers /api/generate and /api/chat without streaming, with
+# a fixed reply.
+#
+
+DEFAULT_MODEL_INFO = {
+    "general.architecture": "llama",
+    "llama.block_count": 32,
+    "llama.embedding_length": 4096,
+    "llama.attention.head_count": 32,
+    "llama.attention.head_count_kv": 8,
+}
+DEFAULT_KEEP_ALIVE = 5 * 60
+
+
+def _seconds(keep_alive: Any) -> float:
+    if keep_alive is None:
+        return DEFAULT_KEEP_ALIVE
+    if isinstance(keep_alive, (int, float)):
+        return keep_alive
+    match = re.fullmatch(r"(-?[\d.]+)([smh]?)", str(keep_alive))
+    return float(match.group(1)) * {"": 1, "s": 1, "m": 60, "h": 3600}[match.group(2)]
+
+
+class MockOllamaServer(JsonServer):
+    def __init__(self, models: Optional[Dict[str, int]] = None, load_seconds: float = 0.3, reply: str = "Hello",
+                 **kwargs):
+        super().__init__(**kwargs)
+        # Model name to file size in bytes.
+        self.models = models if models is not None else {"deepseek-r1:8b": 4_900_000_000}
+        self.load_seconds = load_seconds
+        self.reply = reply
+        self.loads = 0
+        self.loaded: Dict[str, float] = {}
+
+    def _expire(self):
+        now = time.time()
+        self.loaded = {model: until for model, until in self.loaded.items() if until > now}
+
+    def _run(self, body: dict) -> Tuple[int, Any]:
+        model = body.get("model")
+        if model not in self.models:
+            return 404, {"error": "model '%s' not found" % model}
+        self._expire()
+        load_duration = 0
+        if model not in self.loaded:
+            time.sleep(self.load_seconds)
+            self.loads += 1
+            load_duration = int(self.load_seconds * 1e9)
+        keep_alive = _seconds(body.get("keep_alive"))
+        if keep_alive == 0:
+            self.loaded.pop(model, None)
+        else:
+            self.loaded[model] = time.time() + (keep_alive if keep_alive > 0 else 10 ** 9)
+        return 200, {
+            "model": model,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "done": True,
+            "done_reason": "stop",
+            "load_duration": load_duration,
+            "total_duration": load_duration,
+        }
+
+    def handle(self, method: str, path: str, body: Any) -> Tuple[int, Any]:
+        if path == "/api/tags":
+            return 200, {"models": [{"name": m, "model": m, "size": size} for m, size in self.models.items()]}
+        if path == "/api/ps":
+            self._expire()
+            return 200, {"models": [
+                {
+                    "name": m, "model": m, "size": self.models[m], "size_vram": self.models[m],
+                    "expires_at": datetime.fromtimestamp(min(until, 2 ** 31), timezone.utc).isoformat(),
+                }
+                for m, until in self.loaded.items()
+            ]}
+        if path == "/api/show":
+            if body.get("model") not in self.models:
+                return 404, {"error": "model not found"}
+            return 200, {"model_info": DEFAULT_MODEL_INFO, "details": {"format": "gguf"}}
+        if path == "/api/generate":
+            status, response = self._run(body)
+            if status == 200 and body.get("prompt"):
+                response["response"] = self.reply
+            return status, response
+        if path == "/api/chat":
+            status, response = self._run(body)
+            if status == 200:
+                response["message"] = {"role": "assistant", "content": self.reply}
+            return status, response
+        return 404, {"error": "not found"}
@@ -0,0 +1,79 @@
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Dict, Tuple
+
+import typer
+
+from civic_chat.mock._server import JsonServer
+
+#
+# A stand-in for the LiteLLM proxy, or any OpenAI-compatible server, for measuring the client side of the proxy path
+# without real providers.  It answers chat completions after a configurable latency, and records how many requests
+# each model had in flight at once, so concurrency limits can be checked from the server's side.
+#
+#     python -m civic_chat.mock.openai_server --port 4000 --latency 0.5
+#
+
+
+class MockOpenAIServer(JsonServer):
+    def __init__(self, reply: str = "Final Answer: done", latency: float = 0.0, **kwargs):
+        super().__init__(**kwargs)
+        self.reply = reply
+        # The base server sleeps before handling, outside the in-flight count, so the latency is spent here instead.
+        self.response_latency = latency
+        self.in_flight: Dict[str, int] = defaultdict(int)
+        self.max_in_flight: Dict[str, int] = defaultdict(int)
+        self._flight_lock = threading.Lock()
+
+    def handle(self, method: str, path: str, body: Any) -> Tuple[int, Any]:
+        if method == "GET" and path.endswith("/models"):
+            return 200, {"object": "list", "data": [{"id": "mock", "object": "model", "owned_by": "mock"}]}
+        if method != "POST" or not path.endswith("/chat/completions") or not body:
+            return 404, {"error": {"message": "not found: %s %s" % (method, path), "type": "invalid_request_error"}}
+        model = body.get("model", "")
+        with self._flight_lock:
+            self.in_flight[model] += 1
+            self.max_in_flight[model] = max(self.max_in_flight[model], self.in_flight[model])
+        try:
+            if self.response_latency:
+                time.sleep(self.response_latency)
+        finally:
+            with self._flight_lock:
+                self.in_flight[model] -= 1
+        prompt_tokens = sum(len(str(m.get("content", ""))) for m in body.get("messages") or []) // 4
+        completion_tokens = max(1, len(self.reply) // 4)
+        return 200, {
+            "id": "chatcmpl-mock-%d" % len(self.requests),
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": self.reply},
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+
+
+def serve(port: int = typer.Option(4000, help="Port to listen on."),
+          latency: float = typer.Option(0.5, help="Seconds to wait before each answer."),
+          reply: str = typer.Option("Final Answer: done", help="What every completion says.")):
+    """ Run the stand-in until interrupted.
+    """
+    server = MockOpenAIServer(reply=reply, latency=latency, port=port)
+    print(f"mock OpenAI server on {server.start()}/v1", flush=True)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    typer.run(serve)
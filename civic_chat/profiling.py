@@ -0,0 +1,196 @@
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Any, Dict, List, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+#
+# Memory profiling for agent runs, enabled with --profile-memory on the CLI.
+# Every LLM step and tool call records the process RSS when it ended, the peaks of RSS and of traced Python
+# allocations while it ran, and the allocation sites that grew the most.  Tool calls also record the size of the
+# result handed back to the model.
+#
+# tracemalloc keeps one peak for the whole process, and resetting it would spoil the peak for anyone else measuring,
+# so a profiler never resets it.  A step's peak is the process peak when that rose during the step, and otherwise
+# the most traced memory a sampling thread saw while the step ran.  Peak RSS works the same way, with the lifetime
+# peak from getrusage.  Off Linux there is no /proc to read the current RSS from, so a step only has a peak RSS
+# when it raised the lifetime peak.
+#
+
+TOP_SITES = 10
+STEP_TOP_SITES = 3
+TRACEBACK_FRAMES = 8
+# Seconds between samples of traced memory and RSS while steps run.
+SAMPLE_INTERVAL = 0.005
+
+
+def read_rss() -> Optional[int]:
+    """Current resident set size of this process, in bytes, or None where there is no /proc, as off Linux."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def read_peak_rss() -> Optional[int]:
+    """The most resident memory this process ever had, in bytes, or None where getrusage is missing, as on Windows."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _max(*values: Optional[int]) -> Optional[int]:
+    values = [v for v in values if v is not None]
+    return max(values) if values else None
+
+
+def _format_bytes(n: float) -> str:
+    for unit in ["B", "KiB", "MiB"]:
+        if abs(n) < 1024:
+            return "%.1f%s" % (n, unit)
+        n /= 1024
+    return "%.1fGiB" % n
+
+
+# Leave out what the profiler allocates for itself.
+_SELF_FILTERS = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+
+
+def _top_sites(after: tracemalloc.Snapshot, before: tracemalloc.Snapshot, limit: int) -> List[str]:
+    stats = after.filter_traces(_SELF_FILTERS).compare_to(before.filter_traces(_SELF_FILTERS), "lineno")
+    return [
+        "%s:%d %s in %d blocks" % (s.traceback[0].filename, s.traceback[0].lineno, _format_bytes(s.size_diff), s.count_diff)
+        for s in stats[:limit] if s.size_diff > 0
+    ]
+
+
+class MemoryProfiler(BaseCallbackHandler):
+    def __init__(self, sample_interval: float = SAMPLE_INTERVAL):
+        self.steps: List[Dict[str, Any]] = []
+        self.sample_interval = sample_interval
+        self._running: Dict[UUID, Dict[str, Any]] = {}
+        self._first_snapshot: Optional[tracemalloc.Snapshot] = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEBACK_FRAMES)
+        self._first_snapshot = tracemalloc.take_snapshot()
+        if self._sampler is None:
+            self._stopped.clear()
+            self._sampler = threading.Thread(target=self._sample, daemon=True, name="memory profiler")
+            self._sampler.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._sampler is not None:
+            self._sampler.join()
+            self._sampler = None
+
+    def _sample(self):
+        while not self._stopped.wait(self.sample_interval):
+            if not self._running:
+                continue
+            traced = tracemalloc.get_traced_memory()[0]
+            rss = read_rss()
+            with self._lock:
+                for step in self._running.values():
+                    step["traced_max"] = max(step["traced_max"], traced)
+                    step["rss_max"] = _max(step["rss_max"], rss)
+
+    def _begin(self, run_id: UUID, kind: str, name: str):
+        snapshot = tracemalloc.take_snapshot()
+        traced, process_peak = tracemalloc.get_traced_memory()
+        with self._lock:
+            self._running[run_id] = {
+                "kind": kind,
+                "name": name,
+                "t0": time.time(),
+                "traced0": traced,
+                "traced_max": traced,
+                "process_peak0": process_peak,
+                "rss_max": read_rss(),
+                "process_peak_rss0": read_peak_rss(),
+                "snapshot": snapshot,
+            }
+
+    def _end(self, run_id: UUID, result_bytes: Optional[int] = None):
+        traced, process_peak = tracemalloc.get_traced_memory()
+        with self._lock:
+            step = self._running.pop(run_id, None)
+        if step is None:
+            return
+        before = step.pop("snapshot")
+        traced_max = max(step.pop("traced_max"), traced)
+        if process_peak > step.pop("process_peak0"):
+            # The process reached a new peak during the step, and that is the most it had at once.
+            traced_max = max(traced_max, process_peak)
+        rss, process_peak_rss = read_rss(), read_peak_rss()
+        peak_rss = _max(step.pop("rss_max"), rss)
+        process_peak_rss0 = step.pop("process_peak_rss0")
+        if process_peak_rss is not None and process_peak_rss0 is not None and process_peak_rss > process_peak_rss0:
+            peak_rss = _max(peak_rss, process_peak_rss)
+        step.update(
+            rss=rss,
+            peak_rss=peak_rss,
+            elapsed=time.time() - step.pop("t0"),
+            allocated=traced - step["traced0"],
+            traced_peak=traced_max - step.pop("traced0"),
+            result_bytes=result_bytes,
+            top_sites=_top_sites(tracemalloc.take_snapshot(), before, STEP_TOP_SITES),
+        )
+        self.steps.append(step)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id: UUID, **kwargs):
+        self._begin(run_id, "llm", (serialized or {}).get("name") or "llm")
+
+    def on_llm_start(self, serialized, prompts, *, run_id: UUID, **kwargs):
+        self._begin(run_id, "llm", (serialized or {}).get("name") or "llm")
+
+    def on_llm_end(self, response, *, run_id: UUID, **kwargs):
+        self._end(run_id)
+
+    def on_llm_error(self, error, *, run_id: UUID, **kwargs):
+        self._end(run_id)
+
+    def on_tool_start(self, serialized, input_str, *, run_id: UUID, **kwargs):
+        self._begin(run_id, "tool", (serialized or {}).get("name") or "tool")
+
+    def on_tool_end(self, output, *, run_id: UUID, **kwargs):
+        # What the model sees is the string form of the result.
+        content = getattr(output, "content", output)
+        self._end(run_id, len(str(content).encode()))
+
+    def on_tool_error(self, error, *, run_id: UUID, **kwargs):
+        self._end(run_id)
+
+    def report(self) -> str:
+        lines = ["%-5s %-45s %8s %11s %11s %11s %11s %11s" % (
+            "kind", "name", "seconds", "allocated", "traced peak", "rss", "peak rss", "result"
+        )]
+        for step in self.steps:
+            lines.append("%-5s %-45s %8.2f %11s %11s %11s %11s %11s" % (
+                step["kind"], step["name"][:45], step["elapsed"], _format_bytes(step["allocated"]),
+                _format_bytes(step["traced_peak"]),
+                _format_bytes(step["rss"]) if step["rss"] is not None else "",
+                _format_bytes(step["peak_rss"]) if step["peak_rss"] is not None else "",
+                _format_bytes(step["result_bytes"]) if step["result_bytes"] is not None else "",
+            ))
+            lines.extend("      " + site for site in step["top_sites"])
+        if self._first_snapshot is not None:
+            lines.append("top allocation sites over the run:")
+            lines.extend("  " + site for site in _top_sites(tracemalloc.take_snapshot(), self._first_snapshot, TOP_SITES))
+        return "\n".join(lines)
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+
+"""
+Serve the chat agent over HTTP from several worker processes that share one listening socket and one cache.
+
+The launcher opens the socket, then forks the workers, which all accept connections from it, so the kernel spreads
+connections across them.  Every worker uses the shared SQLite cache, so a GraphQL result, schema or LLM response
+fetched by one worker is a hit for all of them.  Workers that die are replaced.
+
+    python -m civic_chat.server --workers 4 --port 8000
+    curl -s localhost:8000/chat -d '{"question": "What is the evidence for KRAS in Colorectal Cancer?"}'
+    curl -s localhost:8000/metrics
+
+Each worker serves its own metrics, labelled with its process ID, from whichever worker takes the connection.
+
+With --mock, the workers use the local mock GraphQL server and a scripted LLM, for trying the deployment offline.
+"""
+
+import json
+import os
+import signal
+import socket
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Set
+
+import typer
+
+from civic_chat.deadline import Deadline
+from civic_chat.env import SHARED_CACHE_FILE
+from civic_chat.metrics import agent_metrics, registry
+
+
+def civic_function_tools() -> list:
+    from civic_chat.tools.civic_disease import get_disease_id
+    from civic_chat.tools.civic_evidence_search import search_evidence
+    from civic_chat.tools.civic_evidence_semantic import semantic_search_evidence
+    from civic_chat.tools.civic_evidence_summary import summarize_disease_mutations, summarize_disease_mutations_for_profiles
+    from civic_chat.tools.civic_mutation import get_gene_molecular_profile_ids
+    from civic_chat.tools.civic_mutation_evidence import (
+        count_disease_mutations_for_profiles, get_all_disease_mutations, get_disease_predictive_mutations_brief_for_profiles,
+        get_disease_predictive_mutations_for_profiles,
+    )
+
+    return [
+        get_disease_id,
+        get_gene_molecular_profile_ids,
+        get_all_disease_mutations,
+        get_disease_predictive_mutations_for_profiles,
+        get_disease_predictive_mutations_brief_for_profiles,
+        count_disease_mutations_for_profiles,
+        summarize_disease_mutations,
+        summarize_disease_mutations_for_profiles,
+        search_evidence,
+        semantic_search_evidence,
+    ]
+
+
+class ChatHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Set on the class by the worker, once it has built its agent.
+    agent_exec = None
+
+    def _send(self, status: int, response: dict):
+        self._send_bytes(status, json.dumps(response).encode(), "application/json")
+
+    def _send_bytes(self, status: int, data: bytes, content_type: str):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send(200, {"worker": os.getpid()})
+        elif self.path == "/metrics":
+            self._send_bytes(200, registry.expose().encode(), "text/plain; version=0.0.4; charset=utf-8")
+        else:
+            self._send(404, {"error": "not found"})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            question = json.loads(self.rfile.read(length))["question"]
+        except (ValueError, KeyError, TypeError):
+            self._send(400, {"error": 'expected a JSON body with a "question"'})
+            return
+        if self.path != "/chat":
+            self._send(404, {"error": "not found"})
+            return
+        t0 = time.time()
+        try:
+            # Each request gets its own deadline, which the tools of the shared agent find in their context.
+            with Deadline(max_steps=self.agent_exec.max_iterations) as deadline:
+                config = {"callbacks": [deadline, agent_metrics]}
+                answer = self.agent_exec.invoke({"input": question}, config=config)["output"]
+        except Exception as e:
+            self._send(500, {"error": str(e), "worker": os.getpid()})
+            return
+        self._send(200, {"answer": answer, "elapsed": time.time() - t0, "worker": os.getpid()})
+
+    def log_message(self, *args):
+        pass
+
+
+def _worker(sock: socket.socket, cache_file: str, mock_url: Optional[str], mock_llm_latency: float):
+    # Everything with connections, threads or clients is created here, after the fork, so nothing is shared by accident.
+    from civic_chat.cache import use_shared_cache
+    from civic_chat.cli import create_agent_executor
+
+    if mock_url:
+        from civic_chat.mock.graphql_server import point_civic_tools_at
+        from civic_chat.mock.llm import ScriptedReactChatModel
+        point_civic_tools_at(mock_url)
+        llm = ScriptedReactChatModel(latency=mock_llm_latency)
+    else:
+        from civic_chat.llm_client import llm
+    use_shared_cache(cache_file)
+    registry.const_labels = {"worker": str(os.getpid())}
+    ChatHandler.agent_exec = create_agent_executor(civic_function_tools(), llm, verbose=False)
+
+    server = ThreadingHTTPServer(sock.getsockname(), ChatHandler, bind_and_activate=False)
+    server.socket = sock
+    server.daemon_threads = True
+    signal.signal(signal.SIGTERM, lambda *_: os._exit(0))
+    server.serve_forever()
+
+
+def _spawn(sock: socket.socket, *args) -> int:
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            _worker(sock, *args)
+        except BaseException:
+            import traceback
+            traceback.print_exc()
+            code = 1
+        finally:
+            # Never return into the launcher's code, or run its exit handlers, from a worker.
+            os._exit(code)
+    return pid
+
+
+def serve(
+    workers: int = typer.Option(os.cpu_count() or 1, help="Worker processes."),
+    host: str = typer.Option("127.0.0.1", help="Address to listen on."),
+    port: int = typer.Option(8000, help="Port to listen on, or 0 for any free port."),
+    cache_file: str = typer.Option(SHARED_CACHE_FILE, help="The SQLite cache shared by the workers."),
+    mock: bool = typer.Option(False, help="Answer from the mock GraphQL server and a scripted LLM."),
+    mock_llm_latency: float = typer.Option(0.2, help="Seconds the scripted LLM takes per step, with --mock."),
+):
+    """ Start the workers on a shared socket, and replace any that exit until stopped.
+    """
+    mock_server = None
+    mock_url = None
+    if mock:
+        from civic_chat.mock.graphql_server import MockGraphQLServer
+        mock_server = MockGraphQLServer()
+        mock_url = mock_server.start()
+
+    # Import the agent and tools once here, so the workers share those pages instead of each importing them.
+    from civic_chat.cli import create_agent_executor  # noqa: F401
+    civic_function_tools()
+
+    sock = socket.create_server((host, port), backlog=128)
+    print(f"listening on http://{host}:{sock.getsockname()[1]} with {workers} workers, cache {cache_file}", flush=True)
+
+    children: Set[int] = set()
+    stopping = False
+
+    def stop(*_):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    args = (cache_file, mock_url, mock_llm_latency)
+    for _ in range(workers):
+        children.add(_spawn(sock, *args))
+
+    try:
+        while not stopping:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                pid = 0
+            if pid in children:
+                children.remove(pid)
+                print(f"worker {pid} exited with status {status}, replacing it", flush=True)
+                children.add(_spawn(sock, *args))
+            time.sleep(0.2)
+    finally:
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in children:
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+        sock.close()
+        if mock_server is not None:
+            mock_server.stop()
+
+
+if __name__ == "__main__":
+    typer.run(serve)
@@ -0,0 +1,142 @@
+import atexit
+import pickle
+import threading
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional, Tuple
+
+from civic_chat.deadline import Deadline, current_deadline
+
+#
+# Results the tools fetched during the current session, kept so code run in the Python REPL workers can analyse
+# them directly, rather than the LLM pasting them back into its code as text.
+# Results are only kept while the REPL tool is enabled, and only copied into shared memory when a REPL call asks for
+# them.  Each question keeps its own, by the Deadline it runs under, and they are freed when the question ends.
+#
+# A result is published as a DataFrame pickled with protocol 5, its column arrays out of band, each at an aligned
+# offset of one shared memory segment.  The worker unpickles the small stream with views of those buffers, so the
+# numeric columns of its DataFrame are the shared memory itself rather than a copy of it.
+#
+
+# Byte alignment of each column buffer in a segment, so the arrays on top of them are aligned too.
+BUFFER_ALIGNMENT = 64
+
+# A segment name and the (offset, size) spans of the pickle stream, then of each out-of-band buffer.
+FrameSegment = Tuple[str, List[Tuple[int, int]]]
+
+
+def flatten_evidence(rows: List[dict]) -> List[dict]:
+    """Flatten nested evidence nodes into one level of columns, such as "molecularProfile.name" and "therapies"."""
+    flat_rows = []
+    for row in rows:
+        flat = {}
+        for key, value in row.items():
+            if isinstance(value, dict):
+                for sub_key, sub_value in value.items():
+                    flat["%s.%s" % (key, sub_key)] = sub_value
+            elif isinstance(value, list) and value and isinstance(value[0], dict):
+                # Lists of named things, like therapies or phenotypes, become a comma separated list of their names.
+                flat[key] = ", ".join(str(v.get("name", v.get("id"))) for v in value)
+            else:
+                flat[key] = value
+        flat_rows.append(flat)
+    return flat_rows
+
+
+def _publish(rows: List[dict]) -> Tuple[shared_memory.SharedMemory, List[Tuple[int, int]]]:
+    flat = flatten_evidence(rows)
+    try:
+        import pandas as pd
+        frame = pd.DataFrame(flat)
+    except ImportError:
+        frame = flat
+    buffers: List[pickle.PickleBuffer] = []
+    stream = pickle.dumps(frame, protocol=5, buffer_callback=buffers.append)
+    parts = [memoryview(stream)] + [buffer.raw() for buffer in buffers]
+    spans = []
+    offset = 0
+    for part in parts:
+        offset = -(-offset // BUFFER_ALIGNMENT) * BUFFER_ALIGNMENT
+        spans.append((offset, part.nbytes))
+        offset += part.nbytes
+    shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+    for part, (start, size) in zip(parts, spans):
+        shm.buf[start:start + size] = part.cast("B")
+    return shm, spans
+
+
+def attach_frame(segment: FrameSegment) -> Tuple[shared_memory.SharedMemory, object]:
+    """Map a published result, and unpickle it on top of the mapping.  The segment must stay open while it is used."""
+    name, spans = segment
+    shm = shared_memory.SharedMemory(name=name)
+    (start, size), buffer_spans = spans[0], spans[1:]
+    buffers = [shm.buf[offset:offset + length] for offset, length in buffer_spans]
+    return shm, pickle.loads(shm.buf[start:start + size], buffers=buffers)
+
+
+class _Frames:
+    def __init__(self):
+        self.rows: Dict[str, List[dict]] = {}
+        self.published: Dict[str, Tuple[shared_memory.SharedMemory, List[Tuple[int, int]]]] = {}
+
+    def unpublish(self, name: str):
+        published = self.published.pop(name, None)
+        if published is not None:
+            published[0].close()
+            published[0].unlink()
+
+    def clear(self):
+        for name in list(self.published):
+            self.unpublish(name)
+        self.rows.clear()
+
+
+class SessionFrames:
+    def __init__(self, enabled: bool = False):
+        # Set when the Python REPL tool is given to the agent; nothing else reads the frames.
+        self.enabled = enabled
+        # The frames of each question by its Deadline, and of calls outside any question under None.
+        self._sessions: Dict[Optional[Deadline], _Frames] = {}
+        self._lock = threading.Lock()
+        atexit.register(self.clear)
+
+    def record(self, name: str, rows: List[dict]):
+        """Keep a tool result of the current question under a name, replacing an earlier result with the same name."""
+        if not self.enabled:
+            return
+        deadline = current_deadline.get()
+        with self._lock:
+            frames = self._sessions.get(deadline)
+            new = frames is None
+            if new:
+                frames = self._sessions[deadline] = _Frames()
+            frames.rows[name] = rows
+            frames.unpublish(name)
+        if new and deadline is not None:
+            deadline.on_exit(lambda: self.end(deadline))
+
+    def manifest(self) -> Dict[str, FrameSegment]:
+        """Publish any new results of the current question to shared memory, and return the segment of each frame."""
+        with self._lock:
+            frames = self._sessions.get(current_deadline.get())
+            if frames is None:
+                return {}
+            for name, rows in frames.rows.items():
+                if name not in frames.published:
+                    frames.published[name] = _publish(rows)
+            return {name: (shm.name, spans) for name, (shm, spans) in frames.published.items()}
+
+    def end(self, deadline: Optional[Deadline]):
+        """Free the frames of a question."""
+        with self._lock:
+            frames = self._sessions.pop(deadline, None)
+            if frames is not None:
+                frames.clear()
+
+    def clear(self):
+        with self._lock:
+            for frames in self._sessions.values():
+                frames.clear()
+            self._sessions.clear()
+
+
+session_frames = SessionFrames()
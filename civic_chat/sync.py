@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+
+"""
+Keep a local copy of CIViC current by applying only what changed since the last sync.
+
+Each entity is paged through with the pageInfo/endCursor fields of its query, and each page is applied in one
+transaction together with the cursor that follows it, so an interrupted sync resumes from the last applied page.
+Records are compared by id and a hash of their content, so only new and changed records are written.
+Records that a completed pass no longer sees are removed.
+
+    python -m civic_chat.sync
+    python -m civic_chat.sync --entity diseases --page-size 200
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import typer
+
+from civic_chat.env import STORE_FILE
+from civic_chat.tools.civic_mutation import MOLECULAR_PROFILE_FIELDS
+from civic_chat.tools.civic_mutation_evidence import EVIDENCE_FIELDS
+
+
+# The disease tool only needs the name, but local lookups need everything a disease is known by.
+DISEASE_SYNC_FIELDS = """
+    totalCount
+    pageInfo {
+      hasNextPage
+      endCursor
+    }
+    nodes {
+      id
+      name
+      displayName
+      doid
+      diseaseAliases
+    }
+"""
+
+# Each synced entity: the table it is stored in, the root query field, its arguments, and the fields to fetch.
+# Evidence is fetched in every status so that status changes, like a submission becoming ACCEPTED, are seen.
+ENTITIES = {
+    "evidence_items": ("evidenceItems", "status: ALL", EVIDENCE_FIELDS),
+    "molecular_profiles": ("molecularProfiles", "", MOLECULAR_PROFILE_FIELDS),
+    "diseases": ("diseases", "", DISEASE_SYNC_FIELDS),
+}
+
+PAGE_SIZE = 100
+
+
+class LocalStore:
+    """A SQLite copy of CIViC records, one table per entity, with the sync position of each."""
+
+    def __init__(self, path: str = STORE_FILE):
+        self.path = path
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        for table in ENTITIES:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS %s ("
+                " id INTEGER PRIMARY KEY, status TEXT, hash TEXT NOT NULL, data TEXT NOT NULL,"
+                " generation INTEGER NOT NULL, updated_at REAL NOT NULL)" % table
+            )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS sync_state ("
+            " entity TEXT PRIMARY KEY, cursor TEXT, generation INTEGER NOT NULL, completed_at REAL)"
+        )
+        self.db.commit()
+
+    def get_state(self, entity: str) -> Tuple[Optional[str], int, Optional[float]]:
+        row = self.db.execute(
+            "SELECT cursor, generation, completed_at FROM sync_state WHERE entity = ?", (entity,)
+        ).fetchone()
+        return row if row is not None else (None, 0, None)
+
+    def _set_state(self, entity: str, cursor: Optional[str], generation: int, completed_at: Optional[float]):
+        self.db.execute(
+            "INSERT OR REPLACE INTO sync_state (entity, cursor, generation, completed_at) VALUES (?, ?, ?, ?)",
+            (entity, cursor, generation, completed_at),
+        )
+
+    def apply_page(self, entity: str, nodes: List[dict], generation: int, next_cursor: Optional[str]) -> Dict[str, int]:
+        """Write the new and changed nodes of one page, and the cursor after it, in a single transaction."""
+        counts = {"new": 0, "changed": 0, "accepted": 0, "unchanged": 0}
+        ids = [int(node["id"]) for node in nodes]
+        existing = {}
+        if ids:
+            existing = {
+                row[0]: (row[1], row[2]) for row in self.db.execute(
+                    "SELECT id, status, hash FROM %s WHERE id IN (%s)" % (entity, ",".join("?" * len(ids))), ids
+                )
+            }
+        now = time.time()
+        writes = []
+        for record_id, node in zip(ids, nodes):
+            data = json.dumps(node, sort_keys=True)
+            digest = hashlib.sha1(data.encode()).hexdigest()
+            status = node.get("status")
+            previous = existing.get(record_id)
+            if previous is None:
+                counts["new"] += 1
+            elif previous[1] == digest:
+                counts["unchanged"] += 1
+                continue
+            else:
+                counts["changed"] += 1
+                if status == "ACCEPTED" and previous[0] != "ACCEPTED":
+                    counts["accepted"] += 1
+            writes.append((record_id, status, digest, data, generation, now))
+
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO %s (id, status, hash, data, generation, updated_at) VALUES (?, ?, ?, ?, ?, ?)"
+                % entity, writes
+            )
+            # Unchanged records are only marked as seen in this pass, so the end of the pass knows what disappeared.
+            unchanged_ids = [(generation, record_id) for record_id in ids if record_id in existing]
+            self.db.executemany("UPDATE %s SET generation = ? WHERE id = ?" % entity, unchanged_ids)
+            self._set_state(entity, next_cursor, generation, None)
+        return counts
+
+    def complete_pass(self, entity: str, generation: int) -> int:
+        """Remove records not seen in the pass that just finished, and mark the pass complete."""
+        with self.db:
+            removed = self.db.execute("DELETE FROM %s WHERE generation < ?" % entity, (generation,)).rowcount
+            self._set_state(entity, None, generation, time.time())
+        return removed
+
+    def records(self, entity: str, status: Optional[str] = None) -> Iterator[dict]:
+        if status is None:
+            rows = self.db.execute("SELECT data FROM %s ORDER BY id" % entity)
+        else:
+            rows = self.db.execute("SELECT data FROM %s WHERE status = ? ORDER BY id" % entity, (status,))
+        for (data,) in rows:
+            yield json.loads(data)
+
+    def count(self, entity: str) -> int:
+        return self.db.execute("SELECT COUNT(*) FROM %s" % entity).fetchone()[0]
+
+
+def page_query(root_field: str, args: str, fields: str, first: int, after: Optional[str]) -> str:
+    args = [args] if args else []
+    args.append("first: %d" % first)
+    if after is not None:
+        args.append('after: "%s"' % after)
+    return """
+    {
+      %s(%s) {
+        %s
+      }
+    }
+    """ % (root_field, ", ".join(args), fields)
+
+
+def iter_pages(wrapper, root_field: str, args: str, fields: str, first: int = PAGE_SIZE, after: Optional[str] = None,
+               cached: bool = False):
+    """Yield (nodes, end_cursor, has_next_page) for each page of a connection, starting after a cursor.
+
+    Pages come straight from the network unless cached is set, since a sync must never be answered from the tool cache.
+    """
+    fetch = wrapper._execute_query if cached else wrapper._fetch
+    while True:
+        result = fetch(page_query(root_field, args, fields, first, after))
+        connection = result[root_field]
+        page_info = connection["pageInfo"]
+        yield connection["nodes"], page_info["endCursor"], page_info["hasNextPage"]
+        if not page_info["hasNextPage"]:
+            return
+        after = page_info["endCursor"]
+
+
+def sync_entity(store: LocalStore, entity: str, wrapper=None, page_size: int = PAGE_SIZE) -> Dict[str, int]:
+    """Bring one entity up to date, resuming an interrupted pass if there is one."""
+    if wrapper is None:
+        from civic_chat.tools.civic_db_gql import civic_graphql_wrapper
+        wrapper = civic_graphql_wrapper
+    root_field, args, fields = ENTITIES[entity]
+
+    cursor, generation, completed_at = store.get_state(entity)
+    if cursor is None:
+        # Nothing to resume, so start a new pass.
+        generation += 1
+
+    totals = {"new": 0, "changed": 0, "accepted": 0, "unchanged": 0, "removed": 0}
+    for nodes, end_cursor, has_next_page in iter_pages(wrapper, root_field, args, fields, page_size, cursor):
+        # The cursor saved with the last page stays set until the pass is marked complete below.
+        counts = store.apply_page(entity, nodes, generation, end_cursor)
+        for key, value in counts.items():
+            totals[key] += value
+    totals["removed"] = store.complete_pass(entity, generation)
+    return totals
+
+
+def sync(
+    entity: List[str] = typer.Option(list(ENTITIES), help="Entities to sync, may be repeated."),
+    page_size: int = typer.Option(PAGE_SIZE, help="Records per page, each applied in one transaction."),
+    store_file: str = typer.Option(STORE_FILE, help="The local SQLite store."),
+):
+    """ Apply new and changed CIViC records to the local store.
+    """
+    store = LocalStore(store_file)
+    for name in entity:
+        t0 = time.time()
+        totals = sync_entity(store, name, page_size=page_size)
+        print(f"{name}: {totals} now {store.count(name)} records in {time.time() - t0:.1f}s")
+
+
+if __name__ == "__main__":
+    typer.run(sync)
@@ -0,0 +1,51 @@
+import time
+
+import pytest
+
+from civic_chat.cassette import Cassette, CassetteChatModel, CassetteMiss, cassette_attached
+from civic_chat.cache import ToolCache
+from civic_chat.cli import create_agent_executor
+from civic_chat.loadtest import QUESTION_MIX, load_test_tools
+from civic_chat.mock.graphql_server import MockGraphQLServer, point_civic_tools_at
+from civic_chat.mock.llm import ScriptedReactChatModel
+from civic_chat.tools.civic_db_gql import civic_tool
+
+QUESTION = QUESTION_MIX[0][0]
+
+
+def run_agent(llm):
+    return create_agent_executor(load_test_tools(), llm, verbose=False).invoke({"input": QUESTION})["output"]
+
+
+def test_record_then_replay_offline(tmp_path):
+    path = str(tmp_path / "run.jsonl.gz")
+    previous = civic_tool.graphql_wrapper
+    try:
+        with MockGraphQLServer(latency=0.05) as server:
+            point_civic_tools_at(server.url, cache=ToolCache())
+            cache = civic_tool.graphql_wrapper.cache
+            recording = Cassette(path, mode="record")
+            with cassette_attached(recording):
+                assert civic_tool.graphql_wrapper.cache is None
+                recorded = run_agent(CassetteChatModel(llm=ScriptedReactChatModel(latency=0.05), cassette=recording))
+            recording.save()
+            # The wrappers are as they were before the recording.
+            assert civic_tool.graphql_wrapper.cassette is None and civic_tool.graphql_wrapper.cache is cache
+        kinds = [exchange["key"].split(":")[0] for exchange in recording.exchanges]
+        assert kinds.count("llm") == 4 and kinds.count("graphql") >= 3
+
+        # The server is gone, and the model would fail if it were asked anything.
+        for realtime in [True, False]:
+            replaying = Cassette(path, realtime=realtime)
+            with cassette_attached(replaying):
+                t0 = time.time()
+                replayed = run_agent(CassetteChatModel(llm=ScriptedReactChatModel(latency=60), cassette=replaying))
+                elapsed = time.time() - t0
+            assert replayed == recorded
+            assert replaying.unplayed == 0
+            assert elapsed > 0.35 if realtime else elapsed < 0.35
+
+        with pytest.raises(CassetteMiss):
+            Cassette(path).graphql("{ diseases { nodes { id } } }", lambda: None)
+    finally:
+        civic_tool.graphql_wrapper = previous
@@ -5,12 +5,22 @@ from civic_chat.cli import create_single_inference_cli
 from civic_chat.tools.civic_disease import get_disease_id
 from civic_chat.tools.civic_mutation import get_gene_molecular_profile_ids
 from civic_chat.tools.civic_mutation_evidence import get_all_disease_mutations, get_disease_predictive_mutations_for_profiles
+from civic_chat.tools.civic_mutation_evidence import count_disease_mutations_for_profiles, get_disease_predictive_mutations_brief_for_profiles
+from civic_chat.tools.civic_evidence_summary import summarize_disease_mutations, summarize_disease_mutations_for_profiles
+from civic_chat.tools.civic_evidence_search import search_evidence
+from civic_chat.tools.civic_evidence_semantic import semantic_search_evidence
 
 tools = [
     get_disease_id,
     get_gene_molecular_profile_ids,
     get_all_disease_mutations,
     get_disease_predictive_mutations_for_profiles,
+    get_disease_predictive_mutations_brief_for_profiles,
+    count_disease_mutations_for_profiles,
+    summarize_disease_mutations,
+    summarize_disease_mutations_for_profiles,
+    search_evidence,
+    semantic_search_evidence,
 ]
 
 sys_msg = SystemMessage(
@@ -0,0 +1,64 @@
+from civic_chat.mock.graphql_server import MockGraphQLServer, point_civic_tools_at
+from civic_chat.tools.civic_db_gql import civic_tool
+from civic_chat.tools.civic_evidence_summary import (
+    _summarize_all, summarize_disease_mutations, summarize_disease_mutations_for_profiles, summarize_evidence,
+)
+from civic_chat.tools.civic_mutation_evidence import (
+    count_predictive_evidence, query_all_predictive_evidence, query_predictive_evidence,
+)
+
+EVIDENCE = [
+    {
+        "id": 1, "evidenceLevel": "A", "evidenceRating": 5, "evidenceDirection": "SUPPORTS",
+        "therapies": [{"name": "Cetuximab"}, {"name": "Adagrasib"}], "molecularProfile": {"name": "KRAS G12C"},
+    },
+    {
+        "id": 2, "evidenceLevel": "C", "evidenceRating": None, "evidenceDirection": "DOES_NOT_SUPPORT",
+        "therapies": [], "molecularProfile": {"name": "KRAS G12C"},
+    },
+    {
+        "id": 3, "evidenceLevel": "B", "evidenceRating": 3, "evidenceDirection": "SUPPORTS",
+        "therapies": [{"name": "Sotorasib"}], "molecularProfile": {"name": "KRAS G13D"},
+    },
+]
+
+
+def test_summary_by_therapy_ranks_strongest_first():
+    lines = summarize_evidence(EVIDENCE, "therapy").split("\n")
+    assert lines[0].startswith("therapy\tn\tA\tB")
+    assert [line.split("\t")[0] for line in lines[1:]] == ["Adagrasib", "Cetuximab", "Sotorasib", "(none)"]
+    assert lines[-1].endswith("\t-3.0")
+
+
+def test_summary_by_molecular_profile_counts_levels_and_directions():
+    lines = summarize_evidence(EVIDENCE, "molecularProfile").split("\n")
+    assert lines[1].split("\t") == ["KRAS G12C", "2", "1", "0", "1", "0", "0", "1", "1", "5.0", "22.0"]
+
+
+def test_summary_truncates_to_top_n():
+    summary = summarize_evidence(EVIDENCE, "therapy", top_n=2)
+    assert summary.endswith("... 2 more")
+    assert summarize_evidence([], "therapy") == "no evidence"
+
+
+def test_summaries_page_through_all_evidence():
+    previous = civic_tool.graphql_wrapper
+    try:
+        with MockGraphQLServer() as server:
+            point_civic_tools_at(server.url)
+            total = count_predictive_evidence(1)
+            # More than one page, so the first page alone would leave some out.
+            assert len(query_predictive_evidence(1)) < total
+            summary = summarize_disease_mutations.func(1)
+            profiles_summary = summarize_disease_mutations_for_profiles.func(1, [1, 2])
+            profiles_total = count_predictive_evidence(1, 1) + count_predictive_evidence(1, 2)
+            nodes, total_count = query_all_predictive_evidence(1, max_items=60)
+    finally:
+        civic_tool.graphql_wrapper = previous
+    assert summary.startswith("%d evidence items\n" % total)
+    assert "by evidenceRating:\nevidenceRating\tn" in summary
+    assert profiles_summary.startswith("%d evidence items\n" % profiles_total)
+    assert (len(nodes), total_count) == (60, total)
+    assert _summarize_all(nodes, total_count).startswith(
+        "60 evidence items summarized of %d in CIViC; the rest are left out" % total
+    )
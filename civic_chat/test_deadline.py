@@ -0,0 +1,59 @@
+import time
+
+from langchain_core.tools import Tool
+
+from civic_chat.cli import create_agent_executor
+from civic_chat.deadline import Deadline, with_timeouts
+from civic_chat.mock.llm import ScriptedReactChatModel
+
+QUESTION = 'What is the evidence of mutations associated with the gene "KRAS" in relation to Colorectal Cancer?'
+
+
+def fake_tools(evidence_seconds: float = 0.0) -> list:
+    def evidence(_):
+        time.sleep(evidence_seconds)
+        return "lots of evidence"
+
+    return [
+        Tool.from_function(lambda _: "11", "get_disease_id", "The disease ID."),
+        Tool.from_function(lambda _: "[1, 2, 3]", "get_gene_molecular_profile_ids", "The profile IDs."),
+        Tool.from_function(evidence, "get_disease_predictive_mutations_for_profiles", "The evidence."),
+    ]
+
+
+def ask(deadline: Deadline, tools: list, llm_latency: float = 0.0) -> str:
+    agent_exec = create_agent_executor(tools, ScriptedReactChatModel(latency=llm_latency), verbose=False,
+                                       deadline=deadline)
+    with deadline:
+        return agent_exec.invoke({"input": QUESTION}, config={"callbacks": [deadline]})["output"]
+
+
+def test_slow_tool_is_cut_short():
+    deadline = Deadline(seconds=10, tool_timeout=0.2)
+    t0 = time.time()
+    with deadline:
+        observation = with_timeouts(fake_tools(evidence_seconds=5))[2].run("(11, [1])")
+    assert time.time() - t0 < 1
+    assert "timed out" in observation and "was abandoned" in observation
+    assert deadline.timed_out_tools == ["get_disease_predictive_mutations_for_profiles"]
+    assert len(deadline.abandoned_threads) == deadline.abandoned_running == 1
+    assert "1 of 1 abandoned calls still running" in str(deadline)
+
+
+def test_whole_answer_within_budget():
+    deadline = Deadline(seconds=10)
+    assert ask(deadline, fake_tools()).startswith("Found")
+    assert deadline.calls == {"llm": 4, "tool": 3}
+
+
+def test_step_budget_gives_partial_answer():
+    assert ask(Deadline(seconds=10, max_steps=2), fake_tools()) == "Partial answer after 2 steps."
+
+
+def test_time_budget_gives_partial_answer_in_time():
+    deadline = Deadline(seconds=1.0, reserve=0.4, tool_timeout=5)
+    t0 = time.time()
+    answer = ask(deadline, fake_tools(evidence_seconds=5), llm_latency=0.1)
+    assert time.time() - t0 < 1.0
+    assert answer.startswith("Partial answer")
+    assert deadline.timed_out_tools
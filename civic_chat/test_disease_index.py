@@ -0,0 +1,76 @@
+import threading
+import time
+
+from civic_chat.mock.graphql_server import MockGraphQLServer, point_civic_tools_at
+from civic_chat.sync import LocalStore
+from civic_chat.tools.civic_db_gql import civic_tool
+from civic_chat.tools.civic_disease_index import DiseaseIndex, DiseaseIndexSource
+
+DISEASES = [
+    {"id": 11, "name": "Colorectal Cancer", "displayName": "Colorectal Cancer", "doid": "9256",
+     "diseaseAliases": ["CRC", "Colorectal Carcinoma"]},
+    {"id": 7, "name": "Melanoma", "displayName": "Melanoma", "doid": "1909", "diseaseAliases": []},
+    {"id": 8, "name": "Lung Non-small Cell Carcinoma", "displayName": "Lung Non-small Cell Carcinoma", "doid": "3908",
+     "diseaseAliases": ["NSCLC"]},
+]
+
+
+def test_names_aliases_doids_and_typos_resolve():
+    index = DiseaseIndex(DISEASES)
+    for query in ["Colorectal Cancer", "colorectal cancer", "CRC", '"Colorectal Carcinoma"', "DOID:9256", "doid 9256",
+                  "colorectl cancer", "Cancer, Colorectal"]:
+        disease_id, name, score = index.resolve(query)[0]
+        assert (disease_id, name) == (11, "Colorectal Cancer"), query
+        assert score >= 0.6, query
+    assert index.resolve("NSCLC")[0][0] == 8
+    assert index.resolve("melanomma")[0][0] == 7
+    assert index.resolve("sarcoma")[0][2] < 0.6
+
+
+def test_get_disease_id_in_one_call():
+    from civic_chat.tools.civic_disease import get_disease_id
+    from civic_chat.tools.civic_disease_index import disease_index_source
+
+    previous = civic_tool.graphql_wrapper
+    try:
+        with MockGraphQLServer() as server:
+            point_civic_tools_at(server.url)
+            disease_index_source.clear()
+            assert get_disease_id.func("crc") == 1
+            assert get_disease_id.func("Melanoma") == 2
+            assert get_disease_id.func("Lung Non small cell carcinoma") == 3
+            assert "closest" in get_disease_id.func("Leukaemia")
+            assert len(server.requests) == 1
+    finally:
+        civic_tool.graphql_wrapper = previous
+        disease_index_source.clear()
+
+
+class BlockingWrapper:
+    # Holds up the disease listing until released, and counts the requests for it.
+    def __init__(self):
+        self.release = threading.Event()
+        self.requests = 0
+
+    def _execute_query(self, query):
+        self.requests += 1
+        self.release.wait(5)
+        return {"diseases": {"pageInfo": {"hasNextPage": False, "endCursor": None}, "nodes": DISEASES}}
+
+
+def test_first_callers_share_one_crawl_without_the_lock():
+    wrapper = BlockingWrapper()
+    source = DiseaseIndexSource(store=LocalStore(":memory:"), wrapper=wrapper)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(source.resolve("CRC")[0][0])) for _ in range(4)]
+    [t.start() for t in threads]
+    try:
+        time.sleep(0.05)
+        # The crawl is under way, and the lock is free for anything else.
+        assert source._lock.acquire(timeout=1)
+        source._lock.release()
+    finally:
+        wrapper.release.set()
+        [t.join() for t in threads]
+    assert results == [11] * 4
+    assert wrapper.requests == 1
@@ -0,0 +1,58 @@
+import threading
+import time
+
+from civic_chat.tools.duckduckgo_search import CachedSearch, count_tokens, normalize_query
+
+
+class StandInBackend:
+    # A local search engine: every query returns a result shared by all queries and one of its own.
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.queries = []
+        self.lock = threading.Lock()
+
+    def __call__(self, query, max_results):
+        with self.lock:
+            self.queries.append(query)
+        time.sleep(self.delay)
+        return [
+            {"title": "CIViC", "snippet": "Clinical interpretation of variants in cancer.", "link": "https://www.civicdb.org/"},
+            {"title": query, "snippet": "About %s." % query, "link": "https://example.org/%s" % normalize_query(query).replace(" ", "-")},
+        ][:max_results]
+
+
+def test_near_identical_queries_are_cached():
+    backend = StandInBackend()
+    search = CachedSearch(backend)
+    search.run("KRAS colorectal cancer")
+    search.run("colorectal cancer, KRAS?")
+    assert backend.queries == ["KRAS colorectal cancer"]
+
+
+def test_queries_run_concurrently_and_results_are_deduplicated():
+    backend = StandInBackend(delay=0.2)
+    search = CachedSearch(backend)
+    t0 = time.time()
+    digest = search.run("KRAS G12C sotorasib; BRAF V600E vemurafenib; EGFR osimertinib")
+    assert time.time() - t0 < 0.5
+    assert len(backend.queries) == 3
+    assert digest.count("civicdb.org") == 1
+    assert len(digest.split("\n")) == 4
+
+
+def test_digest_is_token_bounded():
+    search = CachedSearch(StandInBackend(), max_tokens=30)
+    assert len(search.run("KRAS; BRAF; EGFR").split("\n")) == 1
+
+
+def test_a_result_over_the_budget_is_cut_short():
+    long = {"title": "Long", "snippet": "word " * 200, "link": "https://example.org/long"}
+    digest = CachedSearch(lambda query, n: [long], max_tokens=30).run("KRAS")
+    assert digest.startswith("Long: word") and digest.endswith("...")
+    assert count_tokens(digest) <= 30
+
+
+def test_results_without_links_are_told_apart_by_text():
+    results = [{"title": "A", "snippet": "first"}, {"title": "B", "snippet": "second"}, {"title": "A", "snippet": "first"}]
+    digest = CachedSearch(lambda query, n: results).run("KRAS")
+    assert digest.split("\n") == ["A: first ()", "B: second ()"]
@@ -0,0 +1,75 @@
+import json
+
+from langchain_core.tools import Tool
+
+from civic_chat import encode
+from civic_chat.encode import compare_encodings, encode_result, encode_table, tool_result_bytes, with_encodings
+from civic_chat.metrics import registry
+from civic_chat.mock.graphql_server import MockGraphQLServer, point_civic_tools_at
+from civic_chat.tools.civic_db_gql import civic_tool
+from civic_chat.tools.civic_mutation_evidence import query_predictive_evidence
+
+
+def test_table_flattens_nested_fields():
+    rows = [
+        {"id": 1, "disease": {"name": "CRC"}, "therapies": [{"name": "A"}, {"name": "B"}], "note": "two\tlines\n"},
+        {"id": 2, "disease": None, "therapies": [], "note": None},
+    ]
+    assert encode_table(rows) == "id\tdisease.name\ttherapies.name\tnote\n1\tCRC\tA|B\ttwo lines\n2\t\t\t"
+
+
+def test_lists_within_lists_of_objects_keep_their_items():
+    rows = [{"id": 1, "therapies": [
+        {"name": "Sotorasib", "therapyAliases": ["AMG 510", "Lumakras"]},
+        {"name": "Cetuximab", "therapyAliases": []},
+        {"name": "Adagrasib", "therapyAliases": ["MRTX849"]},
+    ]}]
+    assert encode_table(rows) == (
+        "id\ttherapies.name\ttherapies.therapyAliases\n"
+        '1\tSotorasib|Cetuximab|Adagrasib\t[["AMG 510","Lumakras"],[],["MRTX849"]]'
+    )
+
+
+def test_auto_picks_the_cheapest_encoding_for_evidence():
+    previous = civic_tool.graphql_wrapper
+    try:
+        with MockGraphQLServer() as server:
+            point_civic_tools_at(server.url)
+            evidence = query_predictive_evidence(1, 1)
+    finally:
+        civic_tool.graphql_wrapper = previous
+    sizes = compare_encodings(evidence)
+    assert sizes["table"]["tokens"] < sizes["json"]["tokens"] < sizes["repr"]["tokens"]
+    assert encode_result(evidence) == encode_table(evidence)
+    assert json.loads(encode_result(evidence, "json")) == evidence
+
+
+def test_encoding_is_chosen_per_tool():
+    rows = [{"id": 1, "name": "x"}, {"id": 2, "name": "y"}]
+    tools = with_encodings(
+        [Tool.from_function(lambda _: rows, "a", "A."), Tool.from_function(lambda _: rows, "b", "B."),
+         Tool.from_function(lambda _: "text", "c", "C.")],
+        {"a": "json"},
+    )
+    assert tools[0].run("") == '[{"id":1,"name":"x"},{"id":2,"name":"y"}]'
+    assert tools[1].run("") == "id\tname\n1\tx\n2\ty"
+    assert tools[2].run("") == "text"
+
+
+def test_items_missing_fields_keep_their_columns():
+    rows = [{"id": 1, "therapies": [{"name": "A"}, {"name": "B", "ncitId": "C2"}, {"ncitId": "C3"}]}]
+    assert encode_table(rows) == "id\ttherapies.name\ttherapies.ncitId\n1\tA|B|\t|C2|C3"
+
+
+def test_auto_settles_per_tool_and_records_sizes(monkeypatch):
+    calls = []
+    monkeypatch.setattr(encode, "count_tokens", lambda text: calls.append(text) or len(text))
+    rows = [{"id": i, "name": "x"} for i in range(20)]
+    tool, = with_encodings([Tool.from_function(lambda _: rows, "settles", "S.")])
+    table = encode_table(rows)
+    for _ in range(encode.AUTO_SAMPLES + 2):
+        assert tool.run("") == table
+    # Both encodings are counted for the first results, and then only the one sent, for its metric.
+    assert len(calls) == 3 * encode.AUTO_SAMPLES + 2
+    if registry.enabled:
+        assert tool_result_bytes.get(tool="settles", encoding="table").count == encode.AUTO_SAMPLES + 2
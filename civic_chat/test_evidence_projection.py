@@ -0,0 +1,72 @@
+import json
+
+import pytest
+
+from civic_chat.mock.graphql_server import MockGraphQLServer, point_civic_tools_at
+from civic_chat.tools._gql import project_fields
+from civic_chat.tools.civic_db_gql import civic_tool
+from civic_chat.tools.civic_mutation_evidence import (
+    EvidenceMerge, count_disease_mutations_for_profiles, evidence_selection,
+    get_disease_predictive_mutations_brief_for_profiles, get_disease_predictive_mutations_for_profiles,
+    iter_predictive_evidence,
+)
+
+
+def test_project_fields():
+    assert project_fields(["id", "therapies.name", "therapies.id"], indent=" ") == "id\ntherapies {\n name\n id\n}"
+    assert "source {" in evidence_selection(["source"]) and "citationId" in evidence_selection(["source"])
+    with pytest.raises(ValueError):
+        evidence_selection(["therapies.nope"])
+
+
+def test_counts_and_brief_evidence_match_full_evidence():
+    previous = civic_tool.graphql_wrapper
+    try:
+        with MockGraphQLServer() as server:
+            point_civic_tools_at(server.url)
+            full = get_disease_predictive_mutations_for_profiles.func(1, [1, 2, 3])
+            brief = get_disease_predictive_mutations_brief_for_profiles.func(1, [1, 2, 3])
+            counts = count_disease_mutations_for_profiles.func(1, [1, 2, 3])
+    finally:
+        civic_tool.graphql_wrapper = previous
+    assert counts["total"] == len(full) == len(brief)
+    assert [item["id"] for item in brief] == [item["id"] for item in full]
+    assert set(brief[0]) == {"id", "molecularProfile", "evidenceLevel", "evidenceRating", "evidenceDirection", "therapies"}
+    assert len(json.dumps(counts)) * 100 < len(json.dumps(full))
+
+
+def test_repeated_profiles_are_merged_once():
+    previous = civic_tool.graphql_wrapper
+    try:
+        with MockGraphQLServer() as server:
+            point_civic_tools_at(server.url)
+            once = get_disease_predictive_mutations_for_profiles.func(1, [1, 2, 3])
+            repeated = get_disease_predictive_mutations_for_profiles.func(1, [3, 1, 2, 1, 3])
+            merge = EvidenceMerge([1, 2, 1])
+            streamed = list(iter_predictive_evidence(1, [1, 2, 1], merge=merge))
+            merge.add(2, merge.by_profile[2])
+    finally:
+        civic_tool.graphql_wrapper = previous
+    assert sorted(item["id"] for item in repeated) == sorted(item["id"] for item in once)
+    # Grouped by profile, in the order the profiles were first given.
+    profile_order = list(dict.fromkeys(item["molecularProfile"]["id"] for item in repeated))
+    assert profile_order == [i for i in [3, 1, 2] if i in profile_order]
+    assert sorted(profile_id for profile_id, _ in streamed) == [1, 2]
+    assert merge.duplicates == len(merge.by_profile[2])
+
+
+def test_brief_evidence_fields_are_chosen_and_checked():
+    tool = get_disease_predictive_mutations_brief_for_profiles
+    parsed = tool._parse_input({"disease_id": 1, "molecular_profile_ids": "1, 2", "fields": "id, source.citationId"}, None)
+    assert parsed == {"disease_id": 1, "molecular_profile_ids": [1, 2], "fields": ["id", "source.citationId"]}
+    assert tool._parse_input("(1, [1, 2])", None) == {"disease_id": 1, "molecular_profile_ids": [1, 2]}
+    assert tool.func(1, [1], fields=["therapies.nope"]).startswith("Unknown evidence field 'therapies.nope'")
+
+    previous = civic_tool.graphql_wrapper
+    try:
+        with MockGraphQLServer() as server:
+            point_civic_tools_at(server.url)
+            evidence = tool.func(1, [1, 2], fields=["id", "source.citationId"])
+    finally:
+        civic_tool.graphql_wrapper = previous
+    assert evidence and all(set(item) == {"id", "source"} and set(item["source"]) == {"citationId"} for item in evidence)
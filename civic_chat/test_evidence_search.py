@@ -0,0 +1,96 @@
+import threading
+import time
+
+import pytest
+
+from civic_chat.mock.graphql_server import build_dataset
+from civic_chat.sync import LocalStore
+from civic_chat.tools import civic_evidence_search
+from civic_chat.tools.civic_evidence_search import EvidenceSearchIndex, search_evidence
+
+
+@pytest.fixture
+def evidence():
+    return build_dataset(evidence_count=300)["evidenceItems"]
+
+
+@pytest.fixture
+def index(evidence, monkeypatch):
+    store = LocalStore(":memory:")
+    store.apply_page("evidence_items", evidence, 1, None)
+    index = EvidenceSearchIndex(store)
+    assert index.refresh() == len(evidence)
+    monkeypatch.setattr(civic_evidence_search, "_index", index)
+    monkeypatch.setattr(civic_evidence_search, "_refreshed_at", time.time())
+    return index
+
+
+def accepted(evidence):
+    return [item for item in evidence if item["status"] == "ACCEPTED"]
+
+
+def test_ranking(evidence, index):
+    target = accepted(evidence)[7]
+    rows = index.search(target["description"])
+    assert rows[0][0] == target["id"]
+    assert rows[0][1] == target["molecularProfile"]["name"]
+
+    # Every hit for a profile and a disease matches both, and only accepted evidence is found.
+    profile, disease = target["molecularProfile"]["name"], target["disease"]["name"]
+    expected = {item["id"] for item in accepted(evidence)
+                if item["molecularProfile"]["name"] == profile and item["disease"]["name"] == disease}
+    rows = index.search("%s %s" % (profile, disease), limit=100)
+    assert {row[0] for row in rows} == expected
+
+
+def test_falls_back_to_any_word(evidence, index):
+    target = accepted(evidence)[0]
+    rows = index.search("%s xyzzy" % target["description"])
+    assert rows and rows[0][0] == target["id"]
+
+
+def test_no_match(index):
+    assert index.search("xyzzy plugh") == []
+    assert index.search("?!") == []
+    assert search_evidence.run("xyzzy") == "no matching evidence"
+
+
+def test_refresh_drops_evidence_no_longer_accepted(evidence, index):
+    target = accepted(evidence)[3]
+    time.sleep(0.01)
+    index.store.apply_page("evidence_items", [dict(target, status="REJECTED")], 2, None)
+    assert index.refresh() == 1
+    assert target["id"] not in [row[0] for row in index.search(target["description"])]
+    assert index.search(target["description"], status="REJECTED")[0][0] == target["id"]
+
+
+def test_tool_output(evidence, index):
+    target = accepted(evidence)[11]
+    first = search_evidence.run(target["description"]).splitlines()[0]
+    assert first.startswith("EID%d\t%s\t" % (target["id"], target["molecularProfile"]["name"]))
+    assert "[" in first
+
+
+def test_concurrent_first_calls_build_one_index(evidence, tmp_path, monkeypatch):
+    store = LocalStore(str(tmp_path / "store.db"))
+    store.apply_page("evidence_items", evidence, 1, None)
+    built = []
+
+    class CountingIndex(EvidenceSearchIndex):
+        def __init__(self, store):
+            built.append(self)
+            super().__init__(store)
+
+        def refresh(self):
+            time.sleep(0.05)
+            return super().refresh()
+
+    monkeypatch.setattr(civic_evidence_search, "EvidenceSearchIndex", CountingIndex)
+    monkeypatch.setattr(civic_evidence_search, "LocalStore", lambda: store)
+    monkeypatch.setattr(civic_evidence_search, "_index", None)
+    monkeypatch.setattr(civic_evidence_search, "_refreshed_at", 0.0)
+    threads = [threading.Thread(target=civic_evidence_search.get_evidence_search_index) for _ in range(4)]
+    [t.start() for t in threads]
+    [t.join() for t in threads]
+    assert len(built) == 1
+    assert store.db.execute("SELECT count(*) FROM evidence_fts").fetchone()[0] == len(evidence)
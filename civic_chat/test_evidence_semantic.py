@@ -0,0 +1,144 @@
+import os
+import re
+import threading
+import time
+import zlib
+
+import numpy as np
+
+from civic_chat.mock.graphql_server import build_dataset
+from civic_chat.sync import LocalStore
+from civic_chat.tools import civic_evidence_semantic
+from civic_chat.tools.civic_evidence_semantic import EmbeddingIndex, semantic_search_evidence, update_from_store
+
+DIM = 64
+
+
+class FakeEncoder:
+    # Bag of hashed words, normalized, so texts sharing words are close without a model.
+    dim = DIM
+
+    def __call__(self, texts):
+        vectors = np.zeros((len(texts), DIM), dtype=np.float32)
+        for i, text in enumerate(texts):
+            for word in re.findall(r"\w+", text.lower()):
+                vectors[i, zlib.crc32(word.encode()) % DIM] += 1
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-9)
+
+
+def unit(i):
+    vector = np.zeros(DIM, dtype=np.float32)
+    vector[i] = 1
+    return vector
+
+
+def live_ids(index):
+    return sorted(index.ids[index.live].tolist())
+
+
+def test_append_and_remove(tmp_path):
+    index = EmbeddingIndex(str(tmp_path), DIM)
+    index.append([1, 2, 3], np.stack([unit(1), unit(2), unit(3)]))
+    index.append([2], unit(5)[None])
+    index.remove([3])
+    assert live_ids(index) == [1, 2] and len(index) == 2
+    assert index.search(unit(5), k=5)[0] == (2, 1.0)
+    assert 3 not in [record_id for record_id, _ in index.search(unit(3), k=5)]
+
+    reloaded = EmbeddingIndex(str(tmp_path), DIM)
+    assert live_ids(reloaded) == [1, 2]
+    assert reloaded.search(unit(5), k=1) == [(2, 1.0)]
+
+
+def test_interrupted_append_is_cut_off(tmp_path):
+    index = EmbeddingIndex(str(tmp_path), DIM)
+    index.append([1, 2], np.stack([unit(1), unit(2)]))
+    # Vectors written by an append that never got to its IDs.
+    with open(index.vectors_path, "ab") as f:
+        f.write(np.stack([unit(7), unit(8)]).tobytes())
+
+    reloaded = EmbeddingIndex(str(tmp_path), DIM)
+    assert len(reloaded.ids) == 2
+    reloaded.append([3], unit(3)[None])
+    assert reloaded.search(unit(3), k=1) == [(3, 1.0)]
+    assert EmbeddingIndex(str(tmp_path), DIM).search(unit(3), k=1) == [(3, 1.0)]
+
+
+def test_update_from_store_and_search(tmp_path, monkeypatch):
+    evidence = build_dataset(evidence_count=200)["evidenceItems"]
+    store = LocalStore(str(tmp_path / "store.db"))
+    store.apply_page("evidence_items", evidence, 1, None)
+    index = EmbeddingIndex(str(tmp_path / "embeddings"), DIM)
+    encoder = FakeEncoder()
+
+    accepted = [item["id"] for item in evidence if item["status"] == "ACCEPTED"]
+    assert update_from_store(index, store, encoder) == len(accepted)
+    assert live_ids(index) == accepted
+    assert update_from_store(index, store, encoder) == 0
+
+    # An accepted item is rejected, and another is gone from CIViC.
+    time.sleep(0.01)
+    store.apply_page("evidence_items", [dict(evidence[accepted[0] - 1], status="REJECTED")], 2, None)
+    store.db.execute("DELETE FROM evidence_items WHERE id = ?", (accepted[1],))
+    update_from_store(index, store, encoder)
+    assert live_ids(index) == accepted[2:]
+
+    monkeypatch.setattr(civic_evidence_semantic, "_index", index)
+    monkeypatch.setattr(civic_evidence_semantic, "_encoder", encoder)
+    monkeypatch.setattr(civic_evidence_semantic, "_store", store)
+    monkeypatch.setattr(civic_evidence_semantic, "_refreshed_at", time.time())
+    target = evidence[accepted[5] - 1]
+    result = semantic_search_evidence.run(target["description"])
+    lines = result.splitlines()
+    assert len(lines) == civic_evidence_semantic.SEARCH_TOP_K
+    assert lines[0].startswith("EID%d\t" % target["id"])
+    assert target["molecularProfile"]["name"] in lines[0]
+
+
+def test_compaction(tmp_path):
+    index = EmbeddingIndex(str(tmp_path), DIM)
+    index.append([1, 2, 3, 4], np.stack([unit(1), unit(2), unit(3), unit(4)]))
+    index.append([1], unit(11)[None])
+    index.remove([2])
+    # The removal row and the rows it and the update superseded.
+    assert len(index.ids) == 6 and index.dead_fraction == 0.5
+    # Superseding one more row takes the dead fraction past one half.
+    index.append([3], unit(13)[None])
+    assert len(index.ids) == 3 and index.dead_fraction == 0
+    assert index.meta["generation"] == 1
+    assert sorted(os.listdir(tmp_path)) == ["ids.1.i64", "meta.json", "vectors.1.f32"]
+    assert index.search(unit(11), k=1) == [(1, 1.0)] and index.search(unit(13), k=1) == [(3, 1.0)]
+
+    reloaded = EmbeddingIndex(str(tmp_path), DIM)
+    assert live_ids(reloaded) == [1, 3, 4]
+    assert reloaded.search(unit(4), k=1) == [(4, 1.0)]
+    # An index loaded before another compaction appends to the generation that replaced it.
+    index.remove([1, 3])
+    assert index.meta["generation"] == 2
+    reloaded.append([5], unit(5)[None])
+    assert live_ids(EmbeddingIndex(str(tmp_path), DIM)) == [4, 5]
+
+
+def test_concurrent_first_calls_build_one_index(tmp_path, monkeypatch):
+    evidence = build_dataset(evidence_count=100)["evidenceItems"]
+    store = LocalStore(str(tmp_path / "store.db"))
+    store.apply_page("evidence_items", evidence, 1, None)
+    encoders = []
+
+    def encoder():
+        encoders.append(FakeEncoder())
+        time.sleep(0.05)
+        return encoders[-1]
+
+    monkeypatch.setattr(civic_evidence_semantic, "TextEncoder", encoder)
+    monkeypatch.setattr(civic_evidence_semantic, "LocalStore", lambda: store)
+    monkeypatch.setattr(civic_evidence_semantic, "EMBEDDING_DIR", str(tmp_path / "embeddings"))
+    monkeypatch.setattr(civic_evidence_semantic, "_index", None)
+    monkeypatch.setattr(civic_evidence_semantic, "_refreshed_at", 0.0)
+    threads = [threading.Thread(target=civic_evidence_semantic.get_evidence_embedding_index) for _ in range(4)]
+    [t.start() for t in threads]
+    [t.join() for t in threads]
+    index = civic_evidence_semantic._index
+    assert len(encoders) == 1
+    assert len(index.ids) == len(index) == sum(item["status"] == "ACCEPTED" for item in evidence)
@@ -0,0 +1,100 @@
+import asyncio
+import threading
+import time
+
+from civic_chat.cache import ToolCache
+from civic_chat.tools._gql import GraphQLAPIWrapperExtended, gql_queries
+
+QUERY = '{ diseases(name: "Colorectal Cancer") { nodes { id } } }'
+
+
+class SlowWrapper(GraphQLAPIWrapperExtended):
+    # Stands in for the network with a slow fetch that counts its calls.
+    def _fetch(self, query):
+        self.__dict__.setdefault("fetches", []).append(query)
+        time.sleep(0.2)
+        return {"diseases": {"nodes": [{"id": 11}]}}
+
+
+def wrapper(**kwargs):
+    return SlowWrapper(graphql_endpoint="http://localhost/graphql", fetch_schema_from_transport=False, **kwargs)
+
+
+def test_query_normalization_and_cache():
+    w = wrapper(cache=ToolCache())
+    assert w._execute_query("```graphql\n" + QUERY + "\n```") == {"diseases": {"nodes": [{"id": 11}]}}
+    assert w._execute_query('{"query": "%s"}' % QUERY.replace('"', '\\"')) == {"diseases": {"nodes": [{"id": 11}]}}
+    assert len(w.fetches) == 1
+
+
+def test_concurrent_identical_queries_share_one_request():
+    w = wrapper()
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(w._execute_query(QUERY))) for _ in range(8)]
+    [t.start() for t in threads]
+    [t.join() for t in threads]
+    assert len(w.fetches) == 1
+    assert len(results) == 8 and results[0] is not results[1]
+    assert w.single_flight.coalescing_ratio == 7 / 8
+
+
+def test_only_one_thread_takes_the_first_client():
+    for _ in range(20):
+        w = wrapper()
+        barrier = threading.Barrier(8)
+        clients = []
+
+        def take():
+            barrier.wait()
+            clients.append(w._thread_client())
+
+        threads = [threading.Thread(target=take) for _ in range(8)]
+        [t.start() for t in threads]
+        [t.join() for t in threads]
+        assert sum(client is w.gql_client for client in clients) == 1
+        assert len({id(client) for client in clients}) == 8
+
+
+def test_asyncio_queries_share_one_request():
+    w = wrapper()
+    fetched, coalesced = (gql_queries.get(root_field="diseases", source=source) or 0 for source in ("fetch", "coalesced"))
+
+    async def main():
+        return await asyncio.gather(*[w._aexecute_query(QUERY) for _ in range(5)])
+
+    assert len(asyncio.run(main())) == 5
+    assert len(w.fetches) == 1
+    assert w.single_flight.coalesced == 4
+    assert gql_queries.get(root_field="diseases", source="fetch") == fetched + 1
+    assert gql_queries.get(root_field="diseases", source="coalesced") == coalesced + 4
+
+
+def test_introspected_schema_is_shared_through_the_cache():
+    from types import SimpleNamespace
+    from graphql import build_schema, introspection_from_schema
+
+    cache = ToolCache()
+    introspection = introspection_from_schema(build_schema("type Query { diseases: Int }"))
+    fetched = SimpleNamespace(schema="fetched", fetch_schema_from_transport=True, introspection=introspection)
+    wrapper(cache=cache)._save_schema(fetched)
+
+    fresh = SimpleNamespace(schema=None, fetch_schema_from_transport=True, introspection=None)
+    wrapper(cache=cache)._load_schema(fresh)
+    assert fresh.schema.query_type.fields.keys() == {"diseases"}
+
+
+def test_waiters_outlive_a_cancelled_leader():
+    w = wrapper()
+
+    async def main():
+        leader = asyncio.create_task(w._aexecute_query(QUERY))
+        await asyncio.sleep(0.05)
+        waiter = asyncio.create_task(w._aexecute_query(QUERY))
+        await asyncio.sleep(0.05)
+        leader.cancel()
+        return await asyncio.wait_for(waiter, 2)
+
+    assert asyncio.run(main()) == {"diseases": {"nodes": [{"id": 11}]}}
+    # The waiter joined the request the cancelled leader's thread was still making.
+    assert len(w.fetches) == 1
+    assert not w.single_flight._futures
@@ -0,0 +1,39 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from civic_chat.env import LITELLM_ROUTE_CONCURRENCY
+from civic_chat.llm.litellm import get_litellm_proxy, load_routes, route_for
+from civic_chat.mock.openai_server import MockOpenAIServer
+
+
+def test_routes(tmp_path):
+    assert route_for("ollama/deepseek-r1:8b").model_name == "ollama/*"
+    assert route_for("anthropic/claude-3-5-sonnet-20241022").max_parallel_requests == LITELLM_ROUTE_CONCURRENCY
+    assert route_for("gpt-4o").model_name == "*"
+    config = tmp_path / "config.yaml"
+    config.write_text("model_list:\n  - model_name: ollama/*\n    litellm_params:\n      max_parallel_requests: 1\n")
+    assert [r.max_parallel_requests for r in load_routes(str(config))] == [1]
+
+
+def test_proxy_models_share_a_client_and_respect_route_limits():
+    with MockOpenAIServer(latency=0.2) as server:
+        base_url = server.url + "/v1"
+        llm = get_litellm_proxy("ollama/mock", base_url)
+        assert get_litellm_proxy("ollama/mock", base_url) is llm
+        assert get_litellm_proxy("anthropic/mock", base_url).http_client is llm.http_client
+
+        questions = 2 * LITELLM_ROUTE_CONCURRENCY
+        t0 = time.time()
+        with ThreadPoolExecutor(questions) as pool:
+            answers = list(pool.map(lambda i: llm.invoke("question %d" % i).content, range(questions)))
+        assert answers == ["Final Answer: done"] * questions
+        assert server.max_in_flight["ollama/mock"] == LITELLM_ROUTE_CONCURRENCY
+        assert time.time() - t0 >= 0.4
+
+        async def ask_all():
+            return await asyncio.gather(*(llm.ainvoke("async %d" % i) for i in range(questions)))
+
+        server.max_in_flight.clear()
+        assert len(asyncio.run(ask_all())) == questions
+        assert server.max_in_flight["ollama/mock"] == LITELLM_ROUTE_CONCURRENCY
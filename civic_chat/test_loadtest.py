@@ -0,0 +1,28 @@
+import math
+import time
+
+from civic_chat.loadtest import format_result, run_level
+
+
+class SleepyAgent:
+    def invoke(self, inputs):
+        time.sleep(0.02)
+        if "fail" in inputs["input"]:
+            raise ValueError("failed")
+        return {"output": "ok"}
+
+
+def test_run_level_measures_queueing_and_errors():
+    mix = [("fine", 3), ("fail", 1)]
+    serial = run_level(SleepyAgent(), 1, 20, None, mix)
+    parallel = run_level(SleepyAgent(), 10, 20, None, mix)
+    assert 0 < serial["error_rate"] < 1
+    assert serial["error_rate"] == parallel["error_rate"]
+    assert parallel["queue_mean"] < serial["queue_mean"]
+    assert serial["p50"] <= serial["p95"] <= serial["p99"]
+
+
+def test_a_level_without_questions_is_empty():
+    result = run_level(SleepyAgent(), 4, 0, None, [("q", 1)])
+    assert result["throughput"] == 0 and math.isnan(result["p50"])
+    assert "nan" in format_result(result)
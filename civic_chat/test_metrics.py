@@ -0,0 +1,68 @@
+from civic_chat.cache import ToolCache
+from civic_chat.cli import create_agent_executor
+from civic_chat.loadtest import QUESTION_MIX, load_test_tools
+from civic_chat.metrics import MetricsRegistry, agent_metrics, llm_requests, registry, tool_calls
+from civic_chat.mock.graphql_server import MockGraphQLServer, point_civic_tools_at_transport
+from civic_chat.mock.llm import ScriptedReactChatModel
+from civic_chat.tools._gql import gql_queries
+from civic_chat.tools.civic_db_gql import civic_tool
+from civic_chat.tools.civic_disease_index import disease_index_source
+from civic_chat.tools.civic_prefetch import prefetcher
+from civic_chat.tools.civic_profile_index import profile_index_source
+
+
+def test_exposition():
+    metrics = MetricsRegistry(enabled=True)
+    metrics.counter("requests_total", "Requests.", ["path"]).inc(path='/a "b"')
+    metrics.gauge("in_flight", "In flight.").set(2)
+    latency = metrics.histogram("latency_seconds", "Latency.", buckets=[0.1, 1])
+    latency.observe(0.05)
+    latency.observe(0.5)
+    metrics.const_labels = {"worker": "7"}
+    assert metrics.expose().splitlines() == [
+        "# HELP in_flight In flight.",
+        "# TYPE in_flight gauge",
+        'in_flight{worker="7"} 2',
+        "# HELP latency_seconds Latency.",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{worker="7",le="0.1"} 1',
+        'latency_seconds_bucket{worker="7",le="1"} 2',
+        'latency_seconds_bucket{worker="7",le="+Inf"} 2',
+        'latency_seconds_sum{worker="7"} 0.55',
+        'latency_seconds_count{worker="7"} 2',
+        "# HELP requests_total Requests.",
+        "# TYPE requests_total counter",
+        'requests_total{worker="7",path="/a \\"b\\""} 1',
+    ]
+    metrics.enabled = False
+    metrics.gauge("in_flight", "In flight.").set(5)
+    assert metrics.gauge("in_flight", "In flight.").get() == 2
+
+
+def test_agent_run_feeds_the_registry(tmp_path):
+    previous = civic_tool.graphql_wrapper
+    enabled = prefetcher.enabled
+    prefetcher.enabled = False
+    registry.reset()
+    try:
+        point_civic_tools_at_transport(MockGraphQLServer(), cache=ToolCache())
+        disease_index_source.clear()
+        profile_index_source.clear()
+        agent_exec = create_agent_executor(load_test_tools(), ScriptedReactChatModel(), verbose=False)
+        for _ in range(2):
+            agent_exec.invoke({"input": QUESTION_MIX[0][0]}, config={"callbacks": [agent_metrics]})
+    finally:
+        civic_tool.graphql_wrapper = previous
+        prefetcher.enabled = enabled
+        disease_index_source.clear()
+        profile_index_source.clear()
+    assert tool_calls.get(tool="get_disease_predictive_mutations_for_profiles", outcome="ok") == 2
+    assert llm_requests.get(model="ScriptedReactChatModel", outcome="ok") == 8
+    # The second question's evidence comes from the cache.
+    assert gql_queries.get(root_field="evidenceItems", source="fetch") == 3
+    assert gql_queries.get(root_field="evidenceItems", source="cache") == 3
+    path = str(tmp_path / "civic_chat.prom")
+    registry.dump(path)
+    with open(path) as f:
+        assert 'civic_chat_gql_request_seconds_count{root_field="evidenceItems"} 3' in f.read()
+    registry.reset()
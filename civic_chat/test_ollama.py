@@ -0,0 +1,43 @@
+import pytest
+from langchain_ollama import ChatOllama
+
+from civic_chat.llm import ollama
+from civic_chat.llm.ollama import ModelDoesNotFit, OllamaModelManager
+from civic_chat.mock.ollama_server import MockOllamaServer
+
+
+def test_warm_loads_once_and_keeps_the_model_loaded():
+    with MockOllamaServer(load_seconds=0.3) as server:
+        llm = ChatOllama(model="deepseek-r1:8b", base_url=server.url)
+        manager = OllamaModelManager.for_chat_model(llm, keep_alive="30m")
+        report = manager.warm(available=2 ** 40)
+        assert not report.was_loaded and server.loads == 1
+        assert report.cold_seconds >= 0.3 > report.warm_seconds
+        assert report.running["model"] == "deepseek-r1:8b"
+
+        # The chat model sends the same keep_alive, so the model stays loaded through the conversation.
+        assert llm.invoke("Hello").content == "Hello"
+        assert server.requests[-1][2]["keep_alive"] == "30m"
+        assert server.loads == 1
+        assert manager.warm().was_loaded
+
+        manager.unload()
+        assert manager.running() is None
+
+
+def test_memory_fit_check():
+    with MockOllamaServer(models={"llama3.3:70b": 42_000_000_000}) as server:
+        manager = OllamaModelManager("llama3.3:70b", base_url=server.url, num_parallel=4, num_ctx=8192)
+        # 32 layers of 8 KV heads of 128 dimensions: 128KiB per token, 4GiB for 4 slots of 8192 tokens.
+        assert manager.required_memory() == int(42_000_000_000 * 1.1) + 4 * 2 ** 30
+        with pytest.raises(ModelDoesNotFit, match="4 parallel slots"):
+            manager.warm(available=32 * 2 ** 30)
+        assert server.loads == 0
+
+
+def test_fit_check_is_skipped_where_memory_is_unknown(monkeypatch):
+    monkeypatch.setattr(ollama, "read_available_memory", lambda: None)
+    with MockOllamaServer(models={"llama3.3:70b": 42_000_000_000}) as server:
+        report = OllamaModelManager("llama3.3:70b", base_url=server.url).warm()
+        assert not report.fit_checked and server.loads == 1
+        assert "not checked to fit in memory" in str(report)
@@ -0,0 +1,183 @@
+import gc
+import json
+import os
+import time
+
+import pytest
+
+from civic_chat.cache import ToolCache
+from civic_chat.cli import create_agent_executor
+from civic_chat.loadtest import QUESTION_MIX, load_test_tools
+from civic_chat.mock.graphql_server import MockGraphQLServer, point_civic_tools_at_transport
+from civic_chat.mock.llm import ScriptedReactChatModel
+from civic_chat.tools._gql import gql_queries, gql_result_bytes
+from civic_chat.tools.civic_db_gql import civic_tool
+from civic_chat.tools.civic_disease import get_disease_id
+from civic_chat.tools.civic_disease_index import disease_index_source
+from civic_chat.tools.civic_evidence_summary import summarize_disease_mutations, summarize_disease_mutations_for_profiles
+from civic_chat.tools.civic_mutation import get_gene_molecular_profile_ids
+from civic_chat.tools.civic_mutation_evidence import (
+    count_disease_mutations_for_profiles, get_all_disease_mutations, get_disease_predictive_mutations_brief_for_profiles,
+    get_disease_predictive_mutations_for_profiles,
+)
+from civic_chat.tools.civic_prefetch import prefetcher
+from civic_chat.tools.civic_profile_index import profile_index_source
+
+#
+# Microbenchmarks of the tools and the agent loop, against the mock CIViC dataset in-process and the scripted LLM, so
+# they measure our code rather than the network or a model.
+#
+# Each benchmark is timed in units of a fixed pure-Python workload run alongside it, so the stored baselines
+# hold across machines, and fails when it takes more than PERF_TOLERANCE times its baseline.  After an intended
+# change in speed, store new baselines with:
+#
+#     CIVIC_CHAT_UPDATE_PERF_BASELINES=1 python -m pytest civic_chat/test_perf.py
+#
+# Timings are only as steady as the machine, so the benchmarks are skipped unless asked for, like this:
+#
+#     CIVIC_CHAT_PERF=1 python -m pytest civic_chat/test_perf.py
+#
+
+BASELINES_FILE = os.path.join(os.path.dirname(__file__), "perf_baselines.json")
+PERF_TOLERANCE = float(os.environ.get("CIVIC_CHAT_PERF_TOLERANCE", 2.0))
+UPDATE_BASELINES = os.environ.get("CIVIC_CHAT_UPDATE_PERF_BASELINES", "") not in ("", "0")
+RUN_PERF = UPDATE_BASELINES or os.environ.get("CIVIC_CHAT_PERF", "") not in ("", "0")
+
+pytestmark = pytest.mark.skipif(not RUN_PERF, reason="performance benchmarks run with CIVIC_CHAT_PERF=1")
+
+# How long each timing round runs, and how many rounds to take the fastest of.
+ROUND_SECONDS = 0.02
+ROUNDS = 7
+
+QUERY_FORMS = [
+    "{ diseases(name: \"Melanoma\") { nodes { id name } } }",
+    "```graphql\n{ diseases(name: \"Melanoma\") { nodes { id name } } }\n```\n",
+    json.dumps({"query": "{ diseases(name: \"Melanoma\") { nodes { id name } } }"}),
+    'query: """\ndiseases(name: "Melanoma") { nodes { id name } }\n"""\n',
+]
+
+
+def _calls_per_round(fn) -> int:
+    calls = 1
+    while True:
+        t0 = time.perf_counter()
+        for _ in range(calls):
+            fn()
+        if time.perf_counter() - t0 >= ROUND_SECONDS:
+            return calls
+        calls *= 2
+
+
+def _round(fn, calls: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(calls):
+        fn()
+    return (time.perf_counter() - t0) / calls
+
+
+def _relative_time(fn, reference) -> float:
+    """The fastest time per call of fn over that of reference, timed in alternating rounds so both see the same load."""
+    # Like timeit, with the garbage collector off, so a collection of some other test's garbage is not timed.
+    gc.collect()
+    gc.disable()
+    try:
+        calls, reference_calls = _calls_per_round(fn), _calls_per_round(reference)
+        best = best_reference = float("inf")
+        for _ in range(ROUNDS):
+            best_reference = min(best_reference, _round(reference, reference_calls))
+            best = min(best, _round(fn, calls))
+        return best / best_reference
+    finally:
+        gc.enable()
+
+
+def _reference_workload():
+    # Dict building, string formatting, JSON and sorting, like the tools do.
+    rows = [{"id": i, "name": "KRAS G%d" % i, "therapies": [{"name": "T%d" % (i % 7)}]} for i in range(200)]
+    sorted(json.loads(json.dumps(rows)), key=lambda row: row["name"])
+
+
+@pytest.fixture(scope="module")
+def bench():
+    previous = civic_tool.graphql_wrapper
+    enabled = prefetcher.enabled
+    prefetcher.enabled = False
+    with open(BASELINES_FILE) as f:
+        baselines = json.load(f)
+    measured = {}
+    point_civic_tools_at_transport(MockGraphQLServer(), cache=ToolCache())
+    disease_index_source.clear()
+    profile_index_source.clear()
+
+    def check(name: str, fn):
+        fn()  # Fill the caches and indexes first.
+        ratio = _relative_time(fn, _reference_workload)
+        measured[name] = round(ratio, 3)
+        if not UPDATE_BASELINES:
+            assert name in baselines, "no baseline for %s, store one with CIVIC_CHAT_UPDATE_PERF_BASELINES=1" % name
+            assert ratio <= baselines[name] * PERF_TOLERANCE, "%s took %.2f units, the baseline is %.2f" % (
+                name, ratio, baselines[name]
+            )
+
+    yield check
+    civic_tool.graphql_wrapper = previous
+    prefetcher.enabled = enabled
+    disease_index_source.clear()
+    profile_index_source.clear()
+    if UPDATE_BASELINES:
+        with open(BASELINES_FILE, "w") as f:
+            json.dump({**baselines, **measured}, f, indent=2, sort_keys=True)
+            f.write("\n")
+
+
+def _disease_and_profiles(profiles: int) -> dict:
+    return {
+        "disease_id": get_disease_id.func("Colorectal Cancer"),
+        "molecular_profile_ids": get_gene_molecular_profile_ids.func("KRAS")[:profiles],
+    }
+
+
+def test_query_normalization(bench):
+    wrapper = civic_tool.graphql_wrapper
+    bench("gql.execute_query_cached", lambda: [wrapper._execute_query(query) for query in QUERY_FORMS])
+
+
+@pytest.mark.parametrize("tool, tool_input", [
+    (get_disease_id, "Colorectal Cancer"),
+    (get_disease_id, "colorectl cancr"),
+    (get_gene_molecular_profile_ids, "KRAS G12"),
+    (get_all_disease_mutations, "1"),
+    (get_disease_predictive_mutations_brief_for_profiles, "(1, [1,2,3])"),
+    (count_disease_mutations_for_profiles, "(1, [1,2,3])"),
+    (summarize_disease_mutations, "1"),
+    (summarize_disease_mutations_for_profiles, "(1, [1,2,3])"),
+])
+def test_tool(bench, tool, tool_input):
+    # Through the argument parsing, as the agent calls them, but not the callbacks of a full run.
+    bench("tool.%s(%s)" % (tool.name, tool_input), lambda: tool.invoke(tool_input))
+
+
+def test_tool_argument_coercion(bench):
+    # The forms the LLM writes the same arguments in, all answered from the cache, so the coercion is most of the time.
+    inputs = ["(1, [1,2,3])", "1,2", {"disease": "1", "profile_ids": "1,2,3"}, {"disease_id": 1, "molecular_profile_ids": 2}]
+    bench("args.coerce", lambda: [count_disease_mutations_for_profiles.invoke(i) for i in inputs])
+
+
+def test_evidence_merging(bench):
+    tool_input = _disease_and_profiles(profiles=6)
+    bench("merge.get_disease_predictive_mutations_for_profiles",
+          lambda: get_disease_predictive_mutations_for_profiles.func(**tool_input))
+
+
+def test_metrics_overhead(bench):
+    # What the GraphQL wrapper records for each query answered from the cache.
+    def record():
+        gql_queries.inc(root_field="evidenceItems", source="cache")
+        gql_result_bytes.observe(7260, root_field="evidenceItems")
+
+    bench("metrics.record", record)
+
+
+def test_agent_run(bench):
+    agent_exec = create_agent_executor(load_test_tools(), ScriptedReactChatModel(), verbose=False)
+    bench("agent.react_run", lambda: agent_exec.invoke({"input": QUESTION_MIX[0][0]}))
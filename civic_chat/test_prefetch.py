@@ -0,0 +1,71 @@
+import time
+
+from civic_chat.cache import ToolCache
+from civic_chat.mock.graphql_server import MockGraphQLServer, point_civic_tools_at
+from civic_chat.tools.civic_db_gql import civic_tool
+from civic_chat.tools.civic_disease import get_disease_id
+from civic_chat.tools.civic_disease_index import disease_index_source
+from civic_chat.tools.civic_mutation import get_gene_molecular_profile_ids
+from civic_chat.tools.civic_mutation_evidence import (
+    get_disease_predictive_mutations_brief_for_profiles, get_disease_predictive_mutations_for_profiles,
+)
+from civic_chat.tools.civic_prefetch import prefetcher
+from civic_chat.tools.civic_profile_index import profile_index_source
+
+
+def test_evidence_is_fetched_while_the_llm_thinks():
+    previous = civic_tool.graphql_wrapper
+    prefetcher.reset()
+    try:
+        with MockGraphQLServer(latency=0.05) as server:
+            point_civic_tools_at(server.url, cache=ToolCache())
+            disease_index_source.clear()
+            profile_index_source.clear()
+            disease_id = get_disease_id.func("Colorectal Cancer")
+            profile_ids = get_gene_molecular_profile_ids.func("KRAS")
+            time.sleep(0.5)
+            requests = len(server.requests)
+            t0 = time.time()
+            evidence = get_disease_predictive_mutations_for_profiles.func(disease_id, profile_ids[:3])
+            assert time.time() - t0 < 0.05
+            assert evidence and len(server.requests) == requests
+    finally:
+        civic_tool.graphql_wrapper = previous
+        disease_index_source.clear()
+        profile_index_source.clear()
+    stats = prefetcher.stats()
+    assert stats["by_kind"]["profile"]["hits"] == 3
+    assert stats["by_kind"]["disease"]["issued"] == 1 and stats["by_kind"]["disease"]["hits"] == 0
+    assert stats["issued"] == stats["hits"] + stats["pending"] == 1 + min(len(profile_ids), 5)
+    prefetcher.reset()
+
+
+def test_brief_evidence_uses_the_prefetched_evidence():
+    previous = civic_tool.graphql_wrapper
+    prefetcher.reset()
+    try:
+        with MockGraphQLServer(latency=0.2) as server:
+            point_civic_tools_at(server.url, cache=ToolCache())
+            disease_index_source.clear()
+            profile_index_source.clear()
+            disease_id = get_disease_id.func("Colorectal Cancer")
+            profile_ids = get_gene_molecular_profile_ids.func("KRAS")
+            # Asked at once, while the guesses are still on their way.
+            brief = get_disease_predictive_mutations_brief_for_profiles.func(disease_id, profile_ids[:3])
+            full = get_disease_predictive_mutations_for_profiles.func(disease_id, profile_ids[:3])
+            evidence_queries = [body["query"] for _, _, body in server.requests if "evidenceItems" in body["query"]]
+    finally:
+        civic_tool.graphql_wrapper = previous
+        disease_index_source.clear()
+        profile_index_source.clear()
+    # Only the guesses went to the server, and the brief evidence was cut down from them.
+    assert 4 <= len(evidence_queries) <= 1 + min(len(profile_ids), 5)
+    assert all("description" in query for query in evidence_queries)
+    assert prefetcher.stats()["by_kind"]["profile"]["hits"] == 3
+    assert brief == [
+        {"id": item["id"], "molecularProfile": {"name": item["molecularProfile"]["name"]},
+         "evidenceLevel": item["evidenceLevel"], "evidenceRating": item["evidenceRating"],
+         "evidenceDirection": item["evidenceDirection"], "therapies": [{"name": t["name"]} for t in item["therapies"]]}
+        for item in full
+    ]
+    prefetcher.reset()
@@ -0,0 +1,102 @@
+import re
+import threading
+import time
+
+from civic_chat.mock.graphql_server import MockGraphQLServer, point_civic_tools_at
+from civic_chat.sync import LocalStore
+from civic_chat.tools.civic_db_gql import civic_tool
+from civic_chat.tools.civic_profile_index import MolecularProfileIndex, ProfileIndexSource, parse_profile_name
+
+PROFILES = [
+    {"id": 1, "name": "KRAS G12C"},
+    {"id": 2, "name": "KRAS G12D"},
+    {"id": 3, "name": "KRAS G13D"},
+    {"id": 4, "name": "KRAS Mutation"},
+    {"id": 5, "name": "BRAF V600E AND KRAS G12V"},
+    {"id": 6, "name": "EGFR Exon 19 Deletion"},
+]
+
+
+def test_prefix_and_fuzzy_lookup():
+    assert parse_profile_name("BRAF V600E AND KRAS G12V") == [("BRAF", "V600E"), ("KRAS", "G12V")]
+    index = MolecularProfileIndex(PROFILES)
+    assert index.lookup("KRAS") == [1, 2, 3, 4, 5]
+    assert index.lookup("KRAS G12") == [1, 2, 5]
+    assert index.lookup("kras p.G12C") == [1]
+    assert index.lookup("BRAF") == [5]
+    assert index.lookup("EGFR exon 19") == [6]
+    assert index.lookup("KRSA G13D") == [3]
+    assert index.lookup("KRAS G13E") == [3]
+    assert index.lookup("TP53") == []
+
+    t0 = time.perf_counter()
+    for _ in range(1000):
+        index.lookup("KRAS G12")
+    assert time.perf_counter() - t0 < 1.0
+
+
+def test_source_pages_through_remote_genes_then_prefers_the_local_store():
+    store = LocalStore(":memory:")
+    previous = civic_tool.graphql_wrapper
+    try:
+        with MockGraphQLServer() as server:
+            point_civic_tools_at(server.url)
+            source = ProfileIndexSource(store=store)
+            assert source.lookup("KRAS") == [1, 2, 3, 4, 5, 6]
+            queries = [body["query"] for _, _, body in server.requests]
+            assert "description" not in queries[0] and "first: 100" in queries[0]
+            assert source.lookup("KRAS G12") == [1, 2, 3]
+            assert len(server.requests) == 1
+    finally:
+        civic_tool.graphql_wrapper = previous
+
+    store.apply_page("molecular_profiles", PROFILES, 1, None)
+    store.complete_pass("molecular_profiles", 1)
+    source._checked_at = 0
+    assert source.lookup("KRAS G12") == [1, 2, 5]
+
+
+def test_source_resolves_a_misspelled_gene_remotely():
+    previous = civic_tool.graphql_wrapper
+    try:
+        with MockGraphQLServer() as server:
+            point_civic_tools_at(server.url)
+            source = ProfileIndexSource(store=LocalStore(":memory:"))
+            assert source.lookup("KRSA G12") == [1, 2, 3]
+            queries = [body["query"] for _, _, body in server.requests]
+            assert 'name: "KRSA"' in queries[0] and "genes" in queries[1] and 'name: "KRAS"' in queries[2]
+            assert source.lookup("BRAF V600E") == [7]
+            assert source.lookup("BARF V600E") == [7]
+            # The gene listing is fetched once.
+            assert sum("genes" in body["query"] for _, _, body in server.requests) == 1
+    finally:
+        civic_tool.graphql_wrapper = previous
+
+
+class BlockingWrapper:
+    # Holds up every query for one gene until released, and answers the others at once.
+    def __init__(self):
+        self.release = threading.Event()
+
+    def _execute_query(self, query):
+        if '"BRAF"' in query:
+            self.release.wait(5)
+        gene = re.search(r'name: "(\w+)"', query).group(1)
+        nodes = [profile for profile in PROFILES if profile["name"].startswith(gene)]
+        return {"molecularProfiles": {"pageInfo": {"hasNextPage": False, "endCursor": None}, "nodes": nodes}}
+
+
+def test_a_slow_gene_does_not_hold_up_the_others():
+    wrapper = BlockingWrapper()
+    source = ProfileIndexSource(store=LocalStore(":memory:"), wrapper=wrapper)
+    slow = threading.Thread(target=source.lookup, args=("BRAF",))
+    slow.start()
+    try:
+        time.sleep(0.05)
+        t0 = time.perf_counter()
+        assert source.lookup("EGFR") == [6]
+        assert time.perf_counter() - t0 < 1
+    finally:
+        wrapper.release.set()
+        slow.join()
+    assert source.lookup("BRAF") == [5]
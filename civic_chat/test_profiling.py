@@ -0,0 +1,91 @@
+import time
+import tracemalloc
+from uuid import uuid4
+
+from civic_chat import profiling
+from civic_chat.profiling import MemoryProfiler
+
+MIB = 1024 * 1024
+
+
+def allocate(megabytes: int) -> bytearray:
+    block = bytearray(megabytes * MIB)
+    # Held across a few samples.
+    time.sleep(0.05)
+    return block
+
+
+def test_step_peak_and_top_allocations():
+    was_tracing = tracemalloc.is_tracing()
+    profiler = MemoryProfiler()
+    profiler.start()
+    try:
+        # A higher process peak from before the step must not show up in it, and must be left as it was.
+        before = allocate(64)
+        del before
+        process_peak = tracemalloc.get_traced_memory()[1]
+
+        run_id = uuid4()
+        profiler.on_tool_start({"name": "allocate"}, "", run_id=run_id)
+        freed = allocate(16)
+        del freed
+        kept = allocate(4)
+        profiler.on_tool_end("done", run_id=run_id)
+        report = profiler.report()
+        assert tracemalloc.get_traced_memory()[1] >= process_peak
+    finally:
+        profiler.stop()
+        if not was_tracing:
+            tracemalloc.stop()
+
+    step, = profiler.steps
+    assert step["name"] == "allocate" and step["result_bytes"] == 4
+    assert 16 * MIB <= step["traced_peak"] < 21 * MIB
+    assert 4 * MIB <= step["allocated"] < 5 * MIB
+    assert "test_profiling.py" in step["top_sites"][0] and "4.0MiB" in step["top_sites"][0]
+    assert "allocate" in report
+    assert len(kept) == 4 * MIB
+
+
+def run_steps(profiler, *megabytes):
+    for size in megabytes:
+        run_id = uuid4()
+        profiler.on_tool_start({"name": "allocate %d" % size}, "", run_id=run_id)
+        # Written to, so the pages are resident.
+        block = b"\x01" * (size * MIB)
+        time.sleep(0.05)
+        del block
+        profiler.on_tool_end("done", run_id=run_id)
+
+
+def test_peak_rss_is_per_step():
+    was_tracing = tracemalloc.is_tracing()
+    profiler = MemoryProfiler()
+    profiler.start()
+    try:
+        run_steps(profiler, 128, 1)
+    finally:
+        profiler.stop()
+        if not was_tracing:
+            tracemalloc.stop()
+    large, small = profiler.steps
+    # The small step after the large one does not inherit its peak, as the lifetime high-water mark would.
+    assert large["peak_rss"] - small["peak_rss"] > 64 * MIB
+    assert small["peak_rss"] >= small["rss"]
+
+
+def test_without_proc(monkeypatch):
+    monkeypatch.setattr(profiling, "read_rss", lambda: None)
+    was_tracing = tracemalloc.is_tracing()
+    profiler = MemoryProfiler()
+    profiler.start()
+    try:
+        run_steps(profiler, 1)
+        report = profiler.report()
+    finally:
+        profiler.stop()
+        if not was_tracing:
+            tracemalloc.stop()
+    step, = profiler.steps
+    assert step["rss"] is None
+    assert "allocate 1" in report
@@ -0,0 +1,48 @@
+from langchain_core.messages import HumanMessage, SystemMessage
+from langchain_core.tools import tool
+
+from civic_chat.llm.anthropic import ChatAnthropicPromptCached
+from civic_chat.mock.anthropic_server import MockAnthropicServer
+
+SYSTEM = "Answer the following questions by using tools if possible. " * 50
+
+
+@tool
+def get_disease_id(disease_name: str) -> int:
+    """Get the ID of a disease from the name.
+
+    Args:
+        disease_name: The name of the disease with the first letter of each word capitalized.
+    """
+    return 11
+
+
+def test_static_prefix_is_cached_after_the_first_request():
+    with MockAnthropicServer() as server:
+        llm = ChatAnthropicPromptCached(model="claude-3-5-sonnet-20241022", base_url=server.url, api_key="test")
+        agent_llm = llm.bind_tools([get_disease_id])
+        agent_llm.invoke([SystemMessage(SYSTEM), HumanMessage("What is the ID of Colorectal Cancer?")])
+        agent_llm.invoke([SystemMessage(SYSTEM), HumanMessage("What is the ID of Melanoma?")])
+
+        first, second = [body for _, _, body in server.requests]
+        assert second["tools"][-1]["cache_control"] == {"type": "ephemeral"}
+        assert second["system"][-1]["cache_control"] == {"type": "ephemeral"}
+
+        stats = llm.prompt_cache_stats
+        assert stats.requests == 2
+        assert stats.cache_creation_tokens > 0
+        assert stats.cache_read_tokens == stats.cache_creation_tokens
+        assert stats.uncached_tokens > 0
+
+
+def test_react_preamble_is_split_into_a_cached_block():
+    with MockAnthropicServer() as server:
+        llm = ChatAnthropicPromptCached(model="claude-3-5-sonnet-20241022", base_url=server.url, api_key="test")
+        preamble = "Answer the following questions as best you can. You have access to the following tools:\n" * 40
+        llm.invoke(preamble + "\nQuestion: KRAS?\nThought:")
+        llm.invoke(preamble + "\nQuestion: KRAS?\nThought: look it up\nObservation: 11\nThought:")
+
+        content = server.requests[1][2]["messages"][0]["content"]
+        assert content[0]["cache_control"] == {"type": "ephemeral"}
+        assert content[1]["text"].startswith("Question: KRAS?")
+        assert llm.prompt_cache_stats.cache_read_tokens > 0
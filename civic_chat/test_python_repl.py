@@ -0,0 +1,71 @@
+import pytest
+
+from civic_chat.deadline import Deadline
+from civic_chat.session import session_frames
+from civic_chat.tools.python_repl import PythonReplPool
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(session_frames, "enabled", True)
+    pool = PythonReplPool(timeout=2, cpu_seconds=1, memory_mb=200)
+    pool.start()
+    yield pool
+    pool.close()
+    session_frames.clear()
+
+
+def test_variables_persist_within_a_session(pool):
+    assert pool.run("x = 41\nx + 1").strip() == "42"
+    assert pool.run("print(x)").strip() == "41"
+    assert "NameError" in pool.run("x", session="other")
+
+
+def test_session_evidence_is_preloaded(pool):
+    session_frames.record("evidence_disease_1", [
+        {"id": 1, "molecularProfile": {"name": "KRAS G12C"}, "therapies": [{"name": "Sotorasib"}]},
+    ])
+    assert pool.run("evidence.loc[0, 'molecularProfile.name']").strip() == "'KRAS G12C'"
+    session_frames.record("evidence_disease_1", [{"id": 1}, {"id": 2}])
+    assert pool.run("len(frames['evidence_disease_1'])").strip() == "2"
+
+
+def test_each_question_has_its_own_frames_and_worker(pool):
+    with Deadline() as first:
+        session_frames.record("evidence_disease_1", [{"id": 1}])
+        assert pool.run("x = 1\nlen(evidence)").strip() == "1"
+        with Deadline():
+            assert list(session_frames.manifest()) == []
+            assert "NameError" in pool.run("x")
+        assert pool.run("x").strip() == "1"
+    # The question is over, so its frames and its worker are gone.
+    assert first not in session_frames._sessions
+    assert first not in pool._bound
+    with first:
+        assert session_frames.manifest() == {}
+
+
+def test_frames_are_not_kept_without_the_repl(pool, monkeypatch):
+    monkeypatch.setattr(session_frames, "enabled", False)
+    session_frames.record("evidence_disease_1", [{"id": 1}])
+    assert session_frames.manifest() == {}
+
+
+def test_limits_replace_the_worker(pool):
+    assert "TimeoutError" in pool.run("import time\ntime.sleep(5)")
+    assert "CPU limit" in pool.run("while True: pass")
+    assert "MemoryError" in pool.run("b = bytearray(500 * 1024 * 1024)")
+    assert pool.run("1 + 1").strip() == "2"
+
+
+def test_frames_are_shared_memory_and_built_once(pool):
+    session_frames.record("evidence_disease_1", [
+        {"id": i, "evidenceRating": i % 5, "molecularProfile": {"name": "KRAS G12C"}} for i in range(1000)
+    ])
+    first = pool.run("f = frames['evidence_disease_1']\nid(f)")
+    # The numeric columns are views of the mapped segment, not arrays of their own.
+    assert pool.run("import numpy as np\nbase = f['evidenceRating'].to_numpy().base\n"
+                    "while getattr(base, 'base', None) is not None and not isinstance(base, memoryview): base = base.base\n"
+                    "type(base).__name__").strip() == "'memoryview'"
+    assert pool.run("int(f['evidenceRating'].sum())").strip() == str(sum(i % 5 for i in range(1000)))
+    assert pool.run("id(frames['evidence_disease_1'])") == first
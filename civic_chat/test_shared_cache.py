@@ -0,0 +1,77 @@
+import json
+import multiprocessing
+import os
+import re
+import signal
+import subprocess
+import sys
+import time
+import urllib.request
+
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration
+
+from civic_chat.cache import LLMCache, SharedCache
+
+
+def _write(path, worker):
+    cache = SharedCache("tool", path)
+    for i in range(50):
+        cache.set("%d-%d" % (worker, i), json.dumps({"worker": worker, "i": i}))
+
+
+def test_processes_share_entries(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    cache = SharedCache("tool", path)
+    processes = [multiprocessing.get_context("fork").Process(target=_write, args=(path, w)) for w in range(4)]
+    [p.start() for p in processes]
+    [p.join() for p in processes]
+    assert all(p.exitcode == 0 for p in processes)
+    assert len(cache) == 200
+    assert json.loads(cache.get("3-49")) == {"worker": 3, "i": 49}
+    assert SharedCache("llm", path).get("3-49") is None
+
+    llm_cache = LLMCache(SharedCache("llm", path))
+    llm_cache.update("prompt", "model", [ChatGeneration(message=AIMessage("answer"))])
+    assert LLMCache(SharedCache("llm", path)).lookup("prompt", "model")[0].text == "answer"
+
+
+def _post(url, question):
+    request = urllib.request.Request(url + "/chat", data=json.dumps({"question": question}).encode())
+    with urllib.request.urlopen(request, timeout=30) as response:
+        return json.loads(response.read())
+
+
+def test_prefork_workers_share_the_socket_and_cache(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    launcher = subprocess.Popen(
+        [sys.executable, "-m", "civic_chat.server", "--workers", "2", "--port", "0", "--mock",
+         "--mock-llm-latency", "0.1", "--cache-file", path],
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True,
+    )
+    try:
+        url = re.search(r"(http://\S+)", launcher.stdout.readline()).group(1)
+        question = 'What is the evidence of mutations associated with the gene "KRAS" in relation to Colorectal Cancer?'
+        first = _post(url, question)
+        assert "7354 characters" in first["answer"]
+
+        # Every step of the answer is now cached, so any worker answers at once.
+        workers = set()
+        for _ in range(6):
+            again = _post(url, question)
+            assert again["answer"] == first["answer"] and again["elapsed"] < 0.1
+            workers.add(again["worker"])
+
+        with urllib.request.urlopen(url + "/metrics", timeout=30) as response:
+            metrics = response.read().decode()
+        assert 'civic_chat_llm_cache_lookups_total{worker="' in metrics
+        assert 'civic_chat_tool_calls_total{worker="' in metrics
+
+        os.kill(first["worker"], signal.SIGKILL)
+        time.sleep(1)
+        assert _post(url, question)["answer"] == first["answer"]
+    finally:
+        launcher.send_signal(signal.SIGTERM)
+        launcher.wait(timeout=10)
+    namespaces = dict(SharedCache("graphql", path)._db().execute("SELECT namespace, COUNT(*) FROM cache GROUP BY 1"))
+    assert namespaces["graphql"] >= 3 and namespaces["llm"] == 4
@@ -0,0 +1,53 @@
+import re
+
+import pytest
+
+from civic_chat.sync import LocalStore, sync_entity
+
+
+class FakeWrapper:
+    # Serves diseases from a list, a page at a time, and can fail after a number of pages.
+    def __init__(self, nodes, fail_after_pages=None):
+        self.nodes = nodes
+        self.fail_after_pages = fail_after_pages
+        self.pages = 0
+
+    def _fetch(self, query):
+        if self.fail_after_pages is not None and self.pages >= self.fail_after_pages:
+            raise ConnectionError("interrupted")
+        self.pages += 1
+        first = int(re.search(r"first: (\d+)", query).group(1))
+        after = re.search(r'after: "(\d+)"', query)
+        start = int(after.group(1)) if after else 0
+        page = self.nodes[start:start + first]
+        end = start + len(page)
+        return {"diseases": {"nodes": page, "pageInfo": {"endCursor": str(end), "hasNextPage": end < len(self.nodes)}}}
+
+
+def diseases(n, status="SUBMITTED"):
+    return [{"id": i, "name": "Disease %d" % i, "status": status} for i in range(1, n + 1)]
+
+
+def test_sync_applies_only_deltas():
+    store = LocalStore(":memory:")
+    assert sync_entity(store, "diseases", FakeWrapper(diseases(5)), page_size=2)["new"] == 5
+
+    nodes = diseases(4)
+    nodes[0]["status"] = "ACCEPTED"
+    nodes.append({"id": 9, "name": "Disease 9"})
+    totals = sync_entity(store, "diseases", FakeWrapper(nodes), page_size=2)
+    assert totals == {"new": 1, "changed": 1, "accepted": 1, "unchanged": 3, "removed": 1}
+    assert [d["id"] for d in store.records("diseases")] == [1, 2, 3, 4, 9]
+
+
+def test_sync_resumes_after_interruption():
+    store = LocalStore(":memory:")
+    with pytest.raises(ConnectionError):
+        sync_entity(store, "diseases", FakeWrapper(diseases(7), fail_after_pages=2), page_size=2)
+    assert store.count("diseases") == 4
+
+    wrapper = FakeWrapper(diseases(7))
+    totals = sync_entity(store, "diseases", wrapper, page_size=2)
+    assert wrapper.pages == 2
+    assert totals["new"] == 3 and totals["removed"] == 0
+    assert store.get_state("diseases")[0] is None
@@ -0,0 +1,45 @@
+import pytest
+
+from civic_chat.cli import create_agent_executor
+from civic_chat.loadtest import load_test_tools
+from civic_chat.mock.llm import ScriptedReactChatModel
+from civic_chat.tools._args import ToolArgStats
+from civic_chat.tools import _args
+from civic_chat.tools.civic_mutation_evidence import count_disease_mutations_for_profiles, get_all_disease_mutations
+
+EXPECTED = {"disease_id": 1, "molecular_profile_ids": [2, 3]}
+
+
+@pytest.fixture
+def stats(monkeypatch):
+    stats = ToolArgStats()
+    monkeypatch.setattr(_args, "tool_arg_stats", stats)
+    return stats
+
+
+@pytest.mark.parametrize("tool_input", [
+    "(1, [2,3])",
+    "1, 2, 3",
+    "[1, [2, 3]]",
+    '```{"disease_id": 1, "molecular_profile_ids": [2, 3]}```',
+    "disease_id=1, molecular_profile_ids=[2, 3]",
+    {"disease": "1", "profile_ids": "2,3"},
+    {"diseaseId": 1.0, "molecularProfileIds": ["2", "3"]},
+    {"disease_id_and_gene_molecular_profile_id": "(1, [2,3])"},
+])
+def test_common_variants_are_recovered(stats, tool_input):
+    assert count_disease_mutations_for_profiles._parse_input(tool_input, None) == EXPECTED
+    assert stats.recovered["count_disease_mutations_for_profiles"] == 1
+
+
+def test_valid_and_invalid_inputs(stats):
+    assert count_disease_mutations_for_profiles._parse_input(dict(EXPECTED), None) == EXPECTED
+    assert get_all_disease_mutations._parse_input('"1"', None) == {"disease_id": 1}
+    assert get_all_disease_mutations._parse_input("disease 1", None) == {"disease_id": 1}
+    assert "validation error" in count_disease_mutations_for_profiles.run("nothing")
+    assert str(stats) == "4 calls, 1 recovered, 1 failed"
+
+
+def test_agent_uses_structured_actions(stats):
+    agent_exec = create_agent_executor(load_test_tools(), ScriptedReactChatModel(), verbose=False)
+    assert "$JSON_BLOB" in agent_exec.agent.llm_chain.prompt.messages[0].prompt.template
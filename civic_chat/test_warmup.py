@@ -0,0 +1,66 @@
+import time
+
+from civic_chat import warmup
+from civic_chat.cache import ToolCache, tool_cache
+from civic_chat.mock.graphql_server import MockGraphQLServer, point_civic_tools_at
+from civic_chat.tools.civic_db_gql import civic_tool
+from civic_chat.tools.civic_mutation_evidence import query_predictive_evidence
+
+RATE = 20.0
+
+
+def test_warmup_fills_the_cache_sessions_load(tmp_path, monkeypatch):
+    cache_file = str(tmp_path / "tool_cache.json")
+    monkeypatch.setattr(warmup, "CACHE_FILE", cache_file)
+    saved = tool_cache.items()
+    previous = civic_tool.graphql_wrapper
+    try:
+        with MockGraphQLServer() as server:
+            tool_cache.clear()
+            point_civic_tools_at(server.url, cache=tool_cache)
+            t0 = time.time()
+            warmup.warmup(genes=["KRAS"], disease=["Colorectal Cancer", "Melanoma"], dump=None, top_n=20, workers=3,
+                          rate=RATE)
+            elapsed = time.time() - t0
+            fetched = len(server.requests)
+
+            # Warming up again is answered from what the first run saved.
+            warmup.warmup(genes=["KRAS"], disease=["Colorectal Cancer", "Melanoma"], dump=None, top_n=20, workers=3,
+                          rate=RATE)
+            assert len(server.requests) == fetched
+
+            # A session loads the saved cache, and asks the server for none of the warmed evidence.
+            session_cache = ToolCache()
+            session_cache.load(cache_file)
+            point_civic_tools_at(server.url, cache=session_cache)
+            query_predictive_evidence(1)
+            query_predictive_evidence(2, 1)
+            assert len(server.requests) == fetched
+    finally:
+        civic_tool.graphql_wrapper = previous
+        tool_cache.clear()
+        tool_cache.update(saved)
+
+    keys = [key for key, _ in session_cache.items()]
+    assert sum("diseaseId: 1," in key and "molecularProfileId" not in key for key in keys) == 1
+    assert sum("diseaseId: 2, molecularProfileId" in key for key in keys) == sum(
+        "diseaseId: 1, molecularProfileId" in key for key in keys
+    ) > 1
+    # Every request of every worker waited for its turn at the shared rate.
+    assert elapsed >= (fetched - 1) / RATE
+
+
+def test_cache_file_is_loaded_on_first_use_and_may_be_corrupt(tmp_path, caplog):
+    path = str(tmp_path / "tool_cache.json")
+    saved = ToolCache()
+    saved.set("query", "result")
+    saved.save(path)
+    cache = ToolCache(path=path)
+    with open(path, "w") as f:
+        f.write('{"query": [17')
+    # Not read until used, and then read as it is by then.
+    assert cache.get("query") is None and len(cache) == 0
+    assert "could not be read" in caplog.text
+
+    saved.save(path)
+    assert ToolCache(path=path).get("query") == "result"
@@ -0,0 +1,224 @@
+import ast
+import json
+import re
+import threading
+import typing
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional, Union
+
+from langchain_core.tools import StructuredTool
+from pydantic import BaseModel, ValidationError
+
+from civic_chat.metrics import registry
+
+#
+# Typed tool arguments, with a local coercion layer for the forms LLMs actually write them in.
+#
+# The evidence tools take a disease ID and a list of molecular profile IDs.  Models asked for those write
+# {"disease_id": 1, "molecular_profile_ids": [2, 3]}, but also "1,2", "(1, [2,3])", "[1, 2, 3]", {"disease": "1"},
+# {"profile_ids": "2,3"}, a single ID where a list goes, and so on.  Rather than fail validation and spend another
+# LLM turn on a retry, a tolerant tool coerces the input it was given into its schema:
+#
+#   - a string is parsed as JSON, then as a Python literal, then for the integers in it,
+#   - a sequence fills the required arguments in order, the last list argument taking whatever is left; optional
+#     arguments, like the fields of the brief evidence tool, are only taken by name,
+#   - a key fills the argument its name is a part of, like "disease" or "profileIds", and a key naming several
+#     arguments, like the old "disease_id_and_gene_molecular_profile_id", is parsed as a sequence for all of them,
+#   - an int argument takes the first integer of its value, and a list of ints takes all of them.
+#
+# An input that only validates after coercion counts as recovered in tool_arg_stats, and one that does not validate
+# even then as failed; its error is handed to the LLM as the tool's result.
+#
+
+INTEGER = re.compile(r"-?\d+")
+
+# Wrapping an input can come with, from a model quoting or fencing it.
+_WRAPPING = " \t\n\"'`"
+
+tool_arguments = registry.counter(
+    "civic_chat_tool_arguments_total", "Tool inputs by tool, and whether they were valid, recovered or failed.",
+    ["tool", "outcome"],
+)
+
+
+class ToolArgStats:
+    def __init__(self):
+        self.calls: Dict[str, int] = defaultdict(int)
+        self.recovered: Dict[str, int] = defaultdict(int)
+        self.failed: Dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def add(self, tool_name: str, recovered: bool = False, failed: bool = False):
+        tool_arguments.inc(tool=tool_name, outcome="failed" if failed else "recovered" if recovered else "valid")
+        with self._lock:
+            self.calls[tool_name] += 1
+            if recovered:
+                self.recovered[tool_name] += 1
+            if failed:
+                self.failed[tool_name] += 1
+
+    def reset(self):
+        with self._lock:
+            self.calls.clear()
+            self.recovered.clear()
+            self.failed.clear()
+
+    def __str__(self):
+        return (
+            f"{sum(self.calls.values())} calls, {sum(self.recovered.values())} recovered, "
+            f"{sum(self.failed.values())} failed"
+        )
+
+
+tool_arg_stats = ToolArgStats()
+
+
+def _is_list(annotation: Any) -> bool:
+    return typing.get_origin(annotation) in (list, List)
+
+
+def _normalize_name(name: str) -> str:
+    # "molecularProfileIds", "molecular_profile_ids" and "molecular profile id" all become "molecularprofile".
+    name = re.sub(r"[^a-z]", "", name.lower())
+    for suffix in ("ids", "id", "s"):
+        if name.endswith(suffix) and len(name) > len(suffix):
+            return name[:-len(suffix)]
+    return name
+
+
+def _parse_text(text: str) -> Any:
+    text = text.strip(_WRAPPING)
+    for parse in (json.loads, ast.literal_eval):
+        try:
+            return parse(text)
+        except (ValueError, SyntaxError, MemoryError, RecursionError, TypeError):
+            pass
+    return text
+
+
+def _flatten(value: Any) -> list:
+    if isinstance(value, (list, tuple, set)):
+        return [v for item in value for v in _flatten(item)]
+    if isinstance(value, dict):
+        return _flatten(list(value.values()))
+    if isinstance(value, str):
+        return [int(i) for i in INTEGER.findall(value)]
+    return [value]
+
+
+def _coerce_value(value: Any, annotation: Any) -> Any:
+    if typing.get_origin(annotation) is Union:
+        # An optional argument given a value is coerced like the type it is optional of.
+        types = [t for t in typing.get_args(annotation) if t is not type(None)]
+        if value is None or len(types) != 1:
+            return value
+        annotation = types[0]
+    if _is_list(annotation):
+        if isinstance(value, str):
+            value = _parse_text(value)
+        if typing.get_args(annotation)[:1] == (int,):
+            return [_coerce_value(v, int) for v in _flatten(value)]
+        if isinstance(value, str):
+            # Like "id, therapies.name".
+            return [v.strip() for v in value.split(",") if v.strip()]
+        return list(value) if isinstance(value, (list, tuple, set)) else [value]
+    if annotation is int:
+        if isinstance(value, float) and value.is_integer():
+            return int(value)
+        if isinstance(value, (list, tuple)) and len(value) == 1:
+            return _coerce_value(value[0], int)
+        if isinstance(value, str):
+            match = INTEGER.search(value)
+            return int(match.group()) if match else value
+    return value
+
+
+def _fill_in_order(values: list, fields: Dict[str, Any]) -> Dict[str, Any]:
+    names = list(fields)
+    filled = {}
+    for i, name in enumerate(names):
+        if i >= len(values):
+            break
+        if i == len(names) - 1 and _is_list(fields[name].annotation):
+            # The last list argument takes the rest, so "1, 2, 3" is disease 1 and profiles 2 and 3.
+            filled[name] = values[i:] if len(values) > i + 1 else values[i]
+        else:
+            filled[name] = values[i]
+    return filled
+
+
+def _as_sequence(value: Any) -> list:
+    if isinstance(value, str):
+        value = _parse_text(value)
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    if isinstance(value, str):
+        # Free text like "disease 1, profiles 2 and 3", or the old "1,2".
+        return [int(i) for i in INTEGER.findall(value)]
+    return [value]
+
+
+def coerce_arguments(schema: type, tool_input: Union[str, dict]) -> Dict[str, Any]:
+    """Best-effort arguments for the schema from a tool input in any of the forms described above."""
+    fields = schema.model_fields
+    if isinstance(tool_input, str):
+        tool_input = _parse_text(tool_input)
+    if not isinstance(tool_input, dict):
+        required = {name: field for name, field in fields.items() if field.is_required()}
+        return {name: _coerce_value(v, fields[name].annotation)
+                for name, v in _fill_in_order(_as_sequence(tool_input), required).items()}
+
+    arguments = {}
+    leftover = {}
+    normalized = {name: _normalize_name(name) for name in fields}
+    for key, value in tool_input.items():
+        if key in fields:
+            arguments[key] = value
+            continue
+        key_name = _normalize_name(key)
+        matches = [name for name, field in normalized.items() if key_name and (key_name in field or field in key_name)]
+        if len(matches) == 1:
+            arguments.setdefault(matches[0], value)
+        else:
+            leftover[key] = value
+    missing = [name for name in fields if name not in arguments and fields[name].is_required()]
+    if missing and len(leftover) == 1:
+        # One key for several arguments, or a name that means nothing to us: read its value in order.
+        filled = _fill_in_order(_as_sequence(next(iter(leftover.values()))), {name: fields[name] for name in missing})
+        arguments.update(filled)
+    return {name: _coerce_value(v, fields[name].annotation) for name, v in arguments.items()}
+
+
+class TolerantStructuredTool(StructuredTool):
+    """A StructuredTool that coerces inputs which do not fit its schema, instead of failing them."""
+
+    handle_validation_error: Union[bool, str, Callable, None] = True
+
+    def _parse_input(self, tool_input: Union[str, dict], tool_call_id: Optional[str]) -> Union[str, Dict[str, Any]]:
+        schema = self.args_schema
+        if not (isinstance(schema, type) and issubclass(schema, BaseModel)):
+            return super()._parse_input(tool_input, tool_call_id)
+        if isinstance(tool_input, str) and len(schema.model_fields) == 1:
+            # A plain string for the only argument is how the ReAct agent always calls, not a mistake.
+            as_given = {next(iter(schema.model_fields)): tool_input.strip(_WRAPPING)}
+        else:
+            as_given = tool_input
+        if isinstance(as_given, dict):
+            try:
+                parsed = super()._parse_input(as_given, tool_call_id)
+                tool_arg_stats.add(self.name)
+                return parsed
+            except ValidationError:
+                pass
+        try:
+            parsed = super()._parse_input(coerce_arguments(schema, tool_input), tool_call_id)
+        except ValidationError:
+            tool_arg_stats.add(self.name, failed=True)
+            raise
+        tool_arg_stats.add(self.name, recovered=True)
+        return parsed
+
+
+def tolerant_tool(func: Callable) -> TolerantStructuredTool:
+    """Like @tool, for a function with typed arguments, making a TolerantStructuredTool."""
+    return TolerantStructuredTool.from_function(func)
@@ -1,16 +1,199 @@
+import asyncio
+import copy
 import json
 import re
-from typing import Dict, Any
+import threading
+import time
+from typing import Dict, Any, Callable, Iterable, Optional, Set
 
 from langchain_community.utilities.graphql import GraphQLAPIWrapper
+from pydantic import PrivateAttr
+
+from civic_chat.metrics import SIZE_BUCKETS, registry
 
 # This is shared by both graphql clients, and handles quirks in the different LLMs that generate
 # GQL with characters that are not expected.
 
+
+def project_fields(paths: Iterable[str], indent: str = "    ") -> str:
+    """Turn dotted field paths like ["id", "therapies.name"] into a GQL selection set, without the outer braces."""
+    tree: Dict[str, dict] = {}
+    for path in paths:
+        node = tree
+        for name in path.split("."):
+            node = node.setdefault(name, {})
+
+    def render(node: Dict[str, dict], depth: int) -> str:
+        lines = []
+        for name, children in node.items():
+            if children:
+                lines.append("%s%s {\n%s\n%s}" % (indent * depth, name, render(children, depth + 1), indent * depth))
+            else:
+                lines.append(indent * depth + name)
+        return "\n".join(lines)
+
+    return render(tree, 0)
+
+
+def field_paths(selection: str) -> Set[str]:
+    """The dotted paths of the leaf fields in a GQL selection set, such as one of the *_FIELDS constants."""
+    from graphql import parse
+
+    paths = set()
+
+    def walk(selection_set, prefix: str):
+        for field in selection_set.selections:
+            path = prefix + field.name.value
+            if field.selection_set is None:
+                paths.add(path)
+            else:
+                walk(field.selection_set, path + ".")
+
+    walk(parse("{\n%s\n}" % selection).definitions[0].selection_set, "")
+    return paths
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Runs one call per key at a time, and hands its result to every caller that asked for the same key meanwhile."""
+
+    def __init__(self):
+        self.requests = 0
+        self.coalesced = 0
+        self._calls: Dict[str, _Call] = {}
+        self._futures: Dict[Any, asyncio.Future] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def coalescing_ratio(self) -> float:
+        """The share of requests that were served by another request already in flight."""
+        return self.coalesced / self.requests if self.requests else 0.0
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            self.requests += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.coalesced += 1
+        if leader:
+            try:
+                call.result = fn()
+            except Exception as e:
+                call.error = e
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+        else:
+            call.done.wait()
+        if call.error is not None:
+            raise call.error
+        # Each waiter gets its own copy, since callers are free to modify what they get back.
+        return call.result if leader else copy.deepcopy(call.result)
+
+    async def ado(self, key: str, fn: Callable[[], Any]) -> Any:
+        # Tasks on one event loop wait on a shared future, and the one task that runs the call goes through do(),
+        # so asyncio callers also coalesce with threads asking for the same key.
+        future_key = (id(asyncio.get_running_loop()), key)
+        with self._lock:
+            future = self._futures.get(future_key)
+            leader = future is None
+            if leader:
+                future = self._futures[future_key] = asyncio.get_running_loop().create_future()
+            else:
+                self.requests += 1
+                self.coalesced += 1
+        if not leader:
+            try:
+                return copy.deepcopy(await asyncio.shield(future))
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+            # The task running the call was cancelled, though its thread may still be running it, so join that.
+            return await asyncio.to_thread(self.do, key, fn)
+        try:
+            result = await asyncio.to_thread(self.do, key, fn)
+            future.set_result(result)
+            return result
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved, for when no other task was waiting.
+            future.exception()
+            raise
+        finally:
+            # Cancelled, or another BaseException, so the tasks waiting on the future must not wait forever.
+            if not future.done():
+                future.cancel()
+            with self._lock:
+                del self._futures[future_key]
+
+
+gql_queries = registry.counter(
+    "civic_chat_gql_queries_total", "GraphQL queries by root field, answered from the cache, fetched, or coalesced with one in flight.",
+    ["root_field", "source"],
+)
+gql_request_seconds = registry.histogram(
+    "civic_chat_gql_request_seconds", "Time per GraphQL request sent, by root field.", ["root_field"]
+)
+gql_request_errors = registry.counter(
+    "civic_chat_gql_request_errors_total", "GraphQL requests that failed, by root field.", ["root_field"]
+)
+gql_result_bytes = registry.histogram(
+    "civic_chat_gql_result_bytes", "Bytes of GraphQL results fetched, as JSON, by root field.", ["root_field"],
+    buckets=SIZE_BUCKETS,
+)
+
+_ROOT_FIELD = re.compile(r"\{\s*(\w+)")
+
+
+def root_field(query: str) -> str:
+    """The first field a query selects, like "evidenceItems", to label its metrics with."""
+    match = _ROOT_FIELD.search(query)
+    return match.group(1) if match else "unknown"
+
+
 class GraphQLAPIWrapperExtended(GraphQLAPIWrapper):
-    # This override handles the problem that some models generate GQL with various wrapper text.
-    def _execute_query(self, query: str) -> Dict[str, Any]:
-        """Execute a GraphQL query and return the results."""
+    # A civic_chat.cache.ToolCache.  Results are served from here when set, keyed on the normalized query.
+    cache: Any = None
+
+    # A callable run before every request that goes over the network, to let batch jobs throttle themselves.
+    rate_limiter: Any = None
+
+    # A civic_chat.cassette.Cassette that records every request that goes over the network, or answers in its place.
+    cassette: Any = None
+
+    # Makes the gql transport for the clients of threads other than the first, instead of HTTP to graphql_endpoint.
+    transport_factory: Any = None
+
+    # A civic_chat.tools.civic_prefetch.Prefetcher told about every query, to count the ones it guessed.
+    prefetcher: Any = None
+
+    # Identical queries in flight at the same time share one request.
+    _single_flight: SingleFlight = PrivateAttr(default_factory=SingleFlight)
+
+    # A gql client holds a single connected transport, so each thread other than the first gets its own.
+    _local: threading.local = PrivateAttr(default_factory=threading.local)
+    _owner: Any = PrivateAttr(default=None)
+    _owner_lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    # Whether the schema this process introspected, or loaded, is in the cache.
+    _schema_cached: bool = PrivateAttr(default=False)
+
+    @property
+    def single_flight(self) -> SingleFlight:
+        return self._single_flight
+
+    @staticmethod
+    def _normalize_query(query: str) -> str:
         # NOTE: Some LLMs emit GQL with various quoting irregularities that mess up the default GQL tool.
         if query.startswith("```"):
             query = re.sub(r"^```.*\n", "", query)
@@ -22,4 +205,132 @@ class GraphQLAPIWrapperExtended(GraphQLAPIWrapper):
             query = re.sub(r'^query: """\n', "", query)
             query = re.sub(r'"""' + "\n*$", "", query)
             query = "{\n" + query + "\n}\n"
-        return super()._execute_query(query)
+        return query
+
+    @staticmethod
+    def _cache_key(query: str) -> str:
+        # Comments and layout do not change the meaning of a query, so queries that differ only in those share a key.
+        query = re.sub(r'#[^"\n]*$', "", query, flags=re.MULTILINE)
+        return " ".join(query.split())
+
+    # This override handles the problem that some models generate GQL with various wrapper text.
+    def _execute_query(self, query: str) -> Dict[str, Any]:
+        """Execute a GraphQL query and return the results."""
+        query = self._normalize_query(query)
+        key = self._cache_key(query)
+        if self.prefetcher is not None:
+            self.prefetcher.claim(key)
+        field = root_field(query)
+        if self.cache is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                gql_queries.inc(root_field=field, source="cache")
+                return json.loads(cached)
+        fetched = []
+        result = self._single_flight.do(key, lambda: self._fetch_and_cache(key, query, fetched))
+        if not fetched:
+            gql_queries.inc(root_field=field, source="coalesced")
+        return result
+
+    async def _aexecute_query(self, query: str) -> Dict[str, Any]:
+        """Execute a GraphQL query from asyncio code, without blocking the event loop."""
+        query = self._normalize_query(query)
+        key = self._cache_key(query)
+        if self.prefetcher is not None:
+            self.prefetcher.claim(key)
+        field = root_field(query)
+        if self.cache is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                gql_queries.inc(root_field=field, source="cache")
+                return json.loads(cached)
+        fetched = []
+        result = await self._single_flight.ado(key, lambda: self._fetch_and_cache(key, query, fetched))
+        if not fetched:
+            gql_queries.inc(root_field=field, source="coalesced")
+        return result
+
+    async def arun(self, query: str) -> str:
+        """Run a GraphQL query and get the results, from asyncio code."""
+        result = await self._aexecute_query(query)
+        return json.dumps(result, indent=2)
+
+    def _fetch_and_cache(self, key: str, query: str, fetched: Optional[list] = None) -> Dict[str, Any]:
+        # Only the caller whose request goes out counts it as fetched; the ones sharing it count as coalesced.
+        if fetched is not None:
+            fetched.append(True)
+        field = root_field(query)
+        gql_queries.inc(root_field=field, source="fetch")
+        result = self._fetch(query)
+        text = json.dumps(result)
+        gql_result_bytes.observe(len(text), root_field=field)
+        if self.cache is not None:
+            self.cache.set(key, text)
+        return result
+
+    def _fetch(self, query: str) -> Dict[str, Any]:
+        if self.cassette is not None:
+            return self.cassette.graphql(query, lambda: self._send(query))
+        return self._send(query)
+
+    def _send(self, query: str) -> Dict[str, Any]:
+        if self.rate_limiter is not None:
+            self.rate_limiter()
+        client = self._thread_client()
+        self._load_schema(client)
+        field = root_field(query)
+        t0 = time.perf_counter()
+        try:
+            result = client.execute(self.gql_function(query))
+        except Exception:
+            gql_request_errors.inc(root_field=field)
+            raise
+        finally:
+            gql_request_seconds.observe(time.perf_counter() - t0, root_field=field)
+        self._save_schema(client)
+        return result
+
+    def _schema_key(self) -> str:
+        return "schema " + self.graphql_endpoint
+
+    def _load_schema(self, client):
+        # Introspecting a schema as large as CIViC's is a big request, made by every new process, so the answer is
+        # cached with the results and shared by processes that share the cache.
+        if client.schema is not None or not client.fetch_schema_from_transport or self.cache is None:
+            return
+        introspection = self.cache.get(self._schema_key())
+        if introspection is not None:
+            from gql.utilities import build_client_schema
+            client.introspection = json.loads(introspection)
+            client.schema = build_client_schema(client.introspection)
+            self._schema_cached = True
+
+    def _save_schema(self, client):
+        if self.cache is not None and client.introspection is not None and not self._schema_cached:
+            self.cache.set(self._schema_key(), json.dumps(client.introspection))
+            self._schema_cached = True
+
+    def _thread_client(self):
+        if self._owner is None:
+            # Two threads starting at once must not both take gql_client.
+            with self._owner_lock:
+                if self._owner is None:
+                    self._owner = threading.get_ident()
+        if self._owner == threading.get_ident():
+            return self.gql_client
+        client = getattr(self._local, "client", None)
+        if client is None:
+            from gql import Client
+            from gql.transport.requests import RequestsHTTPTransport
+            # Reuse the schema once the first client has it, rather than fetching it again per thread.
+            schema = self.gql_client.schema
+            if self.transport_factory is not None:
+                transport = self.transport_factory()
+            else:
+                transport = RequestsHTTPTransport(url=self.graphql_endpoint, headers=self.custom_headers)
+            client = self._local.client = Client(
+                transport=transport,
+                schema=schema,
+                fetch_schema_from_transport=schema is None and self.fetch_schema_from_transport is not False,
+            )
+        return client
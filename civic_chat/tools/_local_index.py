@@ -0,0 +1,67 @@
+import os
+import threading
+import time
+from typing import Any, Iterable, Optional
+
+from civic_chat.env import STORE_FILE
+
+# Shared by the in-memory indexes the tools look things up in instead of querying CIViC, like the molecular profile
+# and disease indexes.  They are built from the local copy of CIViC once civic_chat.sync has filled it, and rebuilt
+# when a later sync completes.  Without a local copy, each source fetches what it needs from CIViC itself.
+
+# How often to check whether a sync has completed since an index was built.
+REFRESH_INTERVAL = 60
+
+
+class LocalIndexSource:
+    """Keeps an index current from one entity of the local store.  Subclasses say how to build it, and fetch remotely."""
+
+    # The LocalStore entity the index is built from.
+    entity: str = ""
+
+    def __init__(self, store=None, wrapper=None):
+        self.store = store
+        self.wrapper = wrapper
+        self.index = self.build(())
+        self._built_from: Optional[float] = None
+        self._checked_at = 0.0
+        self._lock = threading.RLock()
+
+    def build(self, records: Iterable[dict]) -> Any:
+        raise NotImplementedError
+
+    def _get_store(self):
+        # Only open the local store once a sync has created it.
+        if self.store is None and os.path.exists(STORE_FILE):
+            from civic_chat.sync import LocalStore
+            self.store = LocalStore()
+        return self.store
+
+    def _get_wrapper(self):
+        if self.wrapper is not None:
+            return self.wrapper
+        from .civic_db_gql import civic_tool
+        return civic_tool.graphql_wrapper
+
+    @property
+    def from_store(self) -> bool:
+        return self._built_from is not None
+
+    def refresh(self):
+        """Rebuild the index if a sync of its entity completed since it was built, checking at most every REFRESH_INTERVAL."""
+        with self._lock:
+            if time.time() - self._checked_at < REFRESH_INTERVAL:
+                return
+            self._checked_at = time.time()
+            store = self._get_store()
+            completed_at = store.get_state(self.entity)[2] if store is not None else None
+            if completed_at is not None and completed_at != self._built_from:
+                self.index = self.build(store.records(self.entity))
+                self._built_from = completed_at
+
+    def clear(self):
+        """Forget everything, so the next lookups load or fetch again."""
+        with self._lock:
+            self.index = self.build(())
+            self._built_from = None
+            self._checked_at = 0.0
@@ -1,4 +1,5 @@
 from langchain_community.tools.graphql.tool import BaseGraphQLTool
+from civic_chat.cache import tool_cache
 from civic_chat.tools._gql import GraphQLAPIWrapperExtended
 
 #
@@ -6,7 +7,7 @@ from civic_chat.tools._gql import GraphQLAPIWrapperExtended
 # It mostly fails b/c the schema is too complicated for an LLM to create the correct queries.
 #
 
-civic_graphql_wrapper = GraphQLAPIWrapperExtended(graphql_endpoint="https://civicdb.org/api/graphql")
+civic_graphql_wrapper = GraphQLAPIWrapperExtended(graphql_endpoint="https://civicdb.org/api/graphql", cache=tool_cache)
 
 civic_tool = BaseGraphQLTool(
     name="CIViC Database",
@@ -1,9 +1,11 @@
-import json
+from typing import Union
 
 from langchain_core.tools import tool
 
-from .civic_db_gql import civic_tool
+from .civic_disease_index import CONFIDENT_SCORE, disease_index_source
+from .civic_prefetch import prefetcher
 
+# The fields for the examples of the raw GQL tool.  The get_disease_id tool looks diseases up in a local index.
 DISEASE_FIELDS = """
     totalCount
     pageInfo {
@@ -18,22 +20,20 @@ DISEASE_FIELDS = """
 
 
 @tool
-def get_disease_id(disease_name: str) -> int:
-    """Get the ID of a disease from the name.
+def get_disease_id(disease_name: str) -> Union[int, str]:
+    """Get the ID of a disease from its name, display name, an alias or abbreviation like "CRC", or a DOID like "DOID:9256".
+    Case and small misspellings do not matter.  When no disease matches closely, the closest ones are listed with their IDs.
 
     Args:
-        disease_name: The name of the disease with the first letter of each word capitalized.
+        disease_name: The name of the disease.
     """
-    disease_name = disease_name.replace('"', '').lstrip().rstrip()
-    disease_query = """
-    {
-      diseases(name: "%s") {
-        %s
-      }
-    }
-    """ % (disease_name, DISEASE_FIELDS)
-    result = civic_tool._run(tool_input=disease_query)
-    while isinstance(result, str):
-        result = json.loads(result)
-    diseases = result["diseases"]["nodes"]
-    return diseases[0]["id"] if len(diseases) > 0 else None
+    candidates = disease_index_source.resolve(disease_name)
+    if not candidates:
+        return None
+    disease_id, _, score = candidates[0]
+    if score >= CONFIDENT_SCORE:
+        prefetcher.disease_resolved(disease_id)
+        return disease_id
+    return "No disease matches %s closely.  The closest are: %s" % (
+        disease_name, "; ".join("%d %s" % (candidate_id, name) for candidate_id, name, _ in candidates)
+    )
@@ -0,0 +1,139 @@
+import re
+import time
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from civic_chat.env import CACHE_TTL
+from ._gql import SingleFlight
+from ._local_index import LocalIndexSource
+
+#
+# Diseases by every name they are known by: the name, the display name, the aliases and the Disease Ontology ID.
+# A question may say "colorectal cancer", "CRC", "Colorectal Carcinoma", "colorectl cancer" or "DOID:9256", and all of
+# them resolve locally, in one call, to the same disease.
+#
+# Names are compared after normalizing case and punctuation.  An exact match wins.  Otherwise candidates are ranked by
+# the Dice coefficient of their character trigrams, which tolerates typos and word order changes.
+#
+# Without a local copy of CIViC, the whole disease listing is fetched through the tool cache and kept for CACHE_TTL.
+#
+
+# How similar the best candidate has to be for the tools to take it without asking, from 0 to 1.
+CONFIDENT_SCORE = 0.6
+
+# How many candidates to offer when no candidate is confident.
+CANDIDATE_LIMIT = 5
+
+
+def normalize_name(name: str) -> str:
+    return " ".join(re.findall(r"[a-z0-9]+", name.lower()))
+
+
+def _trigrams(text: str) -> Set[str]:
+    # Padding makes the start and end of each word count, so short names like "CRC" still have trigrams.
+    text = "  %s " % text
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def _disease_names(disease: dict) -> List[str]:
+    names = [disease.get("name"), disease.get("displayName")] + list(disease.get("diseaseAliases") or [])
+    if disease.get("doid"):
+        names += ["DOID:%s" % disease["doid"], "DOID %s" % disease["doid"]]
+    return [name for name in names if name]
+
+
+class DiseaseIndex:
+    def __init__(self, diseases: Iterable[dict] = ()):
+        self.names: Dict[int, str] = {}
+        self._terms: List[Tuple[str, int]] = []
+        self._exact: Dict[str, Set[int]] = defaultdict(set)
+        self._term_trigrams: List[int] = []
+        self._postings: Dict[str, List[int]] = defaultdict(list)
+        for disease in diseases:
+            self.add(disease)
+
+    def add(self, disease: dict):
+        disease_id = int(disease["id"])
+        self.names[disease_id] = disease["name"]
+        for name in _disease_names(disease):
+            term = normalize_name(name)
+            if not term or disease_id in self._exact[term]:
+                continue
+            self._exact[term].add(disease_id)
+            term_index = len(self._terms)
+            self._terms.append((term, disease_id))
+            trigrams = _trigrams(term)
+            self._term_trigrams.append(len(trigrams))
+            for trigram in trigrams:
+                self._postings[trigram].append(term_index)
+
+    def __len__(self):
+        return len(self.names)
+
+    def resolve(self, query: str, limit: int = CANDIDATE_LIMIT) -> List[Tuple[int, str, float]]:
+        """Rank diseases by how well any of their names match the query, as (disease ID, name, score) tuples."""
+        term = normalize_name(query.replace('"', ""))
+        if not term:
+            return []
+        exact = self._exact.get(term)
+        if exact:
+            # Several diseases can share an alias, so the ones with it as their own name come first.
+            ranked = sorted(exact, key=lambda i: (normalize_name(self.names[i]) != term, i))
+            return [(i, self.names[i], 1.0) for i in ranked[:limit]]
+        query_trigrams = _trigrams(term)
+        shared: Dict[int, int] = defaultdict(int)
+        for trigram in query_trigrams:
+            for term_index in self._postings.get(trigram, ()):
+                shared[term_index] += 1
+        best: Dict[int, float] = {}
+        for term_index, count in shared.items():
+            score = 2.0 * count / (len(query_trigrams) + self._term_trigrams[term_index])
+            disease_id = self._terms[term_index][1]
+            if score > best.get(disease_id, 0.0):
+                best[disease_id] = score
+        ranked = sorted(best.items(), key=lambda item: (-item[1], item[0]))[:limit]
+        return [(disease_id, self.names[disease_id], round(score, 3)) for disease_id, score in ranked]
+
+
+class DiseaseIndexSource(LocalIndexSource):
+    """Keeps a DiseaseIndex current from the local store, or from the full disease listing of CIViC."""
+
+    entity = "diseases"
+
+    def __init__(self, store=None, wrapper=None):
+        super().__init__(store, wrapper)
+        self._fetched_at: Optional[float] = None
+        # Callers that arrive while the listing is being fetched wait for that fetch, rather than making their own.
+        self._single_flight = SingleFlight()
+
+    def build(self, records: Iterable[dict]) -> DiseaseIndex:
+        return DiseaseIndex(records)
+
+    def _fetch_all(self):
+        from civic_chat.sync import DISEASE_SYNC_FIELDS, iter_pages
+
+        # Built without the lock, which is only taken to swap the index in, so the crawl holds up nothing else.
+        index = DiseaseIndex()
+        for nodes, _, _ in iter_pages(self._get_wrapper(), "diseases", "", DISEASE_SYNC_FIELDS, cached=True):
+            for disease in nodes:
+                index.add(disease)
+        with self._lock:
+            if not self.from_store:
+                self.index = index
+                self._fetched_at = time.time()
+
+    def clear(self):
+        with self._lock:
+            super().clear()
+            self._fetched_at = None
+
+    def resolve(self, query: str, limit: int = CANDIDATE_LIMIT) -> List[Tuple[int, str, float]]:
+        with self._lock:
+            self.refresh()
+            stale = not self.from_store and (self._fetched_at is None or time.time() - self._fetched_at >= CACHE_TTL)
+        if stale:
+            self._single_flight.do("diseases", self._fetch_all)
+        return self.index.resolve(query, limit)
+
+
+disease_index_source = DiseaseIndexSource()
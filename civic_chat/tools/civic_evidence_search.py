@@ -0,0 +1,126 @@
+import json
+import re
+import threading
+import time
+from typing import List, Tuple
+
+from langchain_core.tools import tool
+
+from civic_chat.env import SEARCH_REFRESH_INTERVAL
+from civic_chat.sync import LocalStore
+
+#
+# This tool searches evidence text in the local copy of CIViC kept by civic_chat.sync, using a SQLite FTS5 index.
+# Unlike a web search it stays inside the database, and it answers in milliseconds.
+#
+
+SEARCH_LIMIT = 20
+
+
+def _joined(*values) -> str:
+    return " ".join(str(v) for v in values if v)
+
+
+class EvidenceSearchIndex:
+    """A full-text index over evidence descriptions, source titles, therapies and diseases, inside the local store."""
+
+    def __init__(self, store: LocalStore):
+        self.store = store
+        db = store.db
+        db.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS evidence_fts USING fts5("
+            " description, source_title, therapies, disease, molecular_profile, status UNINDEXED,"
+            " tokenize = 'porter unicode61')"
+        )
+        db.execute("CREATE TABLE IF NOT EXISTS evidence_fts_state (id INTEGER PRIMARY KEY, indexed_at REAL NOT NULL)")
+        db.commit()
+
+    def refresh(self) -> int:
+        """Index evidence records changed since the last refresh, and drop removed ones.  Returns the rows indexed."""
+        db = self.store.db
+        row = db.execute("SELECT indexed_at FROM evidence_fts_state WHERE id = 0").fetchone()
+        indexed_at = row[0] if row is not None else 0.0
+        changed = db.execute(
+            "SELECT id, data, updated_at FROM evidence_items WHERE updated_at > ?", (indexed_at,)
+        ).fetchall()
+        with db:
+            db.execute("DELETE FROM evidence_fts WHERE rowid NOT IN (SELECT id FROM evidence_items)")
+            db.executemany("DELETE FROM evidence_fts WHERE rowid = ?", [(record_id,) for record_id, _, _ in changed])
+            db.executemany(
+                "INSERT INTO evidence_fts (rowid, description, source_title, therapies, disease, molecular_profile, status)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [self._row(record_id, data) for record_id, data, _ in changed],
+            )
+            latest = max([updated_at for _, _, updated_at in changed], default=indexed_at)
+            db.execute("INSERT OR REPLACE INTO evidence_fts_state (id, indexed_at) VALUES (0, ?)", (latest,))
+        return len(changed)
+
+    @staticmethod
+    def _row(record_id: int, data: str) -> Tuple:
+        item = json.loads(data)
+        source = item.get("source") or {}
+        disease = item.get("disease") or {}
+        therapies = [
+            _joined(therapy.get("name"), *(therapy.get("therapyAliases") or [])) for therapy in item.get("therapies") or []
+        ]
+        return (
+            record_id,
+            item.get("description") or "",
+            source.get("title") or "",
+            " ".join(therapies),
+            _joined(disease.get("name"), disease.get("displayName"), *(disease.get("diseaseAliases") or [])),
+            (item.get("molecularProfile") or {}).get("name") or "",
+            item.get("status"),
+        )
+
+    def search(self, keywords: str, limit: int = SEARCH_LIMIT, status: str = "ACCEPTED") -> List[Tuple[int, str, str]]:
+        """Rank evidence by BM25 for the keywords, returning (evidence ID, molecular profile, snippet) tuples."""
+        # The LLM writes free text, so only the words are kept, quoted, so nothing is read as FTS5 syntax.
+        words = ['"%s"' % word for word in re.findall(r"\w+", keywords)]
+        if not words:
+            return []
+        # Prefer items that match every word, and only fall back to any word when nothing matches them all.
+        for match in [" AND ".join(words), " OR ".join(words)]:
+            rows = self.store.db.execute(
+                "SELECT rowid, molecular_profile, snippet(evidence_fts, -1, '[', ']', '...', 16)"
+                " FROM evidence_fts WHERE evidence_fts MATCH ? AND status = ? ORDER BY rank LIMIT ?",
+                (match, status, limit),
+            ).fetchall()
+            if rows:
+                return rows
+        return []
+
+
+_index = None
+_refreshed_at = 0.0
+# Threads of the server and of load tests call the tool at once, and must not each build or refresh the index.
+_lock = threading.Lock()
+
+
+def get_evidence_search_index() -> EvidenceSearchIndex:
+    global _index, _refreshed_at
+    with _lock:
+        if _index is None:
+            _index = EvidenceSearchIndex(LocalStore())
+        # Pick up records applied by a sync running in another process.
+        if time.time() - _refreshed_at > SEARCH_REFRESH_INTERVAL:
+            _index.refresh()
+            _refreshed_at = time.time()
+        return _index
+
+
+@tool
+def search_evidence(keywords: str) -> str:
+    """Keyword search over the text of accepted CIViC evidence: descriptions, source titles, therapy names and aliases, and disease names and aliases.
+    Returns the best matching evidence IDs with the molecular profile and a snippet of the matching text.
+
+    Args:
+        keywords: Words to search for, like a therapy, a mutation or a phrase from a publication.
+    """
+    index = get_evidence_search_index()
+    if index.store.count("evidence_items") == 0:
+        return "The local copy of CIViC is empty, run python -m civic_chat.sync first."
+    rows = index.search(keywords)
+    if not rows:
+        return "no matching evidence"
+    return "\n".join("EID%d\t%s\t%s" % (record_id, molecular_profile, snippet) for record_id, molecular_profile, snippet in rows)
@@ -0,0 +1,285 @@
+import json
+import os
+import threading
+import time
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.tools import tool
+
+from civic_chat.env import EMBEDDING_DIR, EMBEDDING_MODEL, SEARCH_REFRESH_INTERVAL
+from civic_chat.sync import LocalStore
+
+#
+# Semantic retrieval over evidence descriptions in the local copy of CIViC kept by civic_chat.sync.
+# Descriptions are embedded on the CPU with a small local model, and the vectors live in a memory-mapped float32
+# matrix with a sidecar of evidence IDs, so a search is one matrix-vector product over pages the OS already holds.
+#
+
+ENCODE_BATCH_SIZE = 32
+SEARCH_TOP_K = 10
+
+# How much of the matrix may be superseded or removed rows before it is compacted, from 0 to 1.
+COMPACT_DEAD_FRACTION = 0.5
+
+
+class TextEncoder:
+    """Mean-pooled, L2-normalized sentence embeddings from a transformers model on the CPU."""
+
+    def __init__(self, model_name: str = EMBEDDING_MODEL, batch_size: int = ENCODE_BATCH_SIZE):
+        import torch
+        from transformers import AutoModel, AutoTokenizer
+
+        self.torch = torch
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.model = AutoModel.from_pretrained(model_name).eval()
+        self.batch_size = batch_size
+        self.dim = self.model.config.hidden_size
+
+    def __call__(self, texts: List[str]) -> np.ndarray:
+        vectors = []
+        with self.torch.no_grad():
+            for start in range(0, len(texts), self.batch_size):
+                batch = self.tokenizer(
+                    texts[start:start + self.batch_size], padding=True, truncation=True, max_length=256,
+                    return_tensors="pt",
+                )
+                hidden = self.model(**batch).last_hidden_state
+                mask = batch["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+                pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+                vectors.append(self.torch.nn.functional.normalize(pooled, dim=1).numpy())
+        return np.concatenate(vectors).astype(np.float32) if vectors else np.zeros((0, self.dim), dtype=np.float32)
+
+
+class EmbeddingIndex:
+    """Unit vectors in an append-only memory-mapped matrix, with the evidence ID of each row in a sidecar file.
+
+    Updating an item appends a new row for its ID, and removing one appends a zero row, so the last row for an ID is
+    the live one and nothing is ever rewritten in place.  Once dead rows make up more than COMPACT_DEAD_FRACTION of
+    the matrix, the live rows are copied to a new generation of the files and the old one is dropped.
+    """
+
+    def __init__(self, path: str, dim: int):
+        self.path = path
+        self.dim = dim
+        os.makedirs(path, exist_ok=True)
+        self.meta_path = os.path.join(path, "meta.json")
+        self.meta = {"dim": dim, "indexed_at": 0.0, "generation": 0}
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path) as f:
+                self.meta.update(json.load(f))
+            if self.meta["dim"] != dim:
+                raise ValueError("index at %s has dimension %d, not %d" % (path, self.meta["dim"], dim))
+        # Held by writers throughout, and by searches only to take the arrays, so a search never sees half an append.
+        self._lock = threading.RLock()
+        self._load()
+
+    def _paths(self, generation: int) -> Tuple[str, str]:
+        suffix = ".%d" % generation if generation else ""
+        return (os.path.join(self.path, "vectors%s.f32" % suffix), os.path.join(self.path, "ids%s.i64" % suffix))
+
+    @property
+    def vectors_path(self) -> str:
+        return self._paths(self.meta["generation"])[0]
+
+    @property
+    def ids_path(self) -> str:
+        return self._paths(self.meta["generation"])[1]
+
+    def _load(self):
+        # Vectors are written before their IDs, so an interrupted append leaves some rows with no ID.  Those are cut
+        # off, or the next append would put its vectors after them and pair every later ID with the wrong vector.
+        ids = np.fromfile(self.ids_path, dtype=np.int64) if os.path.exists(self.ids_path) else np.zeros(0, np.int64)
+        rows = os.path.getsize(self.vectors_path) // (4 * self.dim) if os.path.exists(self.vectors_path) else 0
+        ids = ids[:rows]
+        self._truncate(len(ids))
+        vectors = self._map(len(ids))
+        live = np.zeros(len(ids), dtype=bool)
+        # The row of the live vector of each ID, or of its removal.
+        self._last_row = {}
+        self._mark(ids, vectors, live, 0)
+        self.ids, self.vectors, self.live = ids, vectors, live
+
+    def _reload_if_compacted(self):
+        # Another process may have compacted the index into a new generation since this one loaded it.
+        if not os.path.exists(self.meta_path):
+            return
+        with open(self.meta_path) as f:
+            generation = json.load(f).get("generation", 0)
+        if generation != self.meta["generation"]:
+            self.meta["generation"] = generation
+            self._load()
+
+    def _truncate(self, n: int):
+        for path, row_bytes in [(self.vectors_path, 4 * self.dim), (self.ids_path, 8)]:
+            if os.path.exists(path) and os.path.getsize(path) != n * row_bytes:
+                os.truncate(path, n * row_bytes)
+
+    def _map(self, n: int) -> np.ndarray:
+        if n:
+            return np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(n, self.dim))
+        return np.zeros((0, self.dim), dtype=np.float32)
+
+    def _mark(self, ids: np.ndarray, vectors: np.ndarray, live: np.ndarray, start: int):
+        # A row is live when it is the last one for its ID and it is not a removal.
+        nonzero = np.any(vectors[start:] != 0, axis=1)
+        for offset, record_id in enumerate(ids[start:].tolist()):
+            previous = self._last_row.get(record_id)
+            if previous is not None:
+                live[previous] = False
+            self._last_row[record_id] = start + offset
+            live[start + offset] = nonzero[offset]
+
+    def __len__(self):
+        return int(self.live.sum())
+
+    @property
+    def dead_fraction(self) -> float:
+        """The share of rows that are superseded or removals, which searches still scan until a compaction."""
+        return 1 - len(self) / len(self.ids) if len(self.ids) else 0.0
+
+    def append(self, ids: List[int], vectors: np.ndarray):
+        if len(ids) == 0:
+            return
+        with self._lock:
+            self._reload_if_compacted()
+            # In case an append by another process was interrupted since this one loaded.
+            self._truncate(len(self.ids))
+            start = len(self.ids)
+            with open(self.vectors_path, "ab") as f:
+                f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+            with open(self.ids_path, "ab") as f:
+                f.write(np.asarray(ids, dtype=np.int64).tobytes())
+            # Only the new rows are read; the map of the old ones is replaced by a larger one of the same file.
+            all_ids = np.concatenate([self.ids, np.asarray(ids, dtype=np.int64)])
+            all_vectors = self._map(len(all_ids))
+            live = np.concatenate([self.live, np.zeros(len(ids), dtype=bool)])
+            self._mark(all_ids, all_vectors, live, start)
+            self.ids, self.vectors, self.live = all_ids, all_vectors, live
+            if self.dead_fraction > COMPACT_DEAD_FRACTION:
+                self.compact()
+
+    def remove(self, ids: List[int]):
+        self.append(ids, np.zeros((len(ids), self.dim), dtype=np.float32))
+
+    def compact(self):
+        """Copy the live rows to a new generation of the files, and switch to it."""
+        with self._lock:
+            old_paths = (self.vectors_path, self.ids_path)
+            generation = self.meta["generation"] + 1
+            vectors_path, ids_path = self._paths(generation)
+            np.ascontiguousarray(self.vectors[self.live]).tofile(vectors_path)
+            self.ids[self.live].tofile(ids_path)
+            # The new files are complete before meta.json points at them, so a crash leaves the old generation whole.
+            self.save_meta(generation=generation)
+            self._load()
+            for path in old_paths:
+                os.remove(path)
+
+    def save_meta(self, **meta):
+        self.meta.update(meta)
+        with open(self.meta_path + ".tmp", "w") as f:
+            json.dump(self.meta, f)
+        os.replace(self.meta_path + ".tmp", self.meta_path)
+
+    def search(self, query_vector: np.ndarray, k: int = SEARCH_TOP_K) -> List[Tuple[int, float]]:
+        """The k live rows with the highest cosine similarity to a unit query vector, as (ID, score) pairs."""
+        with self._lock:
+            ids, vectors, live = self.ids, self.vectors, self.live
+        k = min(k, int(live.sum()))
+        if k == 0:
+            return []
+        scores = np.asarray(vectors @ query_vector.astype(np.float32))
+        scores[~live] = -np.inf
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(ids[i]), float(scores[i])) for i in top]
+
+
+def update_from_store(index: EmbeddingIndex, store: LocalStore, encode: Callable[[List[str]], np.ndarray]) -> int:
+    """Encode accepted evidence changed since the last update, in batches, and drop what is no longer accepted."""
+    since = index.meta.get("indexed_at", 0.0)
+    rows = store.db.execute(
+        "SELECT id, status, data, updated_at FROM evidence_items WHERE updated_at > ? ORDER BY id", (since,)
+    ).fetchall()
+    accepted = [(record_id, json.loads(data)) for record_id, status, data, _ in rows if status == "ACCEPTED"]
+    removed = [record_id for record_id, status, _, _ in rows if status != "ACCEPTED"]
+    # Records deleted from the store by a sync are gone from it entirely, so compare against what is live here.
+    live_ids = set(index.ids[index.live].tolist())
+    store_ids = {record_id for (record_id,) in store.db.execute("SELECT id FROM evidence_items WHERE status = 'ACCEPTED'")}
+    removed += sorted(live_ids - store_ids - set(removed))
+
+    for start in range(0, len(accepted), 1024):
+        chunk = accepted[start:start + 1024]
+        texts = [_evidence_text(item) for _, item in chunk]
+        index.append([record_id for record_id, _ in chunk], encode(texts))
+    index.remove([record_id for record_id in removed if record_id in live_ids])
+    index.save_meta(indexed_at=max([updated_at for _, _, _, updated_at in rows], default=since))
+    return len(accepted)
+
+
+def _evidence_text(item: dict) -> str:
+    molecular_profile = (item.get("molecularProfile") or {}).get("name") or ""
+    disease = (item.get("disease") or {}).get("name") or ""
+    therapies = ", ".join(therapy["name"] for therapy in item.get("therapies") or [])
+    return "%s in %s. %s. %s" % (molecular_profile, disease, therapies, item.get("description") or "")
+
+
+_encoder: Optional[TextEncoder] = None
+_index: Optional[EmbeddingIndex] = None
+_store: Optional[LocalStore] = None
+_refreshed_at = 0.0
+# Threads of the server and of load tests call the tool at once, and must not each load a model or encode the same rows.
+_lock = threading.Lock()
+
+
+def get_evidence_embedding_index() -> Tuple[EmbeddingIndex, TextEncoder, LocalStore]:
+    global _encoder, _index, _store, _refreshed_at
+    with _lock:
+        if _index is None:
+            _encoder = TextEncoder()
+            _store = LocalStore()
+            _index = EmbeddingIndex(EMBEDDING_DIR, _encoder.dim)
+        # Pick up what a sync in another process applied since, like the keyword search index does.
+        if time.time() - _refreshed_at > SEARCH_REFRESH_INTERVAL:
+            update_from_store(_index, _store, _encoder)
+            _refreshed_at = time.time()
+        return _index, _encoder, _store
+
+
+@tool
+def semantic_search_evidence(question: str) -> str:
+    """Find accepted CIViC evidence whose meaning is closest to a question or statement, even without shared keywords.
+    Returns evidence IDs with a similarity score, the molecular profile, the disease and the start of the description.
+
+    Args:
+        question: A natural language description of the evidence being looked for.
+    """
+    index, encoder, store = get_evidence_embedding_index()
+    if len(index) == 0:
+        return "The local copy of CIViC is empty, run python -m civic_chat.sync first."
+    hits = index.search(encoder([question])[0])
+    items = {
+        record_id: json.loads(data) for record_id, data in store.db.execute(
+            "SELECT id, data FROM evidence_items WHERE id IN (%s)" % ",".join("?" * len(hits)),
+            [record_id for record_id, _ in hits],
+        )
+    }
+    lines = []
+    for record_id, score in hits:
+        item = items.get(record_id, {})
+        lines.append("EID%d\t%.3f\t%s\t%s\t%s" % (
+            record_id, score,
+            (item.get("molecularProfile") or {}).get("name"),
+            (item.get("disease") or {}).get("name"),
+            (item.get("description") or "")[:200],
+        ))
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    # Build or update the index from the local store, for example after python -m civic_chat.sync.
+    encoder = TextEncoder()
+    t0 = time.time()
+    count = update_from_store(EmbeddingIndex(EMBEDDING_DIR, encoder.dim), LocalStore(), encoder)
+    print(f"encoded {count} evidence items in {time.time() - t0:.1f}s")
@@ -0,0 +1,135 @@
+from typing import List, Optional, Tuple
+
+import numpy as np
+from ._args import tolerant_tool
+from .civic_mutation_evidence import merge_predictive_evidence, query_all_predictive_evidence
+
+#
+# These tools aggregate evidence locally and hand the LLM a compact ranking instead of every evidence node.
+# A question like "which therapies have the strongest evidence for KRAS G12C?" is then one tool call and a few
+# hundred tokens, rather than a walk over every description in the context.
+# They page through all the evidence, up to MAX_SUMMARY_ITEMS, and say so when a summary leaves some out.
+#
+
+# Levels run from A (validated) to E (inferential), and are weighted so that stronger levels dominate the score.
+EVIDENCE_LEVELS = ["A", "B", "C", "D", "E"]
+EVIDENCE_LEVEL_WEIGHTS = np.array([5.0, 4.0, 3.0, 2.0, 1.0])
+
+EVIDENCE_DIRECTIONS = ["SUPPORTS", "DOES_NOT_SUPPORT"]
+
+# How many rows of each ranking to show the LLM.
+SUMMARY_TOP_N = 15
+
+NO_THERAPY = "(none)"
+
+
+def _evidence_columns(evidence: List[dict], group_by: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    # Flatten the nodes into parallel columns, one row per (group key, evidence item).
+    # Therapies are a list per item, so grouping by therapy explodes an item into one row per therapy.
+    keys = []
+    levels = []
+    ratings = []
+    directions = []
+    for item in evidence:
+        if group_by == "therapy":
+            item_keys = [therapy["name"] for therapy in item.get("therapies") or []] or [NO_THERAPY]
+        elif group_by == "molecularProfile":
+            item_keys = [(item.get("molecularProfile") or {}).get("name")]
+        else:
+            item_keys = [item.get(group_by)]
+        for key in item_keys:
+            keys.append(str(key))
+            levels.append(item.get("evidenceLevel"))
+            ratings.append(item.get("evidenceRating") or 0)
+            directions.append(item.get("evidenceDirection"))
+
+    level_index = np.array(
+        [EVIDENCE_LEVELS.index(level) if level in EVIDENCE_LEVELS else -1 for level in levels], dtype=np.int64
+    )
+    supports = np.array([direction == "SUPPORTS" for direction in directions], dtype=bool)
+    return np.array(keys, dtype=object), level_index, np.array(ratings, dtype=np.float64), supports
+
+
+def summarize_evidence(evidence: List[dict], group_by: str = "therapy", top_n: int = SUMMARY_TOP_N) -> str:
+    """Count and rank evidence by a grouping field, returning a compact tab-separated table.
+
+    Args:
+        evidence: Evidence nodes as returned by the evidenceItems query.
+        group_by: One of "therapy", "molecularProfile", "evidenceLevel", "evidenceRating" or "evidenceDirection".
+        top_n: The maximum number of ranked rows to include.
+    """
+    if len(evidence) == 0:
+        return "no evidence"
+
+    keys, level_index, ratings, supports = _evidence_columns(evidence, group_by)
+    unique_keys, group = np.unique(keys, return_inverse=True)
+    group_count = len(unique_keys)
+
+    n = np.bincount(group, minlength=group_count)
+
+    # Count by level with a scatter-add into a (group x level) matrix.  Unknown levels carry no weight.
+    known_level = level_index >= 0
+    by_level = np.zeros((group_count, len(EVIDENCE_LEVELS)), dtype=np.int64)
+    np.add.at(by_level, (group[known_level], level_index[known_level]), 1)
+
+    n_supports = np.bincount(group, weights=supports, minlength=group_count).astype(np.int64)
+    n_against = n - n_supports
+    rated = ratings > 0
+    rating_sum = np.bincount(group, weights=ratings, minlength=group_count)
+    rating_n = np.bincount(group, weights=rated, minlength=group_count)
+    mean_rating = np.divide(rating_sum, rating_n, out=np.zeros(group_count), where=rating_n > 0)
+
+    # Each item contributes its level weight times its star rating, positive when it supports and negative when not.
+    item_weight = np.where(known_level, EVIDENCE_LEVEL_WEIGHTS[level_index], 0.0) * np.where(rated, ratings, 1.0)
+    item_score = np.where(supports, item_weight, -item_weight)
+    score = np.bincount(group, weights=item_score, minlength=group_count)
+
+    # Rank by score, then by the number of items, strongest first.
+    order = np.lexsort((-n, -score))[:top_n]
+
+    header = [group_by, "n"] + EVIDENCE_LEVELS + ["supports", "does_not_support", "mean_rating", "score"]
+    lines = ["\t".join(header)]
+    for i in order:
+        row = [unique_keys[i], n[i]] + list(by_level[i]) + [n_supports[i], n_against[i]]
+        lines.append("\t".join(str(v) for v in row) + "\t%.1f\t%.1f" % (mean_rating[i], score[i]))
+    if group_count > top_n:
+        lines.append("... %d more" % (group_count - top_n))
+    return "\n".join(lines)
+
+
+def _summarize_all(evidence: List[dict], total_count: Optional[int] = None) -> str:
+    # One call answers the usual follow-up questions, so the LLM does not need to come back for another grouping.
+    if total_count is not None and total_count > len(evidence):
+        sections = ["%d evidence items summarized of %d in CIViC; the rest are left out of this summary" % (
+            len(evidence), total_count
+        )]
+    else:
+        sections = ["%d evidence items" % len(evidence)]
+    for group_by in ["therapy", "molecularProfile", "evidenceLevel", "evidenceRating", "evidenceDirection"]:
+        sections.append("by %s:\n%s" % (group_by, summarize_evidence(evidence, group_by)))
+    return "\n\n".join(sections)
+
+
+@tolerant_tool
+def summarize_disease_mutations(disease_id: int) -> str:
+    """Summarize predictive mutation evidence for a disease ID as ranked tables by therapy, molecular profile, level, rating and direction.
+    Prefer this to get_all_disease_mutations() when the question asks which therapies or mutations have the strongest evidence.
+
+    Args:
+        disease_id: The canonical ID of the disease.
+    """
+    return _summarize_all(*query_all_predictive_evidence(disease_id))
+
+
+@tolerant_tool
+def summarize_disease_mutations_for_profiles(disease_id: int, molecular_profile_ids: List[int]) -> str:
+    """Summarize predictive mutation evidence in a disease ID for molecular profile IDs as ranked tables by therapy, molecular profile, level, rating and direction.
+    Prefer this to get_disease_predictive_mutations_for_profiles() when the question asks which therapies have the strongest evidence.
+
+    Args:
+        disease_id: The numeric ID of a disease in the database from get_disease_id().
+        molecular_profile_ids: A list of the molecular profile IDs from get_gene_molecular_profile_ids().
+    """
+    merge = merge_predictive_evidence(disease_id, molecular_profile_ids, all_pages=True)
+    # Items not fetched may be shared between profiles too, so this total is at most what CIViC has.
+    return _summarize_all(merge.items, merge.total_count - merge.duplicates if merge.truncated else None)
@@ -1,9 +1,9 @@
-import json
 from typing import List
 
 from langchain_core.tools import tool
 
-from .civic_db_gql import civic_tool
+from .civic_prefetch import prefetcher
+from .civic_profile_index import profile_index_source
 
 
 MOLECULAR_PROFILE_FIELDS = """
@@ -21,23 +21,11 @@ MOLECULAR_PROFILE_FIELDS = """
 
 @tool
 def get_gene_molecular_profile_ids(gene_name: str) -> List[int]:
-    """Search for the list of gene regions by gene name, containing a numeric "id", and text "name" and "description" for each.
+    """Find the IDs of the molecular profiles of a gene, or of some of its variants, like "KRAS" or "KRAS G12" for all G12 variants.
 
     Args:
-        gene_name: The canonical gene symbol in upper-case.
+        gene_name: The canonical gene symbol in upper-case, optionally followed by a variant or the start of one.
     """
-    gene_name = gene_name.replace('"', '').lstrip().rstrip()
-    molecular_profile_query = """
-    {
-      molecularProfiles(name: "%s") {  # gene name is sufficient
-        %s
-      }
-    }
-    """ % (gene_name, MOLECULAR_PROFILE_FIELDS)
-    result = civic_tool._run(tool_input=molecular_profile_query)
-    while isinstance(result, str):
-        result = json.loads(result)
-    gene_mutation_regions = result["molecularProfiles"]["nodes"]
-    for region in gene_mutation_regions:
-        del region["description"]
-    return [v["id"] for v in gene_mutation_regions]
+    profile_ids = profile_index_source.lookup(gene_name)
+    prefetcher.profiles_resolved(profile_ids)
+    return profile_ids
@@ -1,10 +1,14 @@
 import json
-import re
-from typing import List
-
-from langchain_core.tools import tool
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Iterator, List, Optional, Tuple, Union
 
+from civic_chat.metrics import registry
+from civic_chat.session import session_frames
+from ._args import tolerant_tool
+from ._gql import field_paths, project_fields
 from .civic_db_gql import civic_tool
+from .civic_prefetch import prefetcher
 
 
 EVIDENCE_FIELDS = """
@@ -56,62 +60,308 @@ EVIDENCE_FIELDS = """
 """
 
 
-@tool
-def get_all_disease_mutations(disease_id: str) -> List[dict]:
-    """Search for the list of gene mutations by disease ID, across genes.
+# The fields of an evidence node that a projection can pick from, as dotted paths like "therapies.name".
+EVIDENCE_NODE_PATHS = sorted(
+    path[len("nodes."):] for path in field_paths(EVIDENCE_FIELDS) if path.startswith("nodes.")
+)
 
-    Args:
-        disease_id: The canonical ID of the disease.
+# Enough to tell items apart and rank them, at a small fraction of the size of full nodes.
+BRIEF_EVIDENCE_FIELDS = [
+    "id", "molecularProfile.name", "evidenceLevel", "evidenceRating", "evidenceDirection", "therapies.name",
+]
+
+
+# The most evidence a summary pages through, so a broad disease can not keep it fetching for minutes.
+MAX_SUMMARY_ITEMS = 5000
+
+
+def evidence_selection(fields: Optional[List[str]] = None) -> str:
+    """The selection for an evidence query: all of EVIDENCE_FIELDS, or just the given node fields.
+
+    A field naming an object, like "disease", selects all of its fields.  A projection also selects totalCount and
+    pageInfo, so it can be paged like the full selection.
     """
-    disease_id = int(disease_id.replace('"', '').rstrip())
-    gql = """
-        {
-          evidenceItems(status: ACCEPTED, diseaseId: %d, evidenceType: PREDICTIVE) {
-            %s
-          }
-        }
-        """ % (disease_id, EVIDENCE_FIELDS)
+    if fields is None:
+        return EVIDENCE_FIELDS
+    paths = ["totalCount", "pageInfo.hasNextPage", "pageInfo.endCursor"]
+    paths.extend("nodes." + path for path in evidence_paths(fields))
+    return project_fields(paths)
+
+
+def evidence_paths(fields: List[str]) -> List[str]:
+    """The EVIDENCE_NODE_PATHS the fields name, raising ValueError for a field that names none of them."""
+    paths = []
+    for field in fields:
+        matches = [p for p in EVIDENCE_NODE_PATHS if p == field or p.startswith(field + ".")]
+        if not matches:
+            raise ValueError("Unknown evidence field %r, expected one of %s" % (field, ", ".join(EVIDENCE_NODE_PATHS)))
+        paths.extend(matches)
+    return paths
+
+
+def project_evidence(nodes: List[dict], fields: List[str]) -> List[dict]:
+    """Full evidence nodes cut down to the fields, the way a query for only those fields would return them."""
+    tree: Dict[str, dict] = {}
+    for path in evidence_paths(fields):
+        node = tree
+        for name in path.split("."):
+            node = node.setdefault(name, {})
+
+    def project(value, selection: Dict[str, dict]):
+        if not selection or value is None:
+            return value
+        if isinstance(value, list):
+            return [project(v, selection) for v in value]
+        return {name: project(value.get(name), children) for name, children in selection.items()}
+
+    return [project(node, tree) for node in nodes]
+
+
+def _predictive_evidence_query(disease_id: int, molecular_profile_id: Optional[int], selection: str,
+                               after: Optional[str] = None) -> str:
+    # The first page has no cursor, so it is the same query the other tools and the prefetcher cache.
+    cursor = ', after: "%s"' % after if after is not None else ""
+    if molecular_profile_id is None:
+        return """
+            {
+              evidenceItems(status: ACCEPTED, diseaseId: %d, evidenceType: PREDICTIVE%s) {
+                %s
+              }
+            }
+            """ % (disease_id, cursor, selection)
+    return """
+            {
+              evidenceItems(status: ACCEPTED, diseaseId: %d, molecularProfileId: %d, evidenceType: PREDICTIVE%s) {
+                %s
+              }
+            }
+            """ % (disease_id, molecular_profile_id, cursor, selection)
+
+
+def _run_evidence_query(gql: str) -> dict:
     result = civic_tool._run(tool_input=gql)
     while isinstance(result, str):
         result = json.loads(result)
-    all_predictive_mutations = result["evidenceItems"]["nodes"]
+    return result["evidenceItems"]
+
+
+def query_predictive_evidence(disease_id: int, molecular_profile_id: Optional[int] = None,
+                              fields: Optional[List[str]] = None) -> List[dict]:
+    """Fetch the accepted predictive evidence nodes for a disease, optionally limited to one molecular profile.
+
+    With fields, only those node fields are fetched (see evidence_selection).  Only full nodes are kept as session
+    frames for the Python REPL, so a projection never stands in for the complete evidence there.
+    """
+    if fields is not None and _full_evidence_at_hand(disease_id, molecular_profile_id):
+        # The full nodes are cached, or a prefetch of them is on its way, so they are cut down here rather than
+        # asking the server for the projection too.
+        return project_evidence(query_predictive_evidence(disease_id, molecular_profile_id), fields)
+    gql = _predictive_evidence_query(disease_id, molecular_profile_id, evidence_selection(fields))
+    nodes = _run_evidence_query(gql)["nodes"]
+    if fields is None:
+        _record_frame(disease_id, molecular_profile_id, nodes)
+    return nodes
+
+
+def _full_evidence_at_hand(disease_id: int, molecular_profile_id: Optional[int]) -> bool:
+    wrapper = civic_tool.graphql_wrapper
+    if wrapper.cache is None:
+        return False
+    query = _predictive_evidence_query(disease_id, molecular_profile_id, EVIDENCE_FIELDS)
+    key = wrapper._cache_key(wrapper._normalize_query(query))
+    return prefetcher.pending(key) or wrapper.cache.get(key) is not None
+
+
+def query_all_predictive_evidence(disease_id: int, molecular_profile_id: Optional[int] = None,
+                                  fields: Optional[List[str]] = None,
+                                  max_items: int = MAX_SUMMARY_ITEMS) -> Tuple[List[dict], int]:
+    """Like query_predictive_evidence, but paging through every page rather than taking the first, up to max_items.
+
+    Returns the nodes and the totalCount CIViC reports, which is more than the nodes when max_items cut them short.
+    """
+    selection = evidence_selection(fields)
+    nodes = []
+    after = None
+    while True:
+        connection = _run_evidence_query(_predictive_evidence_query(disease_id, molecular_profile_id, selection, after))
+        nodes.extend(connection["nodes"])
+        page_info = connection.get("pageInfo") or {}
+        if not page_info.get("hasNextPage") or not page_info.get("endCursor") or len(nodes) >= max_items:
+            break
+        after = page_info["endCursor"]
+    nodes = nodes[:max_items]
+    if fields is None:
+        _record_frame(disease_id, molecular_profile_id, nodes)
+    return nodes, max(connection.get("totalCount") or 0, len(nodes))
+
+
+def _record_frame(disease_id: int, molecular_profile_id: Optional[int], nodes: List[dict]):
+    if molecular_profile_id is None:
+        frame_name = "evidence_disease_%d" % disease_id
+    else:
+        frame_name = "evidence_disease_%d_profile_%d" % (disease_id, molecular_profile_id)
+    session_frames.record(frame_name, nodes)
+
+
+def count_predictive_evidence(disease_id: int, molecular_profile_id: Optional[int] = None) -> int:
+    """Count the accepted predictive evidence for a disease, optionally limited to one molecular profile, without fetching it."""
+    gql = _predictive_evidence_query(disease_id, molecular_profile_id, "totalCount")
+    return _run_evidence_query(gql)["totalCount"]
+
+
+# How many profiles' evidence is fetched at once.
+MERGE_WORKERS = 4
+
+evidence_merged = registry.counter(
+    "civic_chat_evidence_merged_total", "Evidence items merged across molecular profiles, kept or duplicate.",
+    ["outcome"],
+)
+
+_merge_executor: Optional[ThreadPoolExecutor] = None
+_merge_executor_lock = threading.Lock()
+
+
+def _get_merge_executor() -> ThreadPoolExecutor:
+    global _merge_executor
+    with _merge_executor_lock:
+        if _merge_executor is None:
+            _merge_executor = ThreadPoolExecutor(MERGE_WORKERS, thread_name_prefix="evidence")
+        return _merge_executor
+
+
+class EvidenceMerge:
+    """Evidence from several molecular profiles, each item kept once, under the first profile it arrived for."""
+
+    def __init__(self, molecular_profile_ids: List[int]):
+        # Repeated IDs are asked for once, and keep the position they were first given in.
+        self.by_profile: Dict[int, List[dict]] = {i: [] for i in dict.fromkeys(molecular_profile_ids)}
+        self.duplicates = 0
+        # Items fetched, and items CIViC has, for all the profiles, counting an item once for each profile it is in.
+        self.fetched = 0
+        self.total_count = 0
+        self._seen = set()
+
+    @property
+    def truncated(self) -> bool:
+        return self.total_count > self.fetched
+
+    def add(self, molecular_profile_id: int, items: List[dict], total_count: Optional[int] = None) -> List[dict]:
+        """Merge one profile's items, and return the ones not seen before.
+
+        total_count is how many items CIViC has for the profile, when that is more than were fetched.
+        """
+        self.fetched += len(items)
+        self.total_count += total_count if total_count is not None else len(items)
+        new = []
+        for item in items:
+            if item["id"] in self._seen:
+                self.duplicates += 1
+                continue
+            self._seen.add(item["id"])
+            new.append(item)
+        self.by_profile.setdefault(molecular_profile_id, []).extend(new)
+        evidence_merged.inc(len(new), outcome="kept")
+        evidence_merged.inc(len(items) - len(new), outcome="duplicate")
+        return new
+
+    @property
+    def items(self) -> List[dict]:
+        """Every item, grouped by profile in the order the profiles were given."""
+        return [item for items in self.by_profile.values() for item in items]
+
+
+def iter_predictive_evidence(disease_id: int, molecular_profile_ids: List[int], fields: Optional[List[str]] = None,
+                             merge: Optional[EvidenceMerge] = None,
+                             all_pages: bool = False) -> Iterator[Tuple[int, List[dict]]]:
+    """Fetch the evidence of a disease for several profiles at once, and yield (profile ID, new items) as each arrives.
+
+    Items already yielded for another profile are left out, and counted in merge.duplicates.  With all_pages, each
+    profile's evidence is paged through with query_all_predictive_evidence instead of taking its first page.
+    """
+    merge = merge if merge is not None else EvidenceMerge(molecular_profile_ids)
+    profile_ids = list(merge.by_profile)
+
+    def fetch(profile_id: int) -> Tuple[List[dict], Optional[int]]:
+        if all_pages:
+            return query_all_predictive_evidence(disease_id, profile_id, fields)
+        return query_predictive_evidence(disease_id, profile_id, fields), None
+
+    if len(profile_ids) == 1:
+        yield profile_ids[0], merge.add(profile_ids[0], *fetch(profile_ids[0]))
+        return
+    futures = {_get_merge_executor().submit(fetch, profile_id): profile_id for profile_id in profile_ids}
+    try:
+        for future in as_completed(futures):
+            profile_id = futures[future]
+            yield profile_id, merge.add(profile_id, *future.result())
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+def merge_predictive_evidence(disease_id: int, molecular_profile_ids: List[int],
+                              fields: Optional[List[str]] = None, all_pages: bool = False) -> EvidenceMerge:
+    """All the evidence of a disease for several profiles, without duplicates, grouped by profile."""
+    merge = EvidenceMerge(molecular_profile_ids)
+    for _ in iter_predictive_evidence(disease_id, molecular_profile_ids, fields, merge, all_pages):
+        pass
+    return merge
+
+
+@tolerant_tool
+def get_all_disease_mutations(disease_id: int) -> List[dict]:
+    """Search for the list of gene mutations by disease ID, across genes.
+
+    Args:
+        disease_id: The canonical ID of the disease.
+    """
+    all_predictive_mutations = query_predictive_evidence(disease_id)
     return all_predictive_mutations
 
 
-@tool
-def get_disease_predictive_mutations_for_profiles(disease_id_and_gene_molecular_profile_id: str) -> List[dict]:
+@tolerant_tool
+def get_disease_predictive_mutations_for_profiles(disease_id: int, molecular_profile_ids: List[int]) -> List[dict]:
     """Get all predictive mutation evidence in a given disease ID and molecular profile ID from get_disease_id() and get_gene_molecular_profile_ids().
 
     Args:
-        disease_id_and_gene_molecular_profile_id: The numeric ID of a disease in the database from get_disease_id(), then a comma, then one of the molecularProfileID from get_gene_molecular_profiles().
+        disease_id: The numeric ID of a disease in the database from get_disease_id().
+        molecular_profile_ids: A list of the molecular profile IDs from get_gene_molecular_profile_ids().
     """
     # NOTE: In the raw GQL version this is in the examples, but never called.  It leaves out the profile IDs and uses
     # the function above instead.
-    if match := re.match("(\d+),(\d+)", disease_id_and_gene_molecular_profile_id):
-        disease_id = match.group(1)
-        molecular_profile_id = match.group(2)
-        molecular_profile_ids = [molecular_profile_id]
-    elif match := re.match("\((\d+), \[(.*)\]\)", disease_id_and_gene_molecular_profile_id):
-        disease_id = match.group(1)
-        molecular_profile_ids = match.group(2).split(',')
-    else:
-        raise Exception("Bad params!")
+    return merge_predictive_evidence(disease_id, molecular_profile_ids).items
 
-    disease_id = int(disease_id)
 
-    all_predictive_mutations = []
-    for molecular_profile_id in molecular_profile_ids:
-        molecular_profile_id = int(molecular_profile_id)
-        gql = """
-            {
-              evidenceItems(status: ACCEPTED, diseaseId: %d, molecularProfileId: %d, evidenceType: PREDICTIVE) {
-                %s
-              }
-            }
-            """ % (disease_id, molecular_profile_id, EVIDENCE_FIELDS)
-        result = civic_tool._run(tool_input=gql)
-        while isinstance(result, str):
-            result = json.loads(result)
-        predictive_mutations = result["evidenceItems"]["nodes"]
-        all_predictive_mutations.extend(predictive_mutations)
-    return all_predictive_mutations
+@tolerant_tool
+def count_disease_mutations_for_profiles(disease_id: int, molecular_profile_ids: List[int]) -> dict:
+    """Count predictive mutation evidence in a disease ID for molecular profile IDs, in total and by profile, without fetching the evidence.
+    Use this when the question asks how many evidence items there are.
+
+    Args:
+        disease_id: The numeric ID of a disease in the database from get_disease_id().
+        molecular_profile_ids: A list of the molecular profile IDs from get_gene_molecular_profile_ids().
+    """
+    counts = {
+        molecular_profile_id: count_predictive_evidence(disease_id, molecular_profile_id)
+        for molecular_profile_id in dict.fromkeys(molecular_profile_ids)
+    }
+    return {"total": sum(counts.values()), "by_molecular_profile_id": counts}
+
+
+@tolerant_tool
+def get_disease_predictive_mutations_brief_for_profiles(disease_id: int, molecular_profile_ids: List[int],
+                                                        fields: Optional[List[str]] = None) -> Union[List[dict], str]:
+    """Get the id, molecular profile, level, rating, direction and therapies of predictive mutation evidence in a disease ID for molecular profile IDs, without descriptions or sources.
+    Prefer this to get_disease_predictive_mutations_for_profiles() unless the question needs the evidence descriptions or citations.
+
+    Args:
+        disease_id: The numeric ID of a disease in the database from get_disease_id().
+        molecular_profile_ids: A list of the molecular profile IDs from get_gene_molecular_profile_ids().
+        fields: Optional evidence fields to get instead, like ["id", "therapies.name", "source.citationId"].
+    """
+    fields = fields or BRIEF_EVIDENCE_FIELDS
+    try:
+        evidence_paths(fields)
+    except ValueError as e:
+        return str(e)
+    return merge_predictive_evidence(disease_id, molecular_profile_ids, fields=fields).items
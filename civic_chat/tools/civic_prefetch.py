@@ -0,0 +1,205 @@
+import threading
+import time
+import weakref
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from civic_chat.deadline import current_deadline
+from civic_chat.env import PREFETCH
+from civic_chat.metrics import registry
+
+#
+# Speculative prefetch of the evidence the agent is about to ask for.
+#
+# The CIViC tools are used in a predictable order: a disease is resolved, the molecular profiles of a gene are
+# resolved, and then the evidence for the disease, or for the disease and each profile, is fetched.  As soon as a
+# resolution tool returns, the prefetcher starts those evidence queries in the background, so by the time the LLM has
+# written its next step their results are in the tool cache, or on their way.
+#
+# A guess that is not used within PREFETCH_WINDOW seconds counts as wasted.  To keep the waste bounded:
+#   - at most PREFETCH_PROFILES profiles of a gene are prefetched,
+#   - at most PREFETCH_MAX_PENDING guesses can be waiting to be used, and
+#   - a kind of guess that was used less than PREFETCH_MIN_HIT_RATE of the time, once PREFETCH_MIN_SAMPLES of them
+#     were used or wasted, is not made again.
+#
+# The disease and profiles a question resolved are remembered for as long as its Deadline lives, so concurrent
+# questions pair their own disease with their own profiles.
+#
+
+PREFETCH_WORKERS = 4
+PREFETCH_PROFILES = 5
+PREFETCH_MAX_PENDING = 16
+PREFETCH_WINDOW = 120
+PREFETCH_MIN_SAMPLES = 10
+PREFETCH_MIN_HIT_RATE = 0.2
+
+# The kinds of guesses: all the evidence of a disease, and the evidence of a disease for one profile.
+KINDS = ["disease", "profile"]
+
+prefetch_guesses = registry.counter(
+    "civic_chat_prefetch_guesses_total", "Prefetch guesses by kind, as issued, hit, wasted or skipped.",
+    ["kind", "outcome"],
+)
+
+
+class _Session:
+    def __init__(self):
+        self.disease_id: Optional[int] = None
+        self.profile_ids: List[int] = []
+
+
+class Prefetcher:
+    def __init__(self, wrapper=None, enabled: bool = PREFETCH, workers: int = PREFETCH_WORKERS):
+        self.wrapper = wrapper
+        self.enabled = enabled
+        self.workers = workers
+        self.issued: Dict[str, int] = defaultdict(int)
+        self.hits: Dict[str, int] = defaultdict(int)
+        self.wasted: Dict[str, int] = defaultdict(int)
+        self.skipped = 0
+        # Cache keys of guesses not yet used, to their kind and when they were made.
+        self._pending: Dict[str, Tuple[str, float]] = {}
+        self._sessions = weakref.WeakKeyDictionary()
+        self._default_session = _Session()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _get_wrapper(self):
+        if self.wrapper is not None:
+            return self.wrapper
+        from .civic_db_gql import civic_tool
+        return civic_tool.graphql_wrapper
+
+    def _session(self) -> _Session:
+        deadline = current_deadline.get()
+        if deadline is None:
+            return self._default_session
+        with self._lock:
+            return self._sessions.setdefault(deadline, _Session())
+
+    def disease_resolved(self, disease_id: int):
+        if not self.enabled:
+            return
+        session = self._session()
+        session.disease_id = disease_id
+        if session.profile_ids:
+            self._prefetch_profiles(disease_id, session.profile_ids)
+        else:
+            self._prefetch("disease", disease_id, None)
+
+    def profiles_resolved(self, profile_ids: List[int]):
+        if not self.enabled:
+            return
+        session = self._session()
+        session.profile_ids = list(profile_ids)
+        if session.disease_id is not None:
+            self._prefetch_profiles(session.disease_id, session.profile_ids)
+
+    def _prefetch_profiles(self, disease_id: int, profile_ids: List[int]):
+        for profile_id in profile_ids[:PREFETCH_PROFILES]:
+            self._prefetch("profile", disease_id, profile_id)
+
+    def _expire(self, now: float):
+        for key, (kind, issued_at) in list(self._pending.items()):
+            if now - issued_at > PREFETCH_WINDOW:
+                del self._pending[key]
+                self.wasted[kind] += 1
+                prefetch_guesses.inc(kind=kind, outcome="wasted")
+
+    def hit_rate(self, kind: Optional[str] = None) -> float:
+        kinds = [kind] if kind else KINDS
+        hits = sum(self.hits[k] for k in kinds)
+        settled = hits + sum(self.wasted[k] for k in kinds)
+        return hits / settled if settled else 0.0
+
+    def _worth_it(self, kind: str) -> bool:
+        settled = self.hits[kind] + self.wasted[kind]
+        return settled < PREFETCH_MIN_SAMPLES or self.hit_rate(kind) >= PREFETCH_MIN_HIT_RATE
+
+    def _prefetch(self, kind: str, disease_id: int, profile_id: Optional[int]):
+        from .civic_mutation_evidence import EVIDENCE_FIELDS, _predictive_evidence_query
+
+        wrapper = self._get_wrapper()
+        # Without a cache there is nowhere to keep a guess, and a cassette must only see the requests the agent makes.
+        if wrapper.cache is None or wrapper.cassette is not None:
+            return
+        query = _predictive_evidence_query(disease_id, profile_id, EVIDENCE_FIELDS)
+        key = wrapper._cache_key(wrapper._normalize_query(query))
+        with self._lock:
+            now = time.time()
+            self._expire(now)
+            if key in self._pending or wrapper.cache.get(key) is not None:
+                return
+            if len(self._pending) >= PREFETCH_MAX_PENDING or not self._worth_it(kind):
+                self.skipped += 1
+                prefetch_guesses.inc(kind=kind, outcome="skipped")
+                return
+            self._pending[key] = (kind, now)
+            self.issued[kind] += 1
+            prefetch_guesses.inc(kind=kind, outcome="issued")
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="prefetch")
+        wrapper.prefetcher = self
+        self._executor.submit(self._fetch, wrapper, key, query)
+
+    @staticmethod
+    def _fetch(wrapper, key: str, query: str):
+        # Through the single flight, so a tool asking meanwhile waits for this request instead of making its own, but
+        # not through _execute_query, which would count the guess as used.
+        if wrapper.cache.get(key) is not None:
+            return
+        try:
+            wrapper.single_flight.do(key, lambda: wrapper._fetch_and_cache(key, query))
+        except Exception:
+            # A failed guess costs nothing more; the tool will make the request itself and see the error.
+            pass
+
+    def pending(self, key: str) -> bool:
+        """Whether a guess was made for the cache key and not used yet."""
+        with self._lock:
+            return key in self._pending
+
+    def claim(self, key: str):
+        """Called by the GraphQL wrapper for every query, to count the ones a guess was made for."""
+        with self._lock:
+            entry = self._pending.pop(key, None)
+            if entry is not None:
+                self.hits[entry[0]] += 1
+                prefetch_guesses.inc(kind=entry[0], outcome="hit")
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._expire(time.time())
+            return {
+                "issued": sum(self.issued.values()),
+                "hits": sum(self.hits.values()),
+                "wasted": sum(self.wasted.values()),
+                "pending": len(self._pending),
+                "skipped": self.skipped,
+                "hit_rate": round(self.hit_rate(), 3),
+                "by_kind": {
+                    kind: {"issued": self.issued[kind], "hits": self.hits[kind], "wasted": self.wasted[kind]}
+                    for kind in KINDS
+                },
+            }
+
+    def __str__(self):
+        stats = self.stats()
+        return (
+            f"{stats['issued']} issued, {stats['hits']} hits, {stats['wasted']} wasted, {stats['pending']} pending, "
+            f"{stats['skipped']} skipped, hit rate {stats['hit_rate']:.0%}"
+        )
+
+    def reset(self):
+        with self._lock:
+            self.issued.clear()
+            self.hits.clear()
+            self.wasted.clear()
+            self.skipped = 0
+            self._pending.clear()
+            self._sessions.clear()
+            self._default_session = _Session()
+
+
+prefetcher = Prefetcher()
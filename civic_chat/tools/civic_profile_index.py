@@ -0,0 +1,182 @@
+import bisect
+import difflib
+import re
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from civic_chat.env import CACHE_TTL
+from ._local_index import LocalIndexSource
+
+#
+# Molecular profiles by gene symbol and variant name, held in memory, so finding the profiles for "KRAS" or
+# "KRAS G12" is a dictionary lookup and a binary search rather than a query to CIViC.
+#
+# Without a local copy of CIViC, each gene is fetched once, every page of it, and kept for CACHE_TTL.  A symbol CIViC
+# has no profiles for, like a misspelled "KRSA", is resolved against the listing of gene names, fetched through the
+# tool cache, and the closest gene is fetched instead.
+#
+
+# Only the name is needed to index a profile, or to resolve a gene.
+PROFILE_NAME_FIELDS = """
+    pageInfo {
+      hasNextPage
+      endCursor
+    }
+    nodes {
+      id
+      name
+    }
+"""
+
+# How close a misspelled gene or variant has to be to count as a match, from 0 to 1.
+FUZZY_CUTOFF = 0.75
+
+# Combination profiles, like "BRAF V600E AND MAP2K1 K57N", are indexed under each of their genes.
+_COMBINATION = re.compile(r"\s+(?:AND|OR)\s+", re.IGNORECASE)
+
+
+def parse_profile_name(name: str) -> List[Tuple[str, str]]:
+    """Split a profile name into (gene, variant) pairs, upper-cased, like [("KRAS", "G12C")] for "KRAS G12C"."""
+    pairs = []
+    for part in _COMBINATION.split(name.strip()):
+        part = re.sub(r"^NOT\s+", "", part.strip(), flags=re.IGNORECASE)
+        gene, _, variant = part.partition(" ")
+        if gene:
+            pairs.append((gene.upper(), variant.strip().upper()))
+    return pairs
+
+
+def _parse_query(query: str) -> Tuple[str, str]:
+    gene, _, variant = query.replace('"', "").strip().upper().partition(" ")
+    # "KRAS p.G12C" means the same as "KRAS G12C".
+    return gene, re.sub(r"^P\.", "", variant.strip())
+
+
+class MolecularProfileIndex:
+    def __init__(self, profiles: Iterable[dict] = ()):
+        self.names: Dict[int, str] = {}
+        # Gene to its (variant, profile ID) pairs, sorted by variant for prefix search.
+        self._variants: Dict[str, List[Tuple[str, int]]] = {}
+        self.add(profiles)
+
+    def add(self, profiles: Iterable[dict]):
+        for profile in profiles:
+            if profile["id"] in self.names:
+                continue
+            self.names[profile["id"]] = profile["name"]
+            for gene, variant in parse_profile_name(profile["name"]):
+                bisect.insort(self._variants.setdefault(gene, []), (variant, profile["id"]))
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, gene: str) -> bool:
+        return gene.upper() in self._variants
+
+    @property
+    def genes(self) -> List[str]:
+        return list(self._variants)
+
+    def resolve_gene(self, gene: str) -> Optional[str]:
+        """The indexed gene symbol closest to a possibly misspelled one."""
+        gene = gene.upper()
+        if gene in self._variants:
+            return gene
+        matches = difflib.get_close_matches(gene, self._variants, n=1, cutoff=FUZZY_CUTOFF)
+        return matches[0] if matches else None
+
+    def lookup(self, query: str) -> List[int]:
+        """Profile IDs for a gene symbol, optionally followed by a variant or the start of one, like "KRAS G12".
+
+        A variant matches by prefix first, and by similarity when nothing starts with it.
+        """
+        gene, variant = _parse_query(query)
+        gene = self.resolve_gene(gene)
+        if gene is None:
+            return []
+        variants = self._variants[gene]
+        if not variant:
+            return sorted({profile_id for _, profile_id in variants})
+        start = bisect.bisect_left(variants, (variant,))
+        ids = []
+        for name, profile_id in variants[start:]:
+            if not name.startswith(variant):
+                break
+            ids.append(profile_id)
+        if not ids:
+            close = set(difflib.get_close_matches(variant, [name for name, _ in variants], n=5, cutoff=FUZZY_CUTOFF))
+            ids = [profile_id for name, profile_id in variants if name in close]
+        return sorted(set(ids))
+
+
+class ProfileIndexSource(LocalIndexSource):
+    """Keeps a MolecularProfileIndex current from the local store, or fills it a gene at a time from CIViC."""
+
+    entity = "molecular_profiles"
+
+    def __init__(self, store=None, wrapper=None):
+        super().__init__(store, wrapper)
+        self._fetched_genes: Dict[str, float] = {}
+        self._gene_names: List[str] = []
+        self._gene_names_at: Optional[float] = None
+
+    def build(self, records: Iterable[dict]) -> MolecularProfileIndex:
+        return MolecularProfileIndex(records)
+
+    def _fetch_profiles(self, gene: str) -> List[dict]:
+        from civic_chat.sync import iter_pages
+
+        profiles = []
+        for nodes, _, _ in iter_pages(self._get_wrapper(), "molecularProfiles", 'name: "%s"' % gene,
+                                      PROFILE_NAME_FIELDS, cached=True):
+            profiles += nodes
+        return profiles
+
+    def _resolve_remote_gene(self, gene: str) -> Optional[str]:
+        from civic_chat.sync import iter_pages
+
+        with self._lock:
+            names = self._gene_names
+            fresh = self._gene_names_at is not None and time.time() - self._gene_names_at < CACHE_TTL
+        if not fresh:
+            names = []
+            for nodes, _, _ in iter_pages(self._get_wrapper(), "genes", "", PROFILE_NAME_FIELDS, cached=True):
+                names += [node["name"].upper() for node in nodes]
+            with self._lock:
+                self._gene_names, self._gene_names_at = names, time.time()
+        matches = difflib.get_close_matches(gene, names, n=1, cutoff=FUZZY_CUTOFF)
+        return matches[0] if matches else None
+
+    def _fetch_gene(self, gene: str):
+        # The requests go out without the lock, so a slow gene does not hold up lookups of the others.
+        with self._lock:
+            fetched_at = self._fetched_genes.get(gene)
+        if fetched_at is not None and time.time() - fetched_at < CACHE_TTL:
+            return
+        profiles = self._fetch_profiles(gene)
+        if not any(gene == name for profile in profiles for name, _ in parse_profile_name(profile["name"])):
+            resolved = self._resolve_remote_gene(gene)
+            if resolved is not None and resolved != gene:
+                profiles += self._fetch_profiles(resolved)
+        with self._lock:
+            self.index.add(profiles)
+            self._fetched_genes[gene] = time.time()
+
+    def clear(self):
+        with self._lock:
+            super().clear()
+            self._fetched_genes.clear()
+            self._gene_names, self._gene_names_at = [], None
+
+    def lookup(self, query: str) -> List[int]:
+        with self._lock:
+            self.refresh()
+            from_store = self.from_store
+        if not from_store:
+            gene, _ = _parse_query(query)
+            self._fetch_gene(gene)
+        with self._lock:
+            return self.index.lookup(query)
+
+
+profile_index_source = ProfileIndexSource()
@@ -1,5 +1,12 @@
+import json
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional
+from urllib.parse import urlsplit
+
 from langchain.agents import Tool
-from langchain_community.tools import DuckDuckGoSearchRun
+
+from civic_chat.cache import ToolCache
 
 #
 # This tool does web searches, which allows it to get content that is time relevant.
@@ -7,7 +14,105 @@ from langchain_community.tools import DuckDuckGoSearchRun
 # This means a toy example passes tests b/c of this shortcut, but a critical question requiring DB knowledge might fail.
 #
 
-duckduckgo = DuckDuckGoSearchRun()
+# Agents often search for nearly the same thing several times in a row, so results are cached on a normalized
+# query for a while.  Several queries can be given at once, and are run concurrently.
+SEARCH_CACHE_TTL = 60 * 60
+SEARCH_MAX_RESULTS = 5
+SEARCH_MAX_TOKENS = 800
+SEARCH_WORKERS = 4
+
+STOP_WORDS = {"a", "an", "and", "the", "of", "in", "on", "for", "to", "with", "is", "are", "what", "which"}
+
+
+def normalize_query(query: str) -> str:
+    # Case, punctuation, word order and filler words rarely change what a search engine returns.
+    words = {word for word in re.findall(r"\w+", query.lower()) if word not in STOP_WORDS}
+    return " ".join(sorted(words))
+
+
+def normalize_url(url: str) -> str:
+    parts = urlsplit(url)
+    host = parts.netloc.lower()
+    if host.startswith("www."):
+        host = host[4:]
+    return host + parts.path.rstrip("/") + ("?" + parts.query if parts.query else "")
+
+
+def count_tokens(text: str) -> int:
+    # About four characters per token for English text, which is close enough for a budget.
+    return (len(text) + 3) // 4
+
+
+def duckduckgo_backend(query: str, max_results: int) -> List[dict]:
+    from langchain_community.utilities import DuckDuckGoSearchAPIWrapper
+    return DuckDuckGoSearchAPIWrapper().results(query, max_results)
+
+
+class CachedSearch:
+    """Runs one or more queries against a search backend, with caching and deduplication of the results.
+
+    The backend takes a query and a result count and returns dicts with "title", "snippet" and "link".
+    """
+
+    def __init__(self, backend: Callable[[str, int], List[dict]] = duckduckgo_backend,
+                 cache: Optional[ToolCache] = None, max_results: int = SEARCH_MAX_RESULTS,
+                 max_tokens: int = SEARCH_MAX_TOKENS, workers: int = SEARCH_WORKERS):
+        self.backend = backend
+        self.cache = cache if cache is not None else ToolCache(ttl=SEARCH_CACHE_TTL)
+        self.max_results = max_results
+        self.max_tokens = max_tokens
+        self.workers = workers
+
+    def search(self, query: str) -> List[dict]:
+        key = normalize_query(query)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return json.loads(cached)
+        results = self.backend(query, self.max_results)
+        self.cache.set(key, json.dumps(results))
+        return results
+
+    def run(self, queries: str) -> str:
+        # Identical queries after normalization are only searched once.
+        unique = {}
+        for query in re.split(r"[;\n]", queries):
+            if query.strip() and normalize_query(query) not in unique:
+                unique[normalize_query(query)] = query.strip()
+        if not unique:
+            return "No search query given."
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(unique))) as pool:
+            result_lists = list(pool.map(self.search, unique.values()))
+        return self.digest(result_lists)
+
+    def digest(self, result_lists: List[List[dict]]) -> str:
+        """Interleave the results of each query, best first, dropping repeated URLs, until the token budget is spent."""
+        seen = set()
+        lines = []
+        tokens = 0
+        for rank in range(max((len(results) for results in result_lists), default=0)):
+            for results in result_lists:
+                if rank >= len(results):
+                    continue
+                result = results[rank]
+                # Results without a link are told apart by what they say instead.
+                link = result.get("link")
+                key = normalize_url(link) if link else (result.get("title", ""), result.get("snippet", ""))
+                if key in seen:
+                    continue
+                seen.add(key)
+                line = "%s: %s (%s)" % (result.get("title", ""), result.get("snippet", ""), link or "")
+                line_tokens = count_tokens(line)
+                if tokens + line_tokens > self.max_tokens:
+                    if not lines:
+                        # Even the best result is over the budget, so it is cut short rather than left out.
+                        lines.append(line[:self.max_tokens * 4 - 3] + "...")
+                    return "\n".join(lines)
+                lines.append(line)
+                tokens += line_tokens
+        return "\n".join(lines) if lines else "No good search results found."
+
+
+duckduckgo = CachedSearch()
 
 duckduckgo_tool = Tool(
     name='DuckDuckGo Search',
@@ -15,8 +120,6 @@ duckduckgo_tool = Tool(
     description='''
     A wrapper around DuckDuckGo Search.
     Useful for when you need to answer questions about current events.
-    Input should be a search query.
+    Input should be a search query, or several search queries separated by semicolons.
     '''
 )
-
-
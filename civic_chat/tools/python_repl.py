@@ -1,13 +1,231 @@
-from langchain_experimental.tools.python.tool import PythonAstREPLTool
+import ast
+import contextlib
+import io
+import multiprocessing
+import os
+import resource
+import threading
+from multiprocessing import resource_tracker
+from typing import Dict, Hashable, List, Optional, Tuple
+
 from langchain.agents import Tool
+from langchain_experimental.tools.python.tool import sanitize_input
+
+from civic_chat.deadline import Deadline, current_deadline
+from civic_chat.session import FrameSegment, attach_frame, session_frames
 
 # A tool to run arbitrary Python code handles a ton of symbolic reasoning,
 # including math and procedures that center around math, table manipulation, etc.
 
-# In theory it has constraints to sandbox it, but this should be removed in production
-# and replace w/ explicit tools with a more narrow scope.
+# The code runs in pre-forked worker processes with CPU, memory and wall-clock limits, so a runaway loop or a huge
+# allocation costs one worker, which is replaced, rather than blocking or killing the agent.
+# It should still be replaced in production with explicit tools with a more narrow scope.
+
+# Evidence fetched by the tools in this session is preloaded into each worker from shared memory, as `frames`
+# (a DataFrame per tool result, by name, whose columns are the shared memory) and `evidence` (all of them together).
+
+# A session is the question being answered, by its Deadline, and its worker is killed when the question ends, so
+# variables never carry over from one user's question to another's.
+
+REPL_TIMEOUT = 30            # wall-clock seconds per call
+REPL_CPU_SECONDS = 20        # CPU seconds per call
+REPL_MEMORY_MB = 2048        # address space a worker may grow by
+REPL_MAX_OUTPUT = 4000       # characters of output handed back to the LLM
+REPL_SPARES = 1              # idle workers kept forked and ready
+
+
+def _limit_memory(memory_mb: int):
+    # The worker inherits the fork server's address space, so the limit is on growth beyond what it starts with.
+    # Without /proc there is no measure of that, and macOS does not enforce RLIMIT_AS anyway, so off Linux only the
+    # CPU and wall-clock limits apply.
+    try:
+        with open("/proc/self/statm") as f:
+            size = int(f.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return
+    limit = size + memory_mb * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _limit_cpu(cpu_seconds: int):
+    # RLIMIT_CPU counts the whole life of the process, so each call moves the limit to what it has used so far plus
+    # the allowance.  Going over sends SIGXCPU, which ends the worker.
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    limit = int(usage.ru_utime + usage.ru_stime) + cpu_seconds
+    resource.setrlimit(resource.RLIMIT_CPU, (limit, resource.RLIM_INFINITY))
+
+
+def _load_frames(namespace: dict, attached: Dict[str, tuple], manifest: Dict[str, FrameSegment]):
+    # Each result is unpickled once, when it is first published or replaced, and kept for the later calls.
+    try:
+        import pandas as pd
+    except ImportError:
+        pd = None
+
+    frames = namespace.setdefault("frames", {})
+    changed = False
+    for name in list(attached):
+        if manifest.get(name, (None,))[0] != attached[name][0]:
+            frames.pop(name, None)
+            try:
+                attached.pop(name)[1].close()
+            except BufferError:
+                # The code kept a column of it in a variable, so the mapping stays until the worker ends.
+                pass
+            changed = True
+    for name, segment in manifest.items():
+        if name in attached:
+            continue
+        shm, frames[name] = attach_frame(segment)
+        attached[name] = (segment[0], shm)
+        changed = True
+    if changed or "evidence" not in namespace:
+        if pd is not None:
+            namespace["evidence"] = (
+                pd.concat(list(frames.values()), keys=list(frames), names=["frame"]).reset_index(level=0)
+                if frames else pd.DataFrame()
+            )
+        else:
+            namespace["evidence"] = [row for rows in frames.values() for row in rows]
+
+
+def _run_code(code: str, namespace: dict) -> str:
+    # Like the AST REPL: run every statement, and show the value of the last one if it is an expression.
+    output = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(output):
+            tree = ast.parse(sanitize_input(code))
+            last = tree.body[-1] if tree.body and isinstance(tree.body[-1], ast.Expr) else None
+            body = tree.body[:-1] if last is not None else tree.body
+            exec(compile(ast.Module(body=body, type_ignores=[]), "<repl>", "exec"), namespace)
+            if last is not None:
+                value = eval(compile(ast.Expression(body=last.value), "<repl>", "eval"), namespace)
+                if value is not None:
+                    print(repr(value))
+    except MemoryError:
+        output.write("MemoryError: the code went over the memory limit of the Python REPL.")
+    except Exception as e:
+        output.write("%s: %s" % (type(e).__name__, e))
+    return output.getvalue()
+
+
+def _worker_main(conn, cpu_seconds: int, memory_mb: int):
+    _limit_memory(memory_mb)
+    namespace = {"__name__": "__repl__"}
+    attached = {}
+    while True:
+        message = conn.recv()
+        if message is None:
+            return
+        code, manifest = message
+        _limit_cpu(cpu_seconds)
+        try:
+            _load_frames(namespace, attached, manifest)
+            result = _run_code(code, namespace)
+        except MemoryError:
+            result = "MemoryError: the session evidence does not fit in the memory limit of the Python REPL."
+        conn.send(result[:REPL_MAX_OUTPUT])
+
+
+class _Worker:
+    def __init__(self, context, cpu_seconds: int, memory_mb: int):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child_conn, cpu_seconds, memory_mb), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.lock = threading.Lock()
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+class PythonReplPool:
+    """Pre-forked Python workers.  Each session is bound to one worker, so its variables persist between calls."""
+
+    def __init__(self, spares: int = REPL_SPARES, timeout: float = REPL_TIMEOUT,
+                 cpu_seconds: int = REPL_CPU_SECONDS, memory_mb: int = REPL_MEMORY_MB):
+        self.spares = spares
+        self.timeout = timeout
+        self.cpu_seconds = cpu_seconds
+        self.memory_mb = memory_mb
+        # Workers are forked by a fork server, which is cheap, since it has pandas and this module imported already, and
+        # safe once the agent has threads running, which forking the agent itself would not be.
+        self._context = multiprocessing.get_context("forkserver")
+        self._context.set_forkserver_preload(["pandas", __name__])
+        self._idle: List[_Worker] = []
+        self._bound: Dict[str, _Worker] = {}
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start the fork server and the spare workers, so the first call does not wait for them."""
+        # Start the resource tracker first, so workers share it instead of each starting one of their own, which
+        # would unlink the session's shared memory whenever a worker is killed.
+        resource_tracker.ensure_running()
+        self._fill_spares()
+
+    def _fill_spares(self):
+        with self._lock:
+            while len(self._idle) < self.spares:
+                self._idle.append(_Worker(self._context, self.cpu_seconds, self.memory_mb))
+
+    def _checkout(self, session: Hashable) -> _Worker:
+        with self._lock:
+            worker = self._bound.get(session)
+            new = worker is None
+            if new:
+                worker = self._idle.pop() if self._idle else _Worker(self._context, self.cpu_seconds, self.memory_mb)
+                self._bound[session] = worker
+        if new and isinstance(session, Deadline):
+            session.on_exit(lambda: self.release(session))
+        if new:
+            self._fill_spares()
+        return worker
+
+    def _discard(self, session: Hashable, worker: _Worker):
+        with self._lock:
+            if self._bound.get(session) is worker:
+                del self._bound[session]
+        worker.kill()
+        self._fill_spares()
+
+    def release(self, session: Hashable):
+        """Kill the worker of a session that is over, with its variables."""
+        with self._lock:
+            worker = self._bound.pop(session, None)
+        if worker is not None:
+            # Not under the worker's lock: a call abandoned at the deadline may still hold it.
+            worker.kill()
+
+    def run(self, code: str, session: Optional[Hashable] = None) -> str:
+        """Run code in the worker of a session, by default the question being answered."""
+        if session is None:
+            session = current_deadline.get() or "default"
+        worker = self._checkout(session)
+        with worker.lock:
+            try:
+                worker.conn.send((code, session_frames.manifest()))
+                if worker.conn.poll(self.timeout):
+                    return worker.conn.recv()
+                failure = "TimeoutError: the code ran for more than %ss and was stopped." % self.timeout
+            except (EOFError, BrokenPipeError, ConnectionResetError):
+                failure = "Error: the Python REPL worker was stopped, most likely for going over its CPU limit of %ss." % (
+                    self.cpu_seconds
+                )
+        # The worker is gone or stuck, so its variables are lost with it.
+        self._discard(session, worker)
+        return failure + " Variables from earlier calls are no longer defined."
+
+    def close(self):
+        with self._lock:
+            workers = self._idle + list(self._bound.values())
+            self._idle, self._bound = [], {}
+        for worker in workers:
+            worker.kill()
+
 
-python_repl = PythonAstREPLTool()
+python_repl = PythonReplPool()
 
 python_repl_tool = Tool(
     name='Python REPL',
@@ -15,6 +233,9 @@ python_repl_tool = Tool(
     description='''
     A Python shell. Use this to execute python commands.
     Input should be a valid python command.
+    The evidence fetched by the other tools in this session is already loaded: `frames` is a dict of pandas
+    DataFrames by result name, and `evidence` is all of them together with a "frame" column.
+    Analyse those instead of copying data into the code.
     When using this tool, sometimes output is abbreviated - make sure
     it does not look abbreviated before using it in your answer.
     ''',
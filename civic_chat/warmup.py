@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+
+"""
+Pre-resolve popular genes and diseases and pre-fetch their evidence, so interactive sessions start with a warm cache.
+
+Run it before business hours, for example:
+    python -m civic_chat.warmup KRAS BRAF EGFR --disease "Colorectal Cancer" --disease "Melanoma"
+    python -m civic_chat.warmup --dump nightly-ClinicalEvidenceSummaries.tsv --top-n 25
+"""
+
+import csv
+import multiprocessing
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import List, Tuple
+
+import typer
+
+from civic_chat.env import CACHE_FILE
+
+
+class SharedRateLimiter:
+    # Spaces requests evenly across every worker process, so the pool as a whole stays under the rate.
+    def __init__(self, requests_per_second: float):
+        self.interval = 1.0 / requests_per_second
+        self.next_slot = multiprocessing.Value("d", 0.0)
+
+    def __call__(self):
+        with self.next_slot.get_lock():
+            now = time.time()
+            slot = max(now, self.next_slot.value)
+            self.next_slot.value = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def _init_worker(rate_limiter: SharedRateLimiter):
+    from civic_chat.tools.civic_db_gql import civic_tool
+    from civic_chat.tools.civic_prefetch import prefetcher
+
+    # The wrapper the tools use, which is not the default one when they were pointed elsewhere.
+    civic_tool.graphql_wrapper.rate_limiter = rate_limiter
+    # The tasks fetch exactly what a prefetch would guess, so guessing too would only spend the rate on repeats.
+    prefetcher.enabled = False
+
+
+def _warm(task: Tuple[str, str], disease_ids: List[int]) -> Tuple[Tuple[str, str], list, str]:
+    # Runs in a worker.  The worker's cache holds what earlier warm-ups saved, which the task is answered from rather
+    # than fetching it again, and only the entries the task added are sent back to be merged into the parent's cache.
+    from civic_chat.cache import tool_cache
+    from civic_chat.tools.civic_disease import get_disease_id
+    from civic_chat.tools.civic_mutation import get_gene_molecular_profile_ids
+    from civic_chat.tools.civic_mutation_evidence import query_predictive_evidence
+
+    before = dict(tool_cache.items())
+
+    def added():
+        return [(key, entry) for key, entry in tool_cache.items() if before.get(key) != entry]
+
+    kind, name = task
+    try:
+        if kind == "disease":
+            disease_id = get_disease_id.func(name)
+            if disease_id is None:
+                return task, added(), "not found"
+            query_predictive_evidence(int(disease_id))
+            return task, added(), str(disease_id)
+        else:
+            molecular_profile_ids = get_gene_molecular_profile_ids.func(name)
+            for disease_id in disease_ids:
+                for molecular_profile_id in molecular_profile_ids:
+                    query_predictive_evidence(disease_id, int(molecular_profile_id))
+            return task, added(), "%d profiles" % len(molecular_profile_ids)
+    except Exception as e:
+        return task, added(), "error: %s" % e
+
+
+def top_n_from_dump(dump_path: str, n: int) -> Tuple[List[str], List[str]]:
+    """Find the most frequent genes and diseases in a CIViC evidence summary TSV download."""
+    genes = Counter()
+    diseases = Counter()
+    with open(dump_path, newline="") as f:
+        for row in csv.DictReader(f, delimiter="\t"):
+            # Older dumps have a gene column, newer ones only name the molecular profile, which starts with the gene.
+            gene = row.get("gene") or (row.get("molecular_profile") or "").split(" ")[0]
+            if gene:
+                genes[gene] += 1
+            if row.get("disease"):
+                diseases[row["disease"]] += 1
+    return [g for g, _ in genes.most_common(n)], [d for d, _ in diseases.most_common(n)]
+
+
+def _run_pool(tasks: List[Tuple[str, str]], disease_ids: List[int], workers: int, rate_limiter: SharedRateLimiter):
+    from civic_chat.cache import tool_cache
+
+    results = {}
+    t0 = time.time()
+    queries = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(rate_limiter,)) as pool:
+        futures = [pool.submit(_warm, task, disease_ids) for task in tasks]
+        for done, future in enumerate(as_completed(futures), start=1):
+            task, entries, outcome = future.result()
+            tool_cache.update(entries)
+            results[task] = outcome
+            queries += len(entries)
+            elapsed = time.time() - t0
+            print(
+                f"[{done}/{len(tasks)}] {task[0]} {task[1]!r}: {outcome}, {len(entries)} queries "
+                f"({done / elapsed:.2f} tasks/s, {queries / elapsed:.2f} queries/s)"
+            )
+    return results
+
+
+def warmup(
+    genes: List[str] = typer.Argument(None, help="Gene symbols to pre-resolve."),
+    disease: List[str] = typer.Option([], help="Disease names to pre-resolve, may be repeated."),
+    dump: str = typer.Option(None, help="A CIViC evidence summary TSV to pick the most popular genes and diseases from."),
+    top_n: int = typer.Option(20, help="How many genes and diseases to take from the dump."),
+    workers: int = typer.Option(4, help="Worker processes."),
+    rate: float = typer.Option(5.0, help="Maximum GraphQL requests per second across all workers."),
+):
+    """ Resolve diseases, then genes and their per-disease evidence, and save everything to the tool cache.
+    The cache is saved to CIVIC_CHAT_CACHE_FILE, which is where every session loads it from.
+    """
+    from civic_chat.cache import tool_cache
+
+    genes = list(genes or [])
+    diseases = list(disease)
+    if dump:
+        dump_genes, dump_diseases = top_n_from_dump(dump, top_n)
+        genes += [g for g in dump_genes if g not in genes]
+        diseases += [d for d in dump_diseases if d not in diseases]
+
+    t0 = time.time()
+    rate_limiter = SharedRateLimiter(rate)
+
+    # Diseases go first, since the per-profile evidence queries for the genes need their IDs.
+    disease_results = _run_pool([("disease", d) for d in diseases], [], workers, rate_limiter)
+    disease_ids = [int(outcome) for outcome in disease_results.values() if outcome.isdigit()]
+    _run_pool([("gene", g) for g in genes], disease_ids, workers, rate_limiter)
+
+    tool_cache.save(CACHE_FILE)
+    print(f"warmed {len(diseases)} diseases and {len(genes)} genes into {len(tool_cache)} cache entries "
+          f"in {time.time() - t0:.1f}s, saved to {CACHE_FILE}")
+
+
+if __name__ == "__main__":
+    typer.run(warmup)